@@ -1,129 +1,91 @@
-import json
 import os
-import psycopg2
+import api
+import db
+import passwords
+import session
 from typing import Dict, Any
 
+def check_session(request: api.Request) -> Dict[str, Any]:
+    token = session.token_from_event(request.event)
+    if not token:
+        raise session.SessionError(401, 'Требуется авторизация')
+    claims = session.verify(token)
+    return api.json_response({
+        'success': True,
+        'user': {
+            'id': claims['sub'],
+            'login': claims['login'],
+            'admin': claims['admin'],
+            'operator': claims['operator']
+        },
+        'expires_at': claims['exp']
+    })
+
+def login(request: api.Request) -> Dict[str, Any]:
+    body_data = request.json
+    login = body_data.get('login', '').strip()
+    password = body_data.get('password', '').strip()
+
+    if not login or not password:
+        raise api.HttpError(400, 'Логин и пароль обязательны')
+
+    if not os.environ.get('DATABASE_URL'):
+        raise api.HttpError(500, 'Database configuration error')
+
+    user = None
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, name, admin, operator, password FROM clients WHERE login = %s",
+                (login,)
+            )
+            row = cursor.fetchone()
+            if row:
+                valid, needs_rehash = passwords.verify_password(login, password, row[4] or '')
+                if valid:
+                    user = row[:4]
+                if valid and needs_rehash:
+                    # Старый открытый пароль или хеш с меньшей стоимостью: заменяем при входе;
+                    # условие по старому значению не затирает параллельную смену пароля
+                    cursor.execute(
+                        "UPDATE clients SET password = %s WHERE id = %s AND password = %s",
+                        (passwords.hash_password(password), row[0], row[4])
+                    )
+                    conn.commit()
+
+    if not user:
+        raise api.HttpError(401, 'Неверный логин или пароль')
+
+    user_id, user_name, is_admin, is_operator = user
+    issued = session.issue(user_id, login, is_admin, bool(is_operator))
+    return api.json_response({
+        'success': True,
+        'user': {
+            'id': user_id,
+            'name': user_name,
+            'login': login,
+            'admin': is_admin,
+            'operator': bool(is_operator)
+        },
+        'token': issued[0] if issued else None,
+        'expires_at': issued[1] if issued else None
+    })
+
+router = api.Router(
+    {'GET': check_session, 'POST': login},
+    allow_headers=('Content-Type', 'X-Auth-Token', 'Authorization'),
+    default_method='POST',
+    requires_database=False,
+    error_prefix='Server error: '
+)
+
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Авторизация пользователя: проверка логина и пароля в базе данных
-    Args: event - dict с httpMethod, body (login, password)
+    Авторизация пользователя: проверка логина и хеша пароля (PBKDF2), выдача токена сессии.
+    GET с заголовком X-Auth-Token — проверка токена без обращения к БД
+    Args: event - dict с httpMethod, body (login, password), headers
           context - объект с атрибутами request_id, function_name
     Returns: HTTP response с результатом авторизации
     '''
-    method: str = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        body_data = json.loads(event.get('body', '{}'))
-        login = body_data.get('login', '').strip()
-        password = body_data.get('password', '').strip()
-        
-        if not login or not password:
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Логин и пароль обязательны'}),
-                'isBase64Encoded': False
-            }
-        
-        database_url = os.environ.get('DATABASE_URL')
-        if not database_url:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Database configuration error'}),
-                'isBase64Encoded': False
-            }
-        
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "SELECT id, name, admin, operator FROM clients WHERE login = %s AND password = %s",
-            (login, password)
-        )
-        
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if user:
-            user_id, user_name, is_admin, is_operator = user
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({
-                    'success': True,
-                    'user': {
-                        'id': user_id,
-                        'name': user_name,
-                        'login': login,
-                        'admin': is_admin,
-                        'operator': bool(is_operator)
-                    }
-                }),
-                'isBase64Encoded': False
-            }
-        else:
-            return {
-                'statusCode': 401,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Неверный логин или пароль'}),
-                'isBase64Encoded': False
-            }
-    
-    except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Invalid JSON'}),
-            'isBase64Encoded': False
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+    return router(event, context)
@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+# Пароли хранятся как pbkdf2_sha256$<итерации>$<соль>$<хеш>. Стоимость задается
+# PASSWORD_HASH_ITERATIONS; записи с меньшим числом итераций и старые открытые пароли
+# перехешируются при следующем успешном входе
+HASH_ALGORITHM = 'pbkdf2_sha256'
+HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '260000'))
+SALT_BYTES = 16
+
+# Кэш успешных проверок: повторный вход (ярлык оператора, повторное подтверждение)
+# в пределах PASSWORD_CACHE_TTL не считает KDF заново. Ключ — HMAC со случайным ключом
+# процесса от логина, пароля и сохраненного хеша: открытый пароль в памяти не хранится,
+# а смена пароля (новый хеш) сразу делает старую запись неприменимой
+CACHE_TTL = float(os.environ.get('PASSWORD_CACHE_TTL', '300'))
+CACHE_MAX_SIZE = int(os.environ.get('PASSWORD_CACHE_MAX_SIZE', '1024'))
+
+_cache_key = os.urandom(32)
+_cache: 'OrderedDict[bytes, float]' = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _b64(raw: bytes) -> str:
+    return base64.b64encode(raw).decode('ascii')
+
+
+def hash_password(password: str, iterations: int = HASH_ITERATIONS) -> str:
+    salt = os.urandom(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f'{HASH_ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}'
+
+
+def is_hashed(stored: str) -> bool:
+    return stored.startswith(HASH_ALGORITHM + '$')
+
+
+def _cache_digest(login: str, password: str, stored: str) -> bytes:
+    message = '\0'.join((login, password, stored)).encode('utf-8')
+    return hmac.new(_cache_key, message, hashlib.sha256).digest()
+
+
+def _cache_hit(digest: bytes) -> bool:
+    with _cache_lock:
+        expires_at = _cache.get(digest)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _cache[digest]
+            return False
+        return True
+
+
+def _cache_store(digest: bytes) -> None:
+    with _cache_lock:
+        _cache[digest] = time.monotonic() + CACHE_TTL
+        _cache.move_to_end(digest)
+        while len(_cache) > CACHE_MAX_SIZE:
+            _cache.popitem(last=False)
+
+
+def _verify_hash(password: str, stored: str) -> Tuple[bool, bool]:
+    try:
+        _, iterations, salt, expected = stored.split('$')
+        iterations_count = int(iterations)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), base64.b64decode(salt), iterations_count)
+    except ValueError:
+        return False, False
+    if not hmac.compare_digest(_b64(digest), expected):
+        return False, False
+    return True, iterations_count < HASH_ITERATIONS
+
+
+def verify_password(login: str, password: str, stored: str) -> Tuple[bool, bool]:
+    '''
+    Проверка пароля по сохраненному значению (хеш или старый открытый пароль).
+    Returns: (пароль верный, запись нужно перехешировать)
+    '''
+    if not stored:
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8')), True
+
+    digest = _cache_digest(login, password, stored)
+    if CACHE_TTL > 0 and _cache_hit(digest):
+        return True, False
+    ok, needs_rehash = _verify_hash(password, stored)
+    if ok and CACHE_TTL > 0:
+        _cache_store(digest)
+    return ok, needs_rehash
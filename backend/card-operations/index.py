@@ -1,219 +1,617 @@
+import base64
+import csv
+import gzip
+import io
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import threading
+import time
+import traceback
+import api
+import db
+import session
+import refcache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime, timezone, timedelta
+from decimal import Decimal, InvalidOperation
 
 MSK_TZ = timezone(timedelta(hours=3))
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8'
+}
+EXPORT_FETCH_SIZE = 2000
+EXPORT_MAX_BODY_BYTES = int(os.environ.get('EXPORT_MAX_BODY_BYTES', str(4 * 1024 * 1024)))
+EXPORT_COLUMNS = (
+    'id', 'operation_date', 'operation_type', 'card_code', 'client_id', 'client_name', 'client_inn',
+    'station_code_1c', 'station_name', 'quantity', 'price', 'amount', 'comment'
+)
+
+SUMMARY_DIMENSIONS = {
+    'client': 'r.client_id',
+    'station': 'r.station_id',
+    'fuel_type': 'r.fuel_type_id',
+    'operation_type': 'r.operation_type',
+    'day': 'r.day',
+    'month': "date_trunc('month', r.day)::date",
+}
+SUMMARY_DEFAULT_GROUP_BY = 'client,station,fuel_type,month'
+
+# Секции card_operations по месяцам (V0015) создаются заранее на PARTITIONS_MONTHS_AHEAD месяцев;
+# в долгоживущем процессе (шлюз) — при старте и далее раз в PARTITIONS_INTERVAL секунд
+PARTITIONS_MONTHS_AHEAD = int(os.environ.get('CARD_OPERATIONS_PARTITIONS_MONTHS_AHEAD', '12'))
+PARTITIONS_INTERVAL = float(os.environ.get('CARD_OPERATIONS_PARTITIONS_INTERVAL', str(24 * 3600)))
+
+def encode_cursor(operation_date: datetime, operation_id: int) -> str:
+    raw = f"{operation_date.isoformat()}|{operation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor_value: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor_value.encode()).decode()
+        date_part, id_part = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date_part), int(id_part)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный cursor')
+
+def parse_date_param(value: str, name: str, end_of_day: bool = False) -> datetime:
     '''
-    API для управления операциями по картам: получение, создание, обновление и удаление
-    Args: event - dict с httpMethod, body, queryStringParameters
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict
+    Разбор даты фильтра: YYYY-MM-DD или YYYY-MM-DD HH:MM[:SS].
+    Для date_to без времени возвращается начало следующего дня (граница не включается)
+    '''
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f'Некорректная дата в параметре {name}')
+    return day + timedelta(days=1) if end_of_day else day
+
+def build_operations_filter(params: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    '''
+    Формирует WHERE для выборки операций по параметрам запроса:
+    card_id, card_code, client_id, station_id, operation_type, date_from, date_to
     '''
-    method: str = event.get('httpMethod', 'GET')
+    conditions: List[str] = []
+    values: List[Any] = []
+    
+    int_filters = (
+        ('card_id', 'co.fuel_card_id'),
+        ('client_id', 'fc.client_id'),
+        ('station_id', 'co.station_id'),
+    )
+    for name, column in int_filters:
+        if params.get(name):
+            try:
+                values.append(int(params[name]))
+            except ValueError:
+                raise ValueError(f'Некорректное значение параметра {name}')
+            conditions.append(f'{column} = %s')
+    
+    if params.get('card_code'):
+        conditions.append('fc.card_code = %s')
+        values.append(params['card_code'].strip())
+    if params.get('operation_type'):
+        conditions.append('co.operation_type = %s')
+        values.append(params['operation_type'])
+    if params.get('date_from'):
+        conditions.append('co.operation_date >= %s')
+        values.append(parse_date_param(params['date_from'], 'date_from'))
+    if params.get('date_to'):
+        conditions.append('co.operation_date < %s')
+        values.append(parse_date_param(params['date_to'], 'date_to', end_of_day=True))
+    
+    where_sql = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    return where_sql, values
+
+def adjust_daily_usage(cursor: Any, fuel_card_id: Any, operation_date: Any, operation_type: str, delta: Any) -> None:
+    '''
+    Поддерживает счетчик card_daily_usage при ручном изменении операций «заправка»
+    '''
+    if operation_type != 'заправка' or not fuel_card_id or not operation_date or not delta:
+        return
+    cursor.execute("""
+        INSERT INTO card_daily_usage (fuel_card_id, usage_date, liters)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (fuel_card_id, usage_date)
+        DO UPDATE SET liters = GREATEST(card_daily_usage.liters + EXCLUDED.liters, 0)
+    """, (fuel_card_id, operation_date.date(), delta))
+
+def iter_export_rows(conn: Any, where_sql: str, values: List[Any]) -> Iterator[Tuple[Any, ...]]:
+    '''
+    Строки выгрузки через серверный (именованный) курсор: в память попадает
+    не больше EXPORT_FETCH_SIZE строк одновременно
+    '''
+    with conn.cursor(name='operations_export') as cur:
+        cur.itersize = EXPORT_FETCH_SIZE
+        cur.execute(f"""
+            SELECT
+                co.id,
+                co.operation_date,
+                co.operation_type,
+                fc.card_code,
+                fc.client_id,
+                c.name,
+                c.inn,
+                s.code_1c,
+                s.name,
+                co.quantity,
+                co.price,
+                co.amount,
+                co.comment
+            FROM card_operations co
+            LEFT JOIN fuel_cards fc ON co.fuel_card_id = fc.id
+            LEFT JOIN clients c ON fc.client_id = c.id
+            LEFT JOIN stations s ON co.station_id = s.id
+            {where_sql}
+            ORDER BY co.operation_date, co.id
+        """, values)
+        for row in cur:
+            yield row
+
+def format_export_row(row: Tuple[Any, ...], export_format: str) -> str:
+    operation_date = row[1].strftime('%Y-%m-%d %H:%M:%S') if row[1] else ''
+    if export_format == 'ndjson':
+        return json.dumps({
+            'id': row[0],
+            'operation_date': operation_date,
+            'operation_type': row[2],
+            'card_code': row[3],
+            'client_id': row[4],
+            'client_name': row[5],
+            'client_inn': row[6],
+            'station_code_1c': row[7],
+            'station_name': row[8],
+            'quantity': float(row[9]) if row[9] is not None else 0.0,
+            'price': float(row[10]) if row[10] is not None else 0.0,
+            'amount': float(row[11]) if row[11] is not None else 0.0,
+            'comment': row[12] or ''
+        }, ensure_ascii=False) + '\n'
+    line = io.StringIO()
+    csv.writer(line).writerow([
+        row[0], operation_date, row[2], row[3], row[4], row[5], row[6], row[7], row[8],
+        row[9], row[10], row[11], row[12] or ''
+    ])
+    return line.getvalue()
+
+def format_export_continuation(next_cursor: str, export_format: str) -> str:
+    '''
+    Последняя строка неполной выгрузки с курсором следующей части
+    '''
+    if export_format == 'ndjson':
+        return json.dumps({'next_cursor': next_cursor}) + '\n'
+    line = io.StringIO()
+    csv.writer(line).writerow(['#next_cursor', next_cursor])
+    return line.getvalue()
+
+def export_operations(conn: Any, params: Dict[str, Any], export_format: str, use_gzip: bool) -> Dict[str, Any]:
+    '''
+    Выгрузка операций для 1С и бухгалтерии в NDJSON или CSV в хронологическом порядке.
+    Строки пишутся в ответ по мере чтения курсора (при use_gzip — сразу сжатыми).
+    Ответ облачной функции целиком проходит через память и ограничен по размеру, поэтому,
+    когда тело достигает EXPORT_MAX_BODY_BYTES, выгрузка прерывается: ответ помечается
+    заголовками X-Export-Truncated: true и X-Next-Cursor, а последней строкой тела идет
+    продолжение — {"next_cursor": "..."} в NDJSON или строка «#next_cursor,...» в CSV.
+    Следующая часть запрашивается с теми же параметрами и cursor=<next_cursor>; без этой
+    строки в конце выгрузка полная. Клиент, который продолжение не разбирает, получает
+    неполную выгрузку с явной последней строкой, а не молча обрезанный файл
+    '''
+    where_sql, values = build_operations_filter(params)
+    if params.get('cursor'):
+        cursor_date, cursor_id = decode_cursor(params['cursor'])
+        where_sql += (' AND ' if where_sql else 'WHERE ') + '(co.operation_date, co.id) > (%s, %s)'
+        values.extend([cursor_date, cursor_id])
+    
+    buffer = io.BytesIO()
+    sink = gzip.GzipFile(fileobj=buffer, mode='wb') if use_gzip else buffer
+    if export_format == 'csv' and not params.get('cursor'):
+        header = io.StringIO()
+        csv.writer(header).writerow(EXPORT_COLUMNS)
+        sink.write(header.getvalue().encode('utf-8'))
+    
+    next_cursor = None
+    rows = iter_export_rows(conn, where_sql, values)
+    try:
+        for row in rows:
+            sink.write(format_export_row(row, export_format).encode('utf-8'))
+            if buffer.tell() >= EXPORT_MAX_BODY_BYTES:
+                next_cursor = encode_cursor(row[1], row[0])
+                break
+    finally:
+        rows.close()
+    if next_cursor:
+        sink.write(format_export_continuation(next_cursor, export_format).encode('utf-8'))
+    if use_gzip:
+        sink.close()
     
-    if method == 'OPTIONS':
+    headers = {
+        'Content-Type': EXPORT_CONTENT_TYPES[export_format],
+        'Content-Disposition': f'attachment; filename="operations.{export_format}"',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Next-Cursor, X-Export-Truncated',
+        'Vary': 'Accept-Encoding'
+    }
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+        headers['X-Export-Truncated'] = 'true'
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
         return {
             'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
+            'headers': headers,
+            'body': base64.b64encode(buffer.getvalue()).decode('ascii'),
+            'isBase64Encoded': True
         }
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': buffer.getvalue().decode('utf-8'),
+        'isBase64Encoded': False
+    }
+
+def transfer_liters(conn: Any, data: Dict[str, Any], owner_id: Optional[int] = None) -> Tuple[int, Dict[str, Any]]:
+    '''
+    Перемещение литров между картами одного клиента в одной транзакции:
+    обе карты блокируются в порядке id, балансы меняются одним UPDATE,
+    операции «списание» и «оприходование» пишутся одним INSERT.
+    owner_id — клиент из сессии: перемещать можно только между его картами
+    Returns: (statusCode, тело ответа)
+    '''
+    if not isinstance(data, dict):
+        return 400, {'error': 'Некорректный JSON'}
+    try:
+        source_id = int(data.get('source_card_id'))
+        target_id = int(data.get('target_card_id'))
+        # Балансы — numeric(10,2): количество считается в Decimal, а не во float
+        quantity = Decimal(str(data.get('quantity')))
+        price = Decimal(str(data.get('price') or 0))
+    except (TypeError, ValueError, InvalidOperation):
+        return 400, {'error': 'Укажите source_card_id, target_card_id и quantity'}
+    if source_id == target_id:
+        return 400, {'error': 'Карта списания и карта зачисления совпадают'}
+    # Decimal('NaN') и Decimal('Infinity') разбираются без ошибки, а NaN не меньше и не больше нуля
+    if not quantity.is_finite() or quantity <= 0:
+        return 400, {'error': 'Количество топлива должно быть больше 0'}
+    if not price.is_finite() or price < 0:
+        return 400, {'error': 'Цена должна быть неотрицательным числом'}
     
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Database configuration error'}),
-            'isBase64Encoded': False
-        }
+    with conn.cursor() as cur:
+        station = refcache.station_by_name(cur, data.get('station_name') or 'Склад')
+        if station is None:
+            return 400, {'error': 'АЗС для операции перемещения не найдена'}
+        
+        cur.execute("""
+            SELECT id, card_code, client_id, balance_liters
+            FROM fuel_cards
+            WHERE id IN (%s, %s)
+            ORDER BY id
+            FOR UPDATE
+        """, (source_id, target_id))
+        cards = {row[0]: row for row in cur.fetchall()}
+        source, target = cards.get(source_id), cards.get(target_id)
+        if not source or not target:
+            conn.rollback()
+            return 404, {'error': 'Card not found'}
+        if source[2] != target[2]:
+            conn.rollback()
+            return 400, {'error': 'Перемещение возможно только между картами одного клиента'}
+        if owner_id is not None and source[2] != owner_id:
+            conn.rollback()
+            return 403, {'error': 'Недостаточно прав'}
+        source_balance = Decimal(str(source[3] or 0))
+        if source_balance < quantity:
+            conn.rollback()
+            return 400, {
+                'error': 'Недостаточно топлива на карте',
+                'current_balance': float(source_balance),
+                'requested_quantity': float(quantity)
+            }
+        
+        cur.execute("""
+            UPDATE fuel_cards
+            SET balance_liters = balance_liters + CASE WHEN id = %s THEN -%s ELSE %s END
+            WHERE id IN (%s, %s)
+            RETURNING id, balance_liters
+        """, (source_id, quantity, quantity, source_id, target_id))
+        balances = {row[0]: float(row[1]) for row in cur.fetchall()}
+        
+        operation_date = datetime.now().replace(microsecond=0)
+        amount = quantity * price
+        cur.execute("""
+            INSERT INTO card_operations
+            (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
+            VALUES (%s, %s, %s, 'списание', %s, %s, %s, %s),
+                   (%s, %s, %s, 'оприходование', %s, %s, %s, %s)
+            RETURNING id
+        """, (
+            source_id, station['id'], operation_date, quantity, price, amount, f'Перемещение на карту {target[1]}',
+            target_id, station['id'], operation_date, quantity, price, amount, f'Перемещение с карты {source[1]}'
+        ))
+        operation_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    
+    return 200, {
+        'success': True,
+        'quantity': float(quantity),
+        'source': {'id': source_id, 'card_code': source[1], 'balance_liters': balances[source_id]},
+        'target': {'id': target_id, 'card_code': target[1], 'balance_liters': balances[target_id]},
+        'operation_ids': operation_ids,
+        'operation_date': operation_date.strftime('%Y-%m-%d %H:%M')
+    }
+
+def operations_summary(cur: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Сводка по агрегату operation_daily_rollups для отчетов по расходу.
+    group_by — список измерений через запятую (client, station, fuel_type, operation_type, day, month),
+    фильтры: client_id, station_id, fuel_type_id, operation_type, date_from, date_to
+    '''
+    group_by = [name.strip() for name in (params.get('group_by') or SUMMARY_DEFAULT_GROUP_BY).split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in SUMMARY_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Параметр group_by: {', '.join(SUMMARY_DIMENSIONS)}")
+    group_by = list(dict.fromkeys(group_by))
+    
+    conditions: List[str] = []
+    values: List[Any] = []
+    for name, column in (('client_id', 'r.client_id'), ('station_id', 'r.station_id'), ('fuel_type_id', 'r.fuel_type_id')):
+        if params.get(name):
+            try:
+                values.append(int(params[name]))
+            except ValueError:
+                raise ValueError(f'Некорректное значение параметра {name}')
+            conditions.append(f'{column} = %s')
+    if params.get('operation_type'):
+        conditions.append('r.operation_type = %s')
+        values.append(params['operation_type'])
+    if params.get('date_from'):
+        conditions.append('r.day >= %s')
+        values.append(parse_date_param(params['date_from'], 'date_from').date())
+    if params.get('date_to'):
+        conditions.append('r.day < %s')
+        values.append(parse_date_param(params['date_to'], 'date_to', end_of_day=True).date())
+    where_sql = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    
+    columns = [f'{SUMMARY_DIMENSIONS[name]} AS {name}' for name in group_by]
+    group_sql = ('GROUP BY ' + ', '.join(str(i + 1) for i in range(len(group_by)))) if group_by else ''
+    order_sql = ('ORDER BY ' + ', '.join(str(i + 1) for i in range(len(group_by)))) if group_by else ''
+    columns += ['SUM(r.liters)', 'SUM(r.amount)', 'SUM(r.operations_count)']
+    cur.execute(f"""
+        SELECT {', '.join(columns)}
+        FROM operation_daily_rollups r
+        {where_sql}
+        {group_sql}
+        HAVING SUM(r.operations_count) <> 0
+        {order_sql}
+    """, values)
+    rows = cur.fetchall()
     
+    client_names: Dict[int, str] = {}
+    if 'client' in group_by:
+        client_ids = sorted({row[group_by.index('client')] for row in rows})
+        if client_ids:
+            cur.execute("SELECT id, name FROM clients WHERE id = ANY(%s)", (client_ids,))
+            client_names = dict(cur.fetchall())
+    
+    summary = []
+    for row in rows:
+        item: Dict[str, Any] = {}
+        for i, name in enumerate(group_by):
+            value = row[i]
+            if name == 'client':
+                item['client_id'] = value
+                item['client_name'] = client_names.get(value)
+            elif name == 'station':
+                station = refcache.station_by_id(cur, value)
+                item['station_id'] = value
+                item['station_name'] = station['name'] if station else None
+            elif name == 'fuel_type':
+                fuel_type = refcache.fuel_type_by_id(cur, value)
+                item['fuel_type_id'] = value
+                item['fuel_type_name'] = fuel_type['name'] if fuel_type else None
+            elif name in ('day', 'month'):
+                item[name] = value.strftime('%Y-%m-%d' if name == 'day' else '%Y-%m')
+            else:
+                item[name] = value
+        item['liters'] = float(row[-3] or 0)
+        item['amount'] = float(row[-2] or 0)
+        item['operations_count'] = int(row[-1] or 0)
+        summary.append(item)
+    
+    return {'group_by': group_by, 'summary': summary}
+
+def parse_page_size(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError('Некорректное значение параметра limit')
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+LIST_COLUMNS = (
+    'id', 'card_code', 'station_name', 'operation_date', 'operation_type',
+    'quantity', 'price', 'amount', 'comment', 'fuel_card_id', 'station_id'
+)
+OPERATION_RETURNING = """
+    RETURNING id, operation_date, operation_type,
+        COALESCE(quantity, 0), COALESCE(price, 0), COALESCE(amount, 0), COALESCE(comment, '')
+"""
+
+def operation_body(row: Tuple[Any, ...], card_code: Any, station_name: Any) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'card_code': card_code,
+        'station_name': station_name,
+        'operation_date': row[1],
+        'operation_type': row[2],
+        'quantity': row[3],
+        'price': row[4],
+        'amount': row[5],
+        'comment': row[6]
+    }
+
+def parse_operation_date(value: Optional[str], formats: Tuple[str, ...]) -> datetime:
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            pass
+    return datetime.now()
+
+def client_params(request: api.Request) -> Dict[str, Any]:
+    claims = session.authorize(request.event)
+    if claims and not claims['admin']:
+        return {**request.params, 'client_id': str(claims['sub'])}
+    return request.params
+
+def list_operations(request: api.Request) -> Dict[str, Any]:
+    params = client_params(request)
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
+        if params.get('report') == 'summary':
+            with db.connection() as conn:
+                with conn.cursor() as cursor:
+                    return api.json_response(operations_summary(cursor, params))
         
-        if method == 'GET':
-            cursor.execute("""
+        export_format = params.get('format')
+        if export_format:
+            if export_format not in EXPORT_CONTENT_TYPES:
+                raise ValueError('Параметр format: ndjson или csv')
+            with db.connection() as conn:
+                return export_operations(conn, params, export_format, api.accepts_encoding(request, 'gzip'))
+        
+        where_sql, values = build_operations_filter(params)
+        limit = parse_page_size(params.get('limit'))
+        if params.get('cursor'):
+            cursor_date, cursor_id = decode_cursor(params['cursor'])
+            where_sql += (' AND ' if where_sql else 'WHERE ') + '(co.operation_date, co.id) < (%s, %s)'
+            values.extend([cursor_date, cursor_id])
+    except ValueError as e:
+        raise api.HttpError(400, str(e))
+    
+    # Keyset-пагинация по (operation_date, id): запрашиваем на одну строку больше,
+    # чтобы понять, есть ли следующая страница
+    values.append(limit + 1)
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
                 SELECT 
                     co.id,
                     fc.card_code,
                     s.name as station_name,
                     co.operation_date,
                     co.operation_type,
-                    co.quantity,
-                    co.price,
-                    co.amount,
-                    co.comment,
+                    COALESCE(co.quantity, 0)::float8,
+                    COALESCE(co.price, 0)::float8,
+                    COALESCE(co.amount, 0)::float8,
+                    COALESCE(co.comment, ''),
                     co.fuel_card_id,
                     co.station_id
                 FROM card_operations co
                 LEFT JOIN fuel_cards fc ON co.fuel_card_id = fc.id
                 LEFT JOIN stations s ON co.station_id = s.id
+                {where_sql}
                 ORDER BY co.operation_date DESC, co.id DESC
-            """)
+                LIMIT %s
+            """, tuple(values))
             rows = cursor.fetchall()
-            
-            operations = []
-            for row in rows:
-                operations.append({
-                    'id': row[0],
-                    'card_code': row[1],
-                    'station_name': row[2],
-                    'operation_date': row[3].strftime('%Y-%m-%d %H:%M') if row[3] else '',
-                    'operation_type': row[4],
-                    'quantity': float(row[5]) if row[5] else 0.0,
-                    'price': float(row[6]) if row[6] else 0.0,
-                    'amount': float(row[7]) if row[7] else 0.0,
-                    'comment': row[8] or '',
-                    'fuel_card_id': row[9],
-                    'station_id': row[10]
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'operations': operations}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            
-            card_code = body_data.get('card_code', '').replace("'", "''")
-            cursor.execute(f"SELECT id FROM fuel_cards WHERE card_code = '{card_code}'")
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][3], rows[-1][0])
+    
+    return api.json_response({**api.rows_payload(request, 'operations', LIST_COLUMNS, rows), 'next_cursor': next_cursor})
+
+def create_operation(request: api.Request) -> Dict[str, Any]:
+    claims = session.authorize(request.event)
+    body_data = request.json
+    if not isinstance(body_data, dict):
+        raise api.HttpError(400, 'Некорректный JSON')
+    
+    if body_data.get('action') == 'transfer':
+        if claims is None:
+            # Без токена перемещение между любыми картами доступно только там, где доступны
+            # действия администратора: иначе удаление токена давало бы клиенту больше прав
+            session.require_admin(claims)
+        owner_id = claims['sub'] if claims and not claims['admin'] else None
+        with db.connection() as conn:
+            status_code, result = transfer_liters(conn, body_data, owner_id)
+        return api.json_response(result, status_code)
+    
+    session.require_admin(claims)
+    card_code = body_data.get('card_code', '')
+    station_name = body_data.get('station_name', '')
+    operation_date = parse_operation_date(
+        body_data.get('operation_date'), ('%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+    )
+    
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT id FROM fuel_cards WHERE card_code = %s", (card_code,))
             card_row = cursor.fetchone()
-            
             if not card_row:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Card not found'}),
-                    'isBase64Encoded': False
-                }
-            
+                raise api.HttpError(400, 'Card not found')
             fuel_card_id = card_row[0]
             
-            station_name = body_data.get('station_name', '').replace("'", "''")
-            cursor.execute(f"SELECT id FROM stations WHERE name = '{station_name}'")
-            station_row = cursor.fetchone()
-            station_id = station_row[0] if station_row else 'NULL'
-            
-            operation_date_str = body_data.get('operation_date', '')
-            
-            if not operation_date_str:
-                operation_date = datetime.now()
-            else:
-                try:
-                    operation_date = datetime.strptime(operation_date_str, '%Y-%m-%dT%H:%M')
-                except:
-                    try:
-                        operation_date = datetime.strptime(operation_date_str, '%Y-%m-%d %H:%M')
-                    except:
-                        try:
-                            operation_date = datetime.strptime(operation_date_str, '%Y-%m-%d %H:%M:%S')
-                        except:
-                            operation_date = datetime.now()
-            
-            operation_type = body_data.get('operation_type', '').replace("'", "''")
-            quantity = float(body_data.get('quantity', 0))
-            price = float(body_data.get('price', 0))
-            amount = float(body_data.get('amount', 0))
-            comment = body_data.get('comment', '').replace("'", "''")
-            operation_date_formatted = operation_date.strftime('%Y-%m-%d %H:%M:%S')
-            
-            cursor.execute(f"""
+            station = refcache.station_by_name(cursor, station_name)
+            cursor.execute("""
                 INSERT INTO card_operations 
                 (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
-                VALUES ({fuel_card_id}, {station_id}, '{operation_date_formatted}', '{operation_type}', {quantity}, {price}, {amount}, '{comment}')
-                RETURNING id, operation_date, operation_type, quantity, price, amount, comment
-            """)
-            
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+            """ + OPERATION_RETURNING, (
+                fuel_card_id,
+                station['id'] if station else None,
+                operation_date.replace(microsecond=0),
+                body_data.get('operation_type', ''),
+                float(body_data.get('quantity', 0)),
+                float(body_data.get('price', 0)),
+                float(body_data.get('amount', 0)),
+                body_data.get('comment', '')
+            ))
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            operation = {
-                'id': row[0],
-                'card_code': card_code,
-                'station_name': station_name,
-                'operation_date': row[1].strftime('%Y-%m-%d %H:%M') if row[1] else '',
-                'operation_type': row[2],
-                'quantity': float(row[3]) if row[3] else 0.0,
-                'price': float(row[4]) if row[4] else 0.0,
-                'amount': float(row[5]) if row[5] else 0.0,
-                'comment': row[6] or ''
-            }
-            
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'operation': operation}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            operation_id = body_data.get('id')
-            
-            card_code = body_data.get('card_code')
+            adjust_daily_usage(cursor, fuel_card_id, row[1], row[2], row[3])
+        conn.commit()
+    
+    return api.json_response({'operation': operation_body(row, card_code, station_name)}, 201)
+
+def update_operation(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    operation_id = body_data.get('id')
+    card_code = body_data.get('card_code')
+    station_name = body_data.get('station_name')
+    operation_date = parse_operation_date(
+        body_data.get('operation_date'), ('%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M')
+    )
+    
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("SELECT id FROM fuel_cards WHERE card_code = %s", (card_code,))
             card_row = cursor.fetchone()
             fuel_card_id = card_row[0] if card_row else None
             
-            station_name = body_data.get('station_name')
-            cursor.execute("SELECT id FROM stations WHERE name = %s", (station_name,))
-            station_row = cursor.fetchone()
-            station_id = station_row[0] if station_row else None
+            station = refcache.station_by_name(cursor, station_name)
+            station_id = station['id'] if station else None
             
-            operation_date_str = body_data.get('operation_date')
-            if not operation_date_str:
-                operation_date = datetime.now()
-            else:
-                try:
-                    operation_date = datetime.strptime(operation_date_str, '%Y-%m-%d %H:%M')
-                except:
-                    try:
-                        operation_date = datetime.strptime(operation_date_str, '%Y-%m-%d %H:%M:%S')
-                    except:
-                        try:
-                            operation_date = datetime.strptime(operation_date_str, '%Y-%m-%dT%H:%M')
-                        except:
-                            operation_date = datetime.now()
+            cursor.execute("""
+                SELECT fuel_card_id, operation_date, operation_type, quantity
+                FROM card_operations WHERE id = %s FOR UPDATE
+            """, (operation_id,))
+            previous = cursor.fetchone()
             
             cursor.execute("""
                 UPDATE card_operations
                 SET fuel_card_id = %s, station_id = %s, operation_date = %s,
                     operation_type = %s, quantity = %s, price = %s, amount = %s, comment = %s
                 WHERE id = %s
-                RETURNING id, operation_date, operation_type, quantity, price, amount, comment
-            """, (
+            """ + OPERATION_RETURNING, (
                 fuel_card_id,
                 station_id,
                 operation_date,
@@ -224,96 +622,89 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('comment', ''),
                 operation_id
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            if row:
-                operation = {
-                    'id': row[0],
-                    'card_code': card_code,
-                    'station_name': station_name,
-                    'operation_date': row[1].strftime('%Y-%m-%d %H:%M') if row[1] else '',
-                    'operation_type': row[2],
-                    'quantity': float(row[3]) if row[3] else 0.0,
-                    'price': float(row[4]) if row[4] else 0.0,
-                    'amount': float(row[5]) if row[5] else 0.0,
-                    'comment': row[6] or ''
-                }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'operation': operation}),
-                    'isBase64Encoded': False
-                }
-            else:
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Operation not found'}),
-                    'isBase64Encoded': False
-                }
-        
-        if method == 'DELETE':
-            params = event.get('queryStringParameters') or {}
-            operation_id = params.get('id')
-            
-            if not operation_id:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Operation ID required'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("DELETE FROM card_operations WHERE id = %s", (operation_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
+            if row and previous:
+                adjust_daily_usage(cursor, previous[0], previous[1], previous[2], -previous[3])
+                adjust_daily_usage(cursor, fuel_card_id, row[1], row[2], row[3])
+        conn.commit()
     
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+    if not row:
+        raise api.HttpError(404, 'Operation not found')
+    return api.json_response({'operation': operation_body(row, card_code, station_name)})
+
+def delete_operation(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    operation_id = request.params.get('id')
+    if not operation_id:
+        raise api.HttpError(400, 'Operation ID required')
+    
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                DELETE FROM card_operations WHERE id = %s
+                RETURNING fuel_card_id, operation_date, operation_type, quantity
+            """, (operation_id,))
+            deleted = cursor.fetchone()
+            if deleted:
+                adjust_daily_usage(cursor, deleted[0], deleted[1], deleted[2], -deleted[3])
+        conn.commit()
+    
+    return api.json_response({'success': True})
+
+def ensure_partitions() -> Optional[int]:
+    '''
+    Создает недостающие месячные секции card_operations; None — этим сейчас занят другой процесс.
+    Рабочие процессы шлюза вызывают функцию одновременно: advisory-блокировка оставляет одного,
+    иначе параллельные CREATE TABLE одной секции падали бы друг на друге
+    '''
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('ensure_card_operations_partitions'))")
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return None
+            cursor.execute("SELECT ensure_card_operations_partitions(%s)", (PARTITIONS_MONTHS_AHEAD,))
+            created = cursor.fetchone()[0]
+        conn.commit()
+    return created
+
+def maintain_partitions() -> None:
+    while True:
+        try:
+            created = ensure_partitions()
+            if created:
+                print(json.dumps({'event': 'card_operations_partitions', 'created': created}))
+        except Exception:
+            # БД недоступна: следующая попытка через интервал
+            print(traceback.format_exc())
+        time.sleep(PARTITIONS_INTERVAL)
+
+def start() -> None:
+    '''
+    Запуск в долгоживущем процессе (шлюз): фоновое создание секций card_operations на месяцы вперед,
+    чтобы новые операции не копились в секции по умолчанию
+    '''
+    threading.Thread(target=maintain_partitions, name='card-operations-partitions', daemon=True).start()
+
+router = api.Router(
+    {'GET': list_operations, 'POST': create_operation, 'PUT': update_operation, 'DELETE': delete_operation},
+    allow_headers=('Content-Type', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Server error: ',
+    compress=True
+)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для управления операциями по картам: получение, создание, обновление и удаление.
+    GET ?format=ndjson|csv — выгрузка операций для 1С и бухгалтерии; выгрузка больше EXPORT_MAX_BODY_BYTES
+        отдается частями: пока последняя строка тела — продолжение ({"next_cursor"} или «#next_cursor,...»,
+        заголовок X-Export-Truncated: true), следующая часть запрашивается с cursor=<next_cursor>
+    GET ?layout=columns — список в виде {fields, rows}; ответы от COMPRESS_MIN_BYTES сжимаются br/gzip
+    GET ?report=summary&group_by=client,station,fuel_type,month — сводка по агрегату operation_daily_rollups
+    POST {action: 'transfer', source_card_id, target_card_id, quantity, price} — перемещение между картами
+    Args: event - dict с httpMethod, body, queryStringParameters
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict
+    '''
+    return router(event, context)
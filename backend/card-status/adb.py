@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Optional
+
+import asyncpg
+
+import db
+
+# Асинхронный доступ к БД для горячих путей 1С (card-status, refuel): пока запрос ждет
+# PostgreSQL, процесс обслуживает другие. Соединений в пуле немного, ожидающие запросы
+# стоят в очереди пула, не занимая потоков. Статистика вызова (db.instrumented) и журнал
+# медленных запросов общие с синхронным db
+ASYNC_POOL_MIN_SIZE = int(os.environ.get('DB_ASYNC_POOL_MIN_SIZE', '1'))
+ASYNC_POOL_MAX_SIZE = int(os.environ.get('DB_ASYNC_POOL_MAX_SIZE', '20'))
+ASYNC_POOL_IDLE_LIFETIME = float(os.environ.get('DB_ASYNC_POOL_IDLE_LIFETIME', '300'))
+
+
+class TimedConnection(asyncpg.Connection):
+    '''
+    Соединение asyncpg с учетом времени запросов, как db.TimedCursor
+    '''
+
+    async def execute(self, query: str, *args: Any, timeout: Optional[float] = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().execute(query, *args, timeout=timeout)
+        finally:
+            db.record_query(query, started)
+
+    async def executemany(self, command: str, args: Any, *, timeout: Optional[float] = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().executemany(command, args, timeout=timeout)
+        finally:
+            db.record_query(command, started)
+
+    async def fetch(self, query: str, *args: Any, timeout: Optional[float] = None, record_class: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().fetch(query, *args, timeout=timeout, record_class=record_class)
+        finally:
+            db.record_query(query, started)
+
+    async def fetchrow(self, query: str, *args: Any, timeout: Optional[float] = None, record_class: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().fetchrow(query, *args, timeout=timeout, record_class=record_class)
+        finally:
+            db.record_query(query, started)
+
+    async def fetchval(self, query: str, *args: Any, column: int = 0, timeout: Optional[float] = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return await super().fetchval(query, *args, column=column, timeout=timeout)
+        finally:
+            db.record_query(query, started)
+
+
+async def _init_connection(conn: asyncpg.Connection) -> None:
+    # JSON/JSONB как dict в обе стороны, как в psycopg2
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+_pool_task: Optional['asyncio.Task[asyncpg.Pool]'] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _create_pool() -> asyncpg.Pool:
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        raise RuntimeError('DATABASE_URL не настроен')
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=ASYNC_POOL_MIN_SIZE,
+        max_size=ASYNC_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=ASYNC_POOL_IDLE_LIFETIME,
+        connection_class=TimedConnection,
+        init=_init_connection,
+        # asyncpg кэширует именованные подготовленные запросы на соединении; за pgbouncer в режиме
+        # transaction (DB_PREPARED_STATEMENTS=0, как для db.Statement) их нужно отключить
+        statement_cache_size=100 if db.PREPARED_STATEMENTS else 0,
+        timeout=5
+    )
+
+
+async def get_pool() -> asyncpg.Pool:
+    '''
+    Пул соединений уровня модуля, привязанный к циклу событий: создается при первом
+    вызове, параллельные первые запросы ждут одного и того же создания.
+    Пул asyncpg нельзя использовать из другого цикла, поэтому при смене цикла создается новый
+    '''
+    global _pool_task, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool_task is None or _pool_loop is not loop:
+        _pool_task = loop.create_task(_create_pool())
+        _pool_loop = loop
+    task = _pool_task
+    try:
+        return await asyncio.shield(task)
+    except Exception:
+        # Неудачное подключение не кэшируется: следующий запрос попробует снова
+        if _pool_task is task:
+            _pool_task = None
+        raise
+
+
+@asynccontextmanager
+async def connection() -> AsyncIterator[TimedConnection]:
+    '''
+    Соединение из пула на время блока: async with adb.connection() as conn: ...
+    При возврате в пул незавершенная транзакция откатывается, сломанное соединение закрывается
+    '''
+    started = time.perf_counter()
+    try:
+        pool = await get_pool()
+        conn = await pool.acquire(timeout=db.POOL_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise db.PoolTimeout('Нет свободных соединений с базой данных')
+    finally:
+        stats = db.current_stats()
+        if stats is not None:
+            stats.pool_ms += (time.perf_counter() - started) * 1000
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
@@ -1,124 +1,178 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
+import api
+import adb
+import db
+import refcache
+from typing import Dict, Any, List, Optional
 from datetime import date
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    Получение баланса и состояния топливной карты для интеграции с 1С
-    Args: event - dict с httpMethod, queryStringParameters (card_code)
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict с данными карты, включая доступный баланс с учетом дневного лимита
-    '''
-    method: str = event.get('httpMethod', 'GET')
+MAX_BATCH_CARDS = 5000
+
+CARD_STATUS_SELECT = """
+    SELECT 
+        fc.card_code,
+        fc.fuel_type_id,
+        fc.balance_liters,
+        c.name as client_name,
+        c.inn as client_inn,
+        fc.daily_limit,
+        COALESCE(u.liters, 0) as today_refueled
+    FROM fuel_cards fc
+    LEFT JOIN clients c ON fc.client_id = c.id
+    LEFT JOIN card_daily_usage u ON u.fuel_card_id = fc.id AND u.usage_date = %(today)s
+"""
+# Тот же запрос для asyncpg: дата — $1, условие отбора — $2
+ASYNC_CARD_STATUS_SELECT = CARD_STATUS_SELECT.replace('%(today)s', '$1::date')
+# Опрос одной карты — самый частый запрос 1С: выполняется подготовленным (db.Statement)
+CARD_STATUS_BY_CODE = db.Statement(
+    'card_status_by_code',
+    CARD_STATUS_SELECT + " WHERE fc.card_code = %(card_code)s",
+    {'today': 'date', 'card_code': 'varchar'}
+)
+
+def build_card_status(cur: Any, row: Any) -> Dict[str, Any]:
+    fuel_type = refcache.fuel_type_by_id(cur, row[1]) if row[1] is not None else None
+    return card_status_body(row, fuel_type)
+
+async def build_card_status_async(conn: Any, row: Any) -> Dict[str, Any]:
+    fuel_type = await refcache.fuel_type_by_id_async(conn, row[1]) if row[1] is not None else None
+    return card_status_body(row, fuel_type)
+
+def card_status_body(row: Any, fuel_type: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    balance_liters = float(row[2]) if row[2] is not None else 0.0
+    daily_limit = float(row[5]) if row[5] is not None else 0.0
+    today_refueled = float(row[6]) if row[6] else 0.0
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Api-Key',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
+    available_balance = balance_liters
     
-    if method != 'GET':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'})
-        }
+    if daily_limit > 0:
+        available_balance = min(balance_liters, daily_limit - today_refueled)
+        available_balance = max(0.0, available_balance)
     
-    params = event.get('queryStringParameters', {}) or {}
-    card_code = params.get('card_code', '').strip()
+    return {
+        'card_code': row[0],
+        'fuel_type': fuel_type['name'] if fuel_type else '',
+        'balance_liters': balance_liters,
+        'available_balance': available_balance,
+        'daily_limit': daily_limit,
+        'client_name': row[3] or '',
+        'client_inn': row[4] or ''
+    }
+
+def parse_card_codes(value: Any) -> List[str]:
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list):
+        return []
+    return list(dict.fromkeys(str(code).strip() for code in value if str(code).strip()))
+
+def batch_card_status(card_codes: List[str], client_inn: Optional[str]) -> Dict[str, Any]:
+    '''
+    Состояние многих карт одним запросом: по списку номеров или по ИНН клиента
+    '''
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            params = {'today': date.today(), 'card_codes': card_codes, 'client_inn': client_inn}
+            if card_codes:
+                cur.execute(CARD_STATUS_SELECT + " WHERE fc.card_code = ANY(%(card_codes)s) ORDER BY fc.card_code", params)
+            else:
+                cur.execute(CARD_STATUS_SELECT + " WHERE c.inn = %(client_inn)s ORDER BY fc.card_code", params)
+            cards = [build_card_status(cur, row) for row in cur.fetchall()]
+    
+    found = {card['card_code'] for card in cards}
+    return api.json_response({
+        'cards': cards,
+        'not_found': [code for code in card_codes if code not in found]
+    })
+
+def card_status_query(request: api.Request) -> Dict[str, Any]:
+    '''
+    Параметры запроса состояния: card_code либо card_codes / client_inn для пакета
+    '''
+    params = request.params
+    if request.method == 'POST':
+        params = request.json
+        if not isinstance(params, dict):
+            raise api.HttpError(400, 'Некорректный JSON')
     
-    if not card_code:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не указан номер карты (параметр card_code)'})
-        }
+    query = {
+        'card_code': str(params.get('card_code') or '').strip(),
+        'card_codes': parse_card_codes(params.get('card_codes')),
+        'client_inn': str(params.get('client_inn') or '').strip() or None
+    }
     
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'DATABASE_URL не настроен'})
-        }
+    if not query['card_code'] and not query['card_codes'] and not query['client_inn']:
+        raise api.HttpError(400, 'Не указан номер карты (параметр card_code)')
+    if len(query['card_codes']) > MAX_BATCH_CARDS:
+        raise api.HttpError(400, f'Не более {MAX_BATCH_CARDS} карт в одном запросе')
+    return query
+
+def card_status(request: api.Request) -> Dict[str, Any]:
+    query = card_status_query(request)
+    if query['card_codes'] or query['client_inn']:
+        return batch_card_status(query['card_codes'], query['client_inn'])
     
-    conn = psycopg2.connect(dsn)
-    try:
+    card_code = query['card_code']
+    with db.connection() as conn:
         with conn.cursor() as cur:
-            escaped_card_code = card_code.replace("'", "''")
-            query = f"""
-                SELECT 
-                    fc.card_code,
-                    ft.name as fuel_type,
-                    fc.balance_liters,
-                    c.name as client_name,
-                    c.inn as client_inn,
-                    fc.daily_limit,
-                    fc.id
-                FROM fuel_cards fc
-                LEFT JOIN clients c ON fc.client_id = c.id
-                LEFT JOIN fuel_types ft ON fc.fuel_type_id = ft.id
-                WHERE fc.card_code = '{escaped_card_code}'
-            """
-            cur.execute(query)
-            
+            CARD_STATUS_BY_CODE.execute(cur, {'today': date.today(), 'card_code': card_code})
             row = cur.fetchone()
-            
             if not row:
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'Карта {card_code} не найдена'})
-                }
-            
-            balance_liters = float(row[2]) if row[2] is not None else 0.0
-            daily_limit = float(row[5]) if row[5] is not None else 0.0
-            card_id = row[6]
-            
-            available_balance = balance_liters
-            
-            if daily_limit > 0:
-                today_start = date.today().strftime('%Y-%m-%d 00:00:00')
-                today_end = date.today().strftime('%Y-%m-%d 23:59:59')
-                
-                query_today = f"""
-                    SELECT COALESCE(SUM(quantity), 0) as today_total
-                    FROM card_operations
-                    WHERE fuel_card_id = {card_id}
-                    AND operation_type = 'заправка'
-                    AND operation_date >= '{today_start}'
-                    AND operation_date <= '{today_end}'
-                """
-                cur.execute(query_today)
-                today_row = cur.fetchone()
-                today_refueled = float(today_row[0]) if today_row and today_row[0] else 0.0
-                
-                available_balance = min(balance_liters, daily_limit - today_refueled)
-                available_balance = max(0.0, available_balance)
-            
-            result = {
-                'card_code': row[0],
-                'fuel_type': row[1] or '',
-                'balance_liters': balance_liters,
-                'available_balance': available_balance,
-                'daily_limit': daily_limit,
-                'client_name': row[3] or '',
-                'client_inn': row[4] or ''
-            }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps(result, ensure_ascii=False)
-            }
-    finally:
-        conn.close()
\ No newline at end of file
+                raise api.HttpError(404, f'Карта {card_code} не найдена')
+            return api.json_response(build_card_status(cur, row))
+
+async def card_status_async(request: api.Request) -> Dict[str, Any]:
+    query = card_status_query(request)
+    card_codes = query['card_codes']
+    
+    async with adb.connection() as conn:
+        if card_codes:
+            rows = await conn.fetch(
+                ASYNC_CARD_STATUS_SELECT + " WHERE fc.card_code = ANY($2::varchar[]) ORDER BY fc.card_code",
+                date.today(), card_codes
+            )
+        elif query['client_inn']:
+            rows = await conn.fetch(
+                ASYNC_CARD_STATUS_SELECT + " WHERE c.inn = $2::varchar ORDER BY fc.card_code",
+                date.today(), query['client_inn']
+            )
+        else:
+            row = await conn.fetchrow(CARD_STATUS_BY_CODE.text, date.today(), query['card_code'])
+            if not row:
+                raise api.HttpError(404, f"Карта {query['card_code']} не найдена")
+            return api.json_response(await build_card_status_async(conn, row))
+        cards = [await build_card_status_async(conn, row) for row in rows]
+    
+    found = {card['card_code'] for card in cards}
+    return api.json_response({
+        'cards': cards,
+        'not_found': [code for code in card_codes if code not in found]
+    })
+
+ROUTER_OPTIONS = {
+    'allow_headers': ('Content-Type', 'X-Api-Key'),
+    'method_not_allowed': 'Метод не поддерживается',
+    'database_error': 'DATABASE_URL не настроен',
+    'invalid_json': 'Некорректный JSON'
+}
+
+router = api.Router({'GET': card_status, 'POST': card_status}, **ROUTER_OPTIONS)
+async_router = api.AsyncRouter({'GET': card_status_async, 'POST': card_status_async}, **ROUTER_OPTIONS)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Получение баланса и состояния топливной карты для интеграции с 1С
+    Args: event - dict с httpMethod, queryStringParameters (card_code | card_codes | client_inn),
+          для POST - body {card_codes: [...]} или {client_inn}
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict с данными карты, включая доступный баланс с учетом дневного лимита
+    '''
+    return router(event, context)
+
+@db.instrumented
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    То же, что handler, на asyncpg (adb): ожидание БД не занимает поток,
+    локальный шлюз в режиме --async держит сотни одновременных опросов 1С
+    '''
+    return await async_router(event, context)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Кэш справочников (АЗС, виды топлива) в памяти «теплого» экземпляра функции.
+# Справочники меняются несколько раз в год, поэтому горячие пути (списание, операции)
+# не ходят за ними в БД на каждый запрос.
+# Записи в stations / fuel-types вызывают invalidate(): в общем процессе (локальный шлюз)
+# это сбрасывает кэш сразу, отдельные облачные функции получают изменения по истечении TTL.
+REFCACHE_TTL = float(os.environ.get('REFCACHE_TTL', '60'))
+MISS_RELOAD_INTERVAL = 1.0
+
+
+STATIONS_QUERY = "SELECT id, name, code_1c, address FROM stations"
+FUEL_TYPES_QUERY = "SELECT id, name, code_1c FROM fuel_types"
+
+
+def _build_stations(rows: Iterable[Any]) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+    stations = [
+        {'id': row[0], 'name': row[1], 'code_1c': row[2], 'address': row[3]}
+        for row in rows
+    ]
+    return {
+        'by_id': {station['id']: station for station in stations},
+        'by_code_1c': {station['code_1c']: station for station in stations},
+        'by_name': {station['name']: station for station in stations},
+    }
+
+
+def _build_fuel_types(rows: Iterable[Any]) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+    fuel_types = [{'id': row[0], 'name': row[1], 'code_1c': row[2]} for row in rows]
+    return {'by_id': {fuel_type['id']: fuel_type for fuel_type in fuel_types}}
+
+
+class _CachedTable:
+    def __init__(self, query: str, build: Callable[[Iterable[Any]], Dict[str, Dict[Any, Dict[str, Any]]]]):
+        self.query = query
+        self.build = build
+        self.data: Optional[Dict[str, Dict[Any, Dict[str, Any]]]] = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+
+    def index(self, cur: Any, name: str) -> Dict[Any, Dict[str, Any]]:
+        data = self.data
+        if data is None or time.monotonic() - self.loaded_at > REFCACHE_TTL:
+            data = self.reload(cur)
+        return data[name]
+
+    def reload(self, cur: Any) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+        with self.lock:
+            cur.execute(self.query)
+            return self.store(self.build(cur.fetchall()))
+
+    def store(self, data: Dict[str, Dict[Any, Dict[str, Any]]]) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+        self.data = data
+        self.loaded_at = time.monotonic()
+        return data
+
+    def lookup(self, cur: Any, name: str, key: Any) -> Optional[Dict[str, Any]]:
+        '''
+        Поиск по индексу; при промахе справочник перечитывается (не чаще MISS_RELOAD_INTERVAL),
+        чтобы только что добавленная запись находилась без ожидания TTL
+        '''
+        found = self.index(cur, name).get(key)
+        if found is None and time.monotonic() - self.loaded_at > MISS_RELOAD_INTERVAL:
+            found = self.reload(cur)[name].get(key)
+        return found
+
+    async def index_async(self, conn: Any, name: str) -> Dict[Any, Dict[str, Any]]:
+        data = self.data
+        if data is None or time.monotonic() - self.loaded_at > REFCACHE_TTL:
+            data = await self.reload_async(conn)
+        return data[name]
+
+    async def reload_async(self, conn: Any) -> Dict[str, Dict[Any, Dict[str, Any]]]:
+        # Блокировку потоков нельзя держать на время await: параллельные задачи
+        # могут прочитать справочник одновременно, результат у них одинаковый
+        data = self.build(await conn.fetch(self.query))
+        with self.lock:
+            return self.store(data)
+
+    async def lookup_async(self, conn: Any, name: str, key: Any) -> Optional[Dict[str, Any]]:
+        '''
+        lookup для соединения asyncpg (adb)
+        '''
+        found = (await self.index_async(conn, name)).get(key)
+        if found is None and time.monotonic() - self.loaded_at > MISS_RELOAD_INTERVAL:
+            found = (await self.reload_async(conn))[name].get(key)
+        return found
+
+    def invalidate(self) -> None:
+        with self.lock:
+            self.data = None
+            self.loaded_at = 0.0
+
+
+_tables = {
+    'stations': _CachedTable(STATIONS_QUERY, _build_stations),
+    'fuel_types': _CachedTable(FUEL_TYPES_QUERY, _build_fuel_types),
+}
+
+
+def station_by_id(cur: Any, station_id: int) -> Optional[Dict[str, Any]]:
+    return _tables['stations'].lookup(cur, 'by_id', station_id)
+
+
+def station_by_code_1c(cur: Any, code_1c: str) -> Optional[Dict[str, Any]]:
+    return _tables['stations'].lookup(cur, 'by_code_1c', code_1c)
+
+
+def station_by_name(cur: Any, name: str) -> Optional[Dict[str, Any]]:
+    return _tables['stations'].lookup(cur, 'by_name', name)
+
+
+def fuel_type_by_id(cur: Any, fuel_type_id: int) -> Optional[Dict[str, Any]]:
+    return _tables['fuel_types'].lookup(cur, 'by_id', fuel_type_id)
+
+
+async def station_by_code_1c_async(conn: Any, code_1c: str) -> Optional[Dict[str, Any]]:
+    return await _tables['stations'].lookup_async(conn, 'by_code_1c', code_1c)
+
+
+async def fuel_type_by_id_async(conn: Any, fuel_type_id: int) -> Optional[Dict[str, Any]]:
+    return await _tables['fuel_types'].lookup_async(conn, 'by_id', fuel_type_id)
+
+
+def invalidate(*names: str) -> None:
+    '''
+    Сброс кэша после изменения справочника: invalidate('stations'), invalidate('fuel_types');
+    без аргументов сбрасываются все справочники
+    '''
+    for name in names or tuple(_tables):
+        _tables[name].invalidate()
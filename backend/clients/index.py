@@ -1,120 +1,81 @@
 import json
-import os
 import uuid
-import psycopg2
+import api
+import db
+import passwords
+import session
 from typing import Dict, Any
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    CRUD операции для клиентов
-    Args: event - dict с httpMethod (GET/POST/PUT/DELETE), body, queryStringParameters
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response с данными клиентов или результатом операции
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    cors_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-        'Access-Control-Allow-Headers': 'Content-Type, Accept',
-        'Access-Control-Max-Age': '86400'
-    }
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': cors_headers,
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        database_url = os.environ.get('DATABASE_URL')
-        if not database_url:
-            return {
-                'statusCode': 500,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    **cors_headers
-                },
-                'body': json.dumps({'error': 'Database configuration error'}),
-                'isBase64Encoded': False
-            }
-        
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        
-        if method == 'GET':
-            cursor.execute("""
-                SELECT id, inn, name, address, phone, email, login, admin, operator
-                FROM clients 
-                ORDER BY id
-            """)
+CLIENT_COLUMNS = ('id', 'inn', 'name', 'address', 'phone', 'email', 'login', 'admin', 'operator')
+# operator может быть NULL у старых записей: в ответе всегда true/false, как bool() до переноса на api
+
+def list_clients(request: api.Request) -> Dict[str, Any]:
+    claims = session.authorize(request.event)
+    params = request.params
+    if claims and not claims['admin']:
+        params = {**params, 'login': claims['login']}
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            conditional = api.Conditional(request, *db.table_version(cursor, ('clients',)), params)
+            if conditional.fresh:
+                return conditional.not_modified()
+            if params.get('login'):
+                cursor.execute("""
+                    SELECT id, inn, name, address, phone, email, login, admin, COALESCE(operator, false)
+                    FROM clients
+                    WHERE login = %s
+                """, (params['login'],))
+            else:
+                cursor.execute("""
+                    SELECT id, inn, name, address, phone, email, login, admin, COALESCE(operator, false)
+                    FROM clients
+                    ORDER BY id
+                """)
             rows = cursor.fetchall()
-            clients = []
-            for row in rows:
-                clients.append({
-                    'id': row[0],
-                    'inn': row[1],
-                    'name': row[2],
-                    'address': row[3],
-                    'phone': row[4],
-                    'email': row[5],
-                    'login': row[6],
-                    'admin': row[7],
-                    'operator': bool(row[8])
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    **cors_headers
-                },
-                'body': json.dumps({'clients': clients}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            
-            print(f"Creating client with data: {json.dumps(body_data, ensure_ascii=False)}")
-            
-            email = body_data.get('email', '').strip() or None
-            phone = body_data.get('phone', '').strip() or None
-            login = body_data.get('login', '').strip() or f'admin_{uuid.uuid4().hex[:8]}'
-            
-            print(f"Normalized values - email: {email}, phone: {phone}, login: {login}")
-            
+
+    return conditional.response({'clients': [dict(zip(CLIENT_COLUMNS, row)) for row in rows]})
+
+def create_client(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+
+    print(f"Creating client with data: {json.dumps({k: v for k, v in body_data.items() if k != 'password'}, ensure_ascii=False)}")
+
+    email = body_data.get('email', '').strip() or None
+    phone = body_data.get('phone', '').strip() or None
+    login = body_data.get('login', '').strip() or f'admin_{uuid.uuid4().hex[:8]}'
+
+    print(f"Normalized values - email: {email}, phone: {phone}, login: {login}")
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
-                SELECT COUNT(*) FROM clients 
-                WHERE login = %s 
-                   OR (email IS NOT NULL AND email = %s) 
+                SELECT COUNT(*) FROM clients
+                WHERE login = %s
+                   OR (email IS NOT NULL AND email = %s)
                    OR (phone IS NOT NULL AND phone = %s)
             """, (login, email, phone))
-            
+
             conflict_count = cursor.fetchone()[0]
             print(f"Conflicts found: {conflict_count}")
-            
+
             if conflict_count > 0:
                 cursor.execute("""
-                    SELECT login, email, phone FROM clients 
-                    WHERE login = %s 
-                       OR (email IS NOT NULL AND email = %s) 
+                    SELECT login, email, phone FROM clients
+                    WHERE login = %s
+                       OR (email IS NOT NULL AND email = %s)
                        OR (phone IS NOT NULL AND phone = %s)
                 """, (login, email, phone))
                 conflicts = cursor.fetchall()
                 print(f"Conflicting records: {conflicts}")
-            
+
             inn = body_data.get('inn', '').strip() or ''
 
             cursor.execute("""
                 INSERT INTO clients (inn, name, address, phone, email, login, password, admin, operator)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, inn, name, address, phone, email, login, admin, operator
+                RETURNING id, inn, name, address, phone, email, login, admin, COALESCE(operator, false)
             """, (
                 inn,
                 body_data.get('name', '').strip(),
@@ -122,48 +83,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 phone,
                 email,
                 login,
-                body_data.get('password'),
+                passwords.hash_password(body_data['password']) if body_data.get('password') else None,
                 body_data.get('admin', False),
                 body_data.get('operator', False)
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            
-            client = {
-                'id': row[0],
-                'inn': row[1],
-                'name': row[2],
-                'address': row[3],
-                'phone': row[4],
-                'email': row[5],
-                'login': row[6],
-                'admin': row[7],
-                'operator': bool(row[8])
-            }
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    **cors_headers
-                },
-                'body': json.dumps({'client': client}),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            client_id = body_data.get('id')
-            
+        conn.commit()
+
+    return api.json_response({'client': dict(zip(CLIENT_COLUMNS, row))}, 201)
+
+def update_client(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
-                UPDATE clients 
+                UPDATE clients
                 SET inn = %s, name = %s, address = %s, phone = %s, email = %s, login = %s, operator = %s
                 WHERE id = %s
-                RETURNING id, inn, name, address, phone, email, login, admin, operator
+                RETURNING id, inn, name, address, phone, email, login, admin, COALESCE(operator, false)
             """, (
                 body_data.get('inn'),
                 body_data.get('name'),
@@ -172,107 +111,40 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('email'),
                 body_data.get('login'),
                 body_data.get('operator', False),
-                client_id
+                body_data.get('id')
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            
-            if row:
-                client = {
-                    'id': row[0],
-                    'inn': row[1],
-                    'name': row[2],
-                    'address': row[3],
-                    'phone': row[4],
-                    'email': row[5],
-                    'login': row[6],
-                    'admin': row[7],
-                    'operator': bool(row[8])
-                }
-                
-                cursor.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        **cors_headers
-                    },
-                    'body': json.dumps({'client': client}),
-                    'isBase64Encoded': False
-                }
-            else:
-                cursor.close()
-                conn.close()
-                
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        **cors_headers
-                    },
-                    'body': json.dumps({'error': 'Client not found'}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'DELETE':
-            query_params = event.get('queryStringParameters', {})
-            client_id = query_params.get('id')
-            
-            if not client_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        **cors_headers
-                    },
-                    'body': json.dumps({'error': 'Client ID is required'}),
-                    'isBase64Encoded': False
-                }
-            
+        conn.commit()
+
+    if not row:
+        raise api.HttpError(404, 'Client not found')
+    return api.json_response({'client': dict(zip(CLIENT_COLUMNS, row))})
+
+def delete_client(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    client_id = request.params.get('id')
+    if not client_id:
+        raise api.HttpError(400, 'Client ID is required')
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("DELETE FROM clients WHERE id = %s", (client_id,))
-            conn.commit()
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    **cors_headers
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        else:
-            return {
-                'statusCode': 405,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    **cors_headers
-                },
-                'body': json.dumps({'error': 'Method not allowed'}),
-                'isBase64Encoded': False
-            }
-    
-    except Exception as e:
-        print(f"Error: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        
-        if 'conn' in locals():
-            conn.close()
-        
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                **cors_headers
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        conn.commit()
+
+    return api.json_response({'success': True})
+
+router = api.Router(
+    {'GET': list_clients, 'POST': create_client, 'PUT': update_client, 'DELETE': delete_client},
+    allow_headers=('Content-Type', 'Accept', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Server error: '
+)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    CRUD операции для клиентов
+    Args: event - dict с httpMethod (GET/POST/PUT/DELETE), body, queryStringParameters
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response с данными клиентов или результатом операции
+    '''
+    return router(event, context)
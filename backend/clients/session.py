@@ -0,0 +1,124 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import api
+
+# Подписанные токены сессии: функция auth выдает их при входе, остальные функции проверяют
+# подпись и срок локально (HMAC-SHA256 по SESSION_SECRET), без запроса к БД.
+# SESSION_REQUIRED=1 включает обязательную авторизацию; до этого запросы без токена
+# пропускаются (интеграции и старые клиенты), а запросы с токеном проверяются всегда.
+# Как только токены выдаются (задан SESSION_SECRET), без токена вызывающий получает не больше прав,
+# чем с токеном клиента: действия администратора и изменения, которые клиенту доступны только
+# для своих данных, требуют токен и до SESSION_REQUIRED=1
+SESSION_SECRET = os.environ.get('SESSION_SECRET', '')
+SESSION_TTL = int(os.environ.get('SESSION_TTL', str(12 * 3600)))
+SESSION_REQUIRED = os.environ.get('SESSION_REQUIRED', '0') == '1'
+TOKEN_HEADERS = ('x-auth-token', 'authorization')
+
+
+class SessionError(api.HttpError):
+    pass
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(SESSION_SECRET.encode(), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def issue(user_id: int, login: str, admin: bool, operator: bool) -> Optional[Tuple[str, int]]:
+    '''
+    Токен сессии и время истечения (unix time); None, если SESSION_SECRET не настроен
+    '''
+    if not SESSION_SECRET:
+        return None
+    now = int(time.time())
+    expires_at = now + SESSION_TTL
+    claims = {
+        'sub': user_id,
+        'login': login,
+        'admin': bool(admin),
+        'operator': bool(operator),
+        'iat': now,
+        'exp': expires_at,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    return f'{payload}.{_sign(payload)}', expires_at
+
+
+def verify(token: str) -> Dict[str, Any]:
+    '''
+    Проверка подписи и срока; возвращает claims (sub, login, admin, operator, exp)
+    '''
+    if not SESSION_SECRET:
+        raise SessionError(500, 'Session configuration error')
+    payload, _, signature = token.partition('.')
+    try:
+        if not payload or not signature or not hmac.compare_digest(signature.encode('ascii'), _sign(payload).encode('ascii')):
+            raise SessionError(401, 'Недействительный токен сессии')
+        claims = json.loads(_b64decode(payload))
+        expires_at = int(claims.get('exp', 0))
+    except (ValueError, TypeError, AttributeError):
+        # Не-ASCII символы, испорченный base64 или JSON, claims не объект
+        raise SessionError(401, 'Недействительный токен сессии')
+    if expires_at <= time.time():
+        raise SessionError(401, 'Срок действия сессии истек')
+    return claims
+
+
+def token_from_event(event: Dict[str, Any]) -> Optional[str]:
+    headers = {name.lower(): value for name, value in (event.get('headers') or {}).items()}
+    for name in TOKEN_HEADERS:
+        value = (headers.get(name) or '').strip()
+        if name == 'authorization' and value.lower().startswith('bearer '):
+            value = value[7:].strip()
+        if value:
+            return value
+    return None
+
+
+def anonymous_allowed(admin: bool = False) -> bool:
+    '''
+    Пропускается ли запрос без токена: до SESSION_REQUIRED=1 — да, кроме действий администратора
+    при настроенных сессиях (без SESSION_SECRET токенов нет ни у кого)
+    '''
+    return not SESSION_REQUIRED and not (admin and SESSION_SECRET)
+
+
+def authorize(event: Dict[str, Any], admin: bool = False) -> Optional[Dict[str, Any]]:
+    '''
+    Claims сессии вызывающего или None (токена нет, и запрос без токена пропускается).
+    admin=True требует роль администратора: без токена — 401, с токеном не администратора — 403
+    '''
+    token = token_from_event(event)
+    if not token:
+        if not anonymous_allowed(admin):
+            raise SessionError(401, 'Требуется авторизация')
+        return None
+    claims = verify(token)
+    if admin and not claims.get('admin'):
+        raise SessionError(403, 'Недостаточно прав')
+    return claims
+
+
+def require_admin(claims: Optional[Dict[str, Any]]) -> None:
+    '''
+    Для уже полученных claims: запрет действия, если вызывающий вошел не администратором
+    или не вошел при настроенных сессиях
+    '''
+    if claims is None:
+        if not anonymous_allowed(admin=True):
+            raise SessionError(401, 'Требуется авторизация')
+    elif not claims.get('admin'):
+        raise SessionError(403, 'Недостаточно прав')
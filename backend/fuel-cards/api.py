@@ -0,0 +1,327 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import traceback
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+try:
+    import brotli
+except ImportError:
+    # brotli есть в requirements только у функций с большими списками; без него ответы сжимаются gzip
+    brotli = None
+
+# Общий каркас функций: разбор запроса, выбор обработчика по методу, ответы JSON
+# и единое преобразование ошибок. Заголовки собираются один раз при загрузке модуля,
+# JSON кодируется C-энкодером без пробелов и \u-экранирования кириллицы; Decimal и datetime
+# из строк курсора преобразуются прямо при кодировании. Числа больших выборок выгоднее
+# приводить к float8 в самом SQL: psycopg2 отдает их сразу как float
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+# Сжатие ответов Router(compress=True): тела меньше порога отдаются как есть
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '2048'))
+GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', '5'))
+
+
+def _format_datetime(value: datetime) -> str:
+    # isoformat в разы быстрее strftime('%Y-%m-%d %H:%M') и для времени без зоны дает ту же строку.
+    # Время с зоной и годы до 1000 (strftime не дополняет год нулями) форматируются как раньше
+    if value.tzinfo is None and value.year >= 1000:
+        return value.isoformat(' ', 'minutes')
+    return value.strftime('%Y-%m-%d %H:%M')
+
+
+# Преобразование по точному типу: один поиск в dict вместо цепочки isinstance на каждое значение
+_CONVERTERS: Dict[type, Callable[[Any], Any]] = {
+    Decimal: float,
+    datetime: _format_datetime,
+    date: date.isoformat
+}
+
+
+def _default(value: Any) -> Any:
+    converter = _CONVERTERS.get(type(value))
+    if converter is not None:
+        return converter(value)
+    if isinstance(value, datetime):
+        return _format_datetime(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default).encode
+
+
+def dumps(value: Any) -> str:
+    '''
+    JSON для ответа: Decimal → число, datetime → «YYYY-MM-DD HH:MM», date → «YYYY-MM-DD»
+    '''
+    return _encode(value)
+
+
+class HttpError(Exception):
+    '''
+    Ошибка с HTTP-статусом: Router превращает ее в ответ {'error': message, ...extra}
+    '''
+
+    def __init__(self, status_code: int, message: str, **extra: Any):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.extra = extra
+
+
+def json_response(body: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    response_headers = dict(JSON_HEADERS)
+    if headers:
+        response_headers.update(headers)
+    return {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': _encode(body),
+        'isBase64Encoded': False
+    }
+
+
+def error_response(status_code: int, message: str, **extra: Any) -> Dict[str, Any]:
+    return json_response({'error': message, **extra}, status_code)
+
+
+def rows_payload(request: 'Request', key: str, columns: Sequence[str], rows: List[Sequence[Any]]) -> Dict[str, Any]:
+    '''
+    Строки списка: по умолчанию {key: [{поле: значение}, ...]}; с ?layout=columns —
+    {'fields': [...], 'rows': [[...], ...]}, где имена полей не повторяются в каждой строке
+    '''
+    if request.params.get('layout') == 'columns':
+        return {'fields': list(columns), 'rows': rows}
+    return {key: [dict(zip(columns, row)) for row in rows]}
+
+
+class Request:
+    __slots__ = ('event', 'method', 'params', 'invalid_json', '_headers', '_json')
+
+    def __init__(self, event: Dict[str, Any], method: str, invalid_json: str = 'Invalid JSON'):
+        self.event = event
+        self.method = method
+        self.invalid_json = invalid_json
+        self.params: Dict[str, Any] = event.get('queryStringParameters') or {}
+        self._headers: Optional[Dict[str, str]] = None
+        self._json: Any = None
+
+    def header(self, name: str) -> Optional[str]:
+        if self._headers is None:
+            self._headers = {key.lower(): value for key, value in (self.event.get('headers') or {}).items()}
+        return self._headers.get(name.lower())
+
+    @property
+    def json(self) -> Any:
+        '''
+        Тело запроса, разобранное один раз; пустое тело — пустой dict
+        '''
+        if self._json is None:
+            raw = self.event.get('body') or '{}'
+            try:
+                self._json = json.loads(raw)
+            except ValueError:
+                raise HttpError(400, self.invalid_json)
+        return self._json
+
+
+def _accepted_encodings(request: Request) -> Dict[str, float]:
+    accepted: Dict[str, float] = {}
+    for part in (request.header('Accept-Encoding') or '').split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name.strip():
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def accepts_encoding(request: Request, encoding: str) -> bool:
+    '''
+    Принимает ли клиент ответ в кодировке encoding (Accept-Encoding с учетом q=0 и *)
+    '''
+    accepted = _accepted_encodings(request)
+    return accepted.get(encoding, accepted.get('*', 0.0)) > 0
+
+
+def accepted_encoding(request: Request) -> Optional[str]:
+    '''
+    Кодировка сжатия по Accept-Encoding с учетом q: br (если установлен brotli), иначе gzip
+    '''
+    for encoding in ('br', 'gzip') if brotli is not None else ('gzip',):
+        if accepts_encoding(request, encoding):
+            return encoding
+    return None
+
+
+def compress(request: Request, response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Сжимает JSON-ответ 200 размером от COMPRESS_MIN_BYTES; тело возвращается в base64
+    с isBase64Encoded, как у выгрузки операций
+    '''
+    if response.get('statusCode') != 200 or response.get('isBase64Encoded'):
+        return response
+    headers = dict(response['headers'])
+    headers['Vary'] = f"{headers['Vary']}, Accept-Encoding" if headers.get('Vary') else 'Accept-Encoding'
+    body = response.get('body') or ''
+    encoding = accepted_encoding(request) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding is None:
+        return {**response, 'headers': headers}
+    raw = body.encode('utf-8')
+    if encoding == 'br':
+        data = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(raw, compresslevel=GZIP_LEVEL, mtime=0)
+    headers['Content-Encoding'] = encoding
+    return {**response, 'headers': headers, 'body': base64.b64encode(data).decode('ascii'), 'isBase64Encoded': True}
+
+
+class Conditional:
+    '''
+    Условный GET по версии данных (db.table_version): ETag считается из версии таблиц
+    и параметров, от которых зависит ответ (scope), Last-Modified — из времени изменения.
+    fresh — копия клиента актуальна, и вместо выполнения запроса списка можно вернуть 304.
+    Cache-Control: no-cache — браузер хранит ответ, но перед использованием всегда сверяет версию
+    '''
+
+    def __init__(self, request: Request, version: str, last_modified: Optional[datetime], scope: Any = None):
+        self.request = request
+        digest = hashlib.sha1(dumps([version, scope]).encode('utf-8')).hexdigest()[:20]
+        self.etag = f'W/"{digest}"'
+        self.last_modified = last_modified.replace(microsecond=0) if last_modified else None
+        self.headers = {
+            'ETag': self.etag,
+            'Cache-Control': 'private, no-cache',
+            'Vary': 'X-Auth-Token, Authorization'
+        }
+        if self.last_modified:
+            self.headers['Last-Modified'] = format_datetime(self.last_modified.astimezone(timezone.utc), usegmt=True)
+
+    @property
+    def fresh(self) -> bool:
+        if_none_match = self.request.header('If-None-Match')
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(',')}
+            # Слабое сравнение: W/"x" и "x" совпадают
+            return '*' in tags or self.etag in tags or self.etag[2:] in tags
+        if_modified_since = self.request.header('If-Modified-Since')
+        if if_modified_since and self.last_modified:
+            try:
+                return self.last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def not_modified(self) -> Dict[str, Any]:
+        return {
+            'statusCode': 304,
+            'headers': {'Access-Control-Allow-Origin': '*', **self.headers},
+            'body': '',
+            'isBase64Encoded': False
+        }
+
+    def response(self, body: Any) -> Dict[str, Any]:
+        return json_response(body, headers=self.headers)
+
+
+class Router:
+    '''
+    Диспетчер handler(event, context) по httpMethod:
+    handler = api.Router({'GET': list_items, 'POST': create_item}, allow_headers=('Content-Type',))
+    Ответ на OPTIONS и 405 строятся из списка методов; HttpError → ответ с ее статусом,
+    прочие исключения → 500 с записью трассировки в лог. Тексты стандартных ошибок
+    переопределяются для функций, у которых клиенты уже разбирают свои сообщения (1С).
+    compress=True — сжатие ответов по Accept-Encoding (см. compress)
+    '''
+
+    def __init__(
+        self,
+        routes: Dict[str, Callable[[Request], Dict[str, Any]]],
+        allow_headers: Iterable[str] = ('Content-Type',),
+        default_method: str = 'GET',
+        requires_database: bool = True,
+        error_prefix: str = '',
+        method_not_allowed: str = 'Method not allowed',
+        database_error: str = 'Database configuration error',
+        invalid_json: str = 'Invalid JSON',
+        compress: bool = False
+    ):
+        self.routes = routes
+        self.compress = compress
+        self.default_method = default_method
+        self.requires_database = requires_database
+        self.error_prefix = error_prefix
+        self.method_not_allowed = method_not_allowed
+        self.database_error = database_error
+        self.invalid_json = invalid_json
+        self.options_headers = {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': ', '.join(list(routes) + ['OPTIONS']),
+            'Access-Control-Allow-Headers': ', '.join(allow_headers),
+            'Access-Control-Max-Age': '86400'
+        }
+
+    def prepare(self, event: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Any, Optional[Request]]:
+        '''
+        Общая часть диспетчеризации: готовый ответ (OPTIONS, 405, нет БД) либо обработчик и запрос
+        '''
+        method = event.get('httpMethod') or self.default_method
+        if method == 'OPTIONS':
+            return {'statusCode': 200, 'headers': dict(self.options_headers), 'body': '', 'isBase64Encoded': False}, None, None
+        route = self.routes.get(method)
+        if route is None:
+            return error_response(405, self.method_not_allowed), None, None
+        if self.requires_database and not os.environ.get('DATABASE_URL'):
+            return error_response(500, self.database_error), None, None
+        return None, route, Request(event, method, self.invalid_json)
+
+    def finish(self, request: Request, response: Dict[str, Any]) -> Dict[str, Any]:
+        return compress(request, response) if self.compress else response
+
+    def failure(self, error: Exception) -> Dict[str, Any]:
+        if isinstance(error, HttpError):
+            return error_response(error.status_code, error.message, **error.extra)
+        print(traceback.format_exc())
+        return error_response(500, f'{self.error_prefix}{error}')
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response, route, request = self.prepare(event)
+        if response is not None:
+            return response
+        try:
+            return self.finish(request, route(request))
+        except Exception as e:
+            return self.failure(e)
+
+
+class AsyncRouter(Router):
+    '''
+    Router для async handler (adb): обработчики маршрутов — корутины,
+    поведение OPTIONS, 405 и ошибок то же, что у Router
+    '''
+
+    async def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        response, route, request = self.prepare(event)
+        if response is not None:
+            return response
+        try:
+            return self.finish(request, await route(request))
+        except Exception as e:
+            return self.failure(e)
@@ -1,104 +1,151 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
+import api
+import db
+import session
+from typing import Dict, Any, List, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+CLIENT_EDITABLE_FIELDS = {'id', 'status', 'block_reason', 'daily_limit'}
+UPDATABLE_FIELDS = (
+    'card_code', 'client_id', 'fuel_type_id', 'balance_liters',
+    'pin_code', 'status', 'block_reason', 'daily_limit'
+)
+
+def build_cards_filter(params: Dict[str, Any]) -> Tuple[str, List[Any]]:
     '''
-    API для управления топливными картами: получение, создание, обновление и удаление
-    Args: event - dict с httpMethod, body, queryStringParameters
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict
+    Формирует WHERE для выборки карт по параметрам запроса:
+    id, client_id, client_login, status, fuel_type_id, card_code, after_id (keyset-пагинация по id)
     '''
-    method: str = event.get('httpMethod', 'GET')
+    conditions: List[str] = []
+    values: List[Any] = []
     
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
+    int_filters = (
+        ('id', 'fc.id'),
+        ('client_id', 'fc.client_id'),
+        ('fuel_type_id', 'fc.fuel_type_id'),
+    )
+    for name, column in int_filters:
+        if params.get(name):
+            try:
+                values.append(int(params[name]))
+            except ValueError:
+                raise ValueError(f'Некорректное значение параметра {name}')
+            conditions.append(f'{column} = %s')
     
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Database configuration error'}),
-            'isBase64Encoded': False
-        }
+    if params.get('after_id'):
+        try:
+            values.append(int(params['after_id']))
+        except ValueError:
+            raise ValueError('Некорректное значение параметра after_id')
+        conditions.append('fc.id > %s')
+    if params.get('client_login'):
+        conditions.append('c.login = %s')
+        values.append(params['client_login'])
+    if params.get('status'):
+        conditions.append('fc.status = %s')
+        values.append(params['status'])
+    if params.get('card_code'):
+        conditions.append('fc.card_code = %s')
+        values.append(params['card_code'].strip())
     
+    where_sql = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+    return where_sql, values
+
+LIST_COLUMNS = (
+    'id', 'card_code', 'balance_liters', 'pin_code', 'client_name', 'fuel_type',
+    'client_id', 'fuel_type_id', 'status', 'block_reason', 'daily_limit'
+)
+# PIN-код карты видит только администратор
+CLIENT_LIST_COLUMNS = tuple(column for column in LIST_COLUMNS if column != 'pin_code')
+CARD_COLUMNS = (
+    'id', 'card_code', 'client_id', 'fuel_type_id', 'balance_liters',
+    'pin_code', 'status', 'block_reason', 'daily_limit'
+)
+# Пустые значения приводятся к значениям по умолчанию в SQL, а не по полям в Python
+CARD_RETURNING = """
+    RETURNING id, card_code, client_id, fuel_type_id,
+        COALESCE(balance_liters, 0), pin_code,
+        COALESCE(NULLIF(status, ''), 'активна'), COALESCE(block_reason, ''),
+        COALESCE(daily_limit, 0)
+"""
+
+def card_with_names(cursor, row) -> Dict[str, Any]:
+    cursor.execute("""
+        SELECT c.name, ft.name
+        FROM clients c, fuel_types ft
+        WHERE c.id = %s AND ft.id = %s
+    """, (row[2], row[3]))
+    names = cursor.fetchone()
+    card = dict(zip(CARD_COLUMNS, row))
+    card['client_name'] = names[0] if names else ''
+    card['fuel_type'] = names[1] if names else ''
+    return card
+
+def list_cards(request: api.Request) -> Dict[str, Any]:
+    claims = session.authorize(request.event)
+    params = request.params
+    if claims is None:
+        # Без токена список карт всех клиентов отдается только там, где токенов еще нет
+        # (SESSION_SECRET не задан), и без PIN-кодов
+        session.require_admin(claims)
+    admin = bool(claims and claims['admin'])
+    if claims and not admin:
+        params = {**params, 'client_id': str(claims['sub'])}
+    columns = LIST_COLUMNS if admin else CLIENT_LIST_COLUMNS
     try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        
-        if method == 'GET':
-            cursor.execute("""
+        where_sql, values = build_cards_filter(params)
+        limit = int(params.get('limit') or DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        raise api.HttpError(400, str(e))
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    values.append(limit + 1)
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
                 SELECT 
                     fc.id, 
                     fc.card_code, 
-                    fc.balance_liters, 
-                    fc.pin_code,
+                    COALESCE(fc.balance_liters, 0)::float8, {'fc.pin_code,' if admin else ''}
                     c.name as client_name,
                     ft.name as fuel_type,
                     fc.client_id,
                     fc.fuel_type_id,
-                    fc.status,
-                    fc.block_reason,
-                    fc.daily_limit
+                    COALESCE(NULLIF(fc.status, ''), 'активна'),
+                    COALESCE(fc.block_reason, ''),
+                    COALESCE(fc.daily_limit, 0)::float8
                 FROM fuel_cards fc
                 LEFT JOIN clients c ON fc.client_id = c.id
                 LEFT JOIN fuel_types ft ON fc.fuel_type_id = ft.id
+                {where_sql}
                 ORDER BY fc.id
-            """)
+                LIMIT %s
+            """, tuple(values))
             rows = cursor.fetchall()
-            
-            cards = []
-            for row in rows:
-                cards.append({
-                    'id': row[0],
-                    'card_code': row[1],
-                    'balance_liters': float(row[2]) if row[2] else 0.0,
-                    'pin_code': row[3],
-                    'client_name': row[4],
-                    'fuel_type': row[5],
-                    'client_id': row[6],
-                    'fuel_type_id': row[7],
-                    'status': row[8] if row[8] else 'активна',
-                    'block_reason': row[9] if row[9] else '',
-                    'daily_limit': float(row[10]) if row[10] else 0.0
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'cards': cards}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            
+
+    # Баланс карты меняется при каждой заправке, и версия таблицы fuel_cards не ведется (V0019):
+    # ETag считается по самой странице. Запрос выполняется всегда, 304 экономит сериализацию,
+    # сжатие и передачу списка, если на странице ничего не изменилось
+    conditional = api.Conditional(request, '', None, [params, rows])
+    if conditional.fresh:
+        return conditional.not_modified()
+
+    next_after_id = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_after_id = rows[-1][0]
+
+    return conditional.response({**api.rows_payload(request, 'cards', columns, rows), 'next_after_id': next_after_id})
+
+def create_card(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
                 INSERT INTO fuel_cards (card_code, client_id, fuel_type_id, balance_liters, pin_code, status, block_reason, daily_limit)
                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, card_code, client_id, fuel_type_id, balance_liters, pin_code, status, block_reason, daily_limit
-            """, (
+            """ + CARD_RETURNING, (
                 body_data.get('card_code'),
                 body_data.get('client_id'),
                 body_data.get('fuel_type_id'),
@@ -108,201 +155,90 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('block_reason', ''),
                 body_data.get('daily_limit', 0)
             ))
-            
-            row = cursor.fetchone()
-            
-            cursor.execute("""
-                SELECT c.name, ft.name
-                FROM clients c, fuel_types ft
-                WHERE c.id = %s AND ft.id = %s
-            """, (row[2], row[3]))
-            
-            names = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            card = {
-                'id': row[0],
-                'card_code': row[1],
-                'client_id': row[2],
-                'fuel_type_id': row[3],
-                'balance_liters': float(row[4]) if row[4] else 0.0,
-                'pin_code': row[5],
-                'status': row[6] if row[6] else 'активна',
-                'block_reason': row[7] if row[7] else '',
-                'daily_limit': float(row[8]) if row[8] else 0.0,
-                'client_name': names[0] if names else '',
-                'fuel_type': names[1] if names else ''
-            }
-            
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'card': card}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            card_id = body_data.get('id')
-            
-            # Динамическое формирование UPDATE запроса только для переданных полей
-            update_fields = []
-            update_values = []
-            
-            if 'card_code' in body_data:
-                update_fields.append('card_code = %s')
-                update_values.append(body_data['card_code'])
-            if 'client_id' in body_data:
-                update_fields.append('client_id = %s')
-                update_values.append(body_data['client_id'])
-            if 'fuel_type_id' in body_data:
-                update_fields.append('fuel_type_id = %s')
-                update_values.append(body_data['fuel_type_id'])
-            if 'balance_liters' in body_data:
-                update_fields.append('balance_liters = %s')
-                update_values.append(body_data['balance_liters'])
-            if 'pin_code' in body_data:
-                update_fields.append('pin_code = %s')
-                update_values.append(body_data['pin_code'])
-            if 'status' in body_data:
-                update_fields.append('status = %s')
-                update_values.append(body_data['status'])
-            if 'block_reason' in body_data:
-                update_fields.append('block_reason = %s')
-                update_values.append(body_data['block_reason'])
-            if 'daily_limit' in body_data:
-                update_fields.append('daily_limit = %s')
-                update_values.append(body_data['daily_limit'])
-            
-            if not update_fields:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'No fields to update'}),
-                    'isBase64Encoded': False
-                }
-            
-            update_values.append(card_id)
-            update_query = f"""
-                UPDATE fuel_cards
-                SET {', '.join(update_fields)}
-                WHERE id = %s
-                RETURNING id, card_code, client_id, fuel_type_id, balance_liters, pin_code, status, block_reason, daily_limit
-            """
-            
+            card = card_with_names(cursor, cursor.fetchone())
+        conn.commit()
+
+    return api.json_response({'card': card}, 201)
+
+def update_card(request: api.Request) -> Dict[str, Any]:
+    claims = session.authorize(request.event)
+    body_data = request.json
+    card_id = body_data.get('id')
+
+    # Клиент может менять у своих карт только блокировку и дневной лимит.
+    # Без токена — любые поля любой карты, но только там, где доступны действия администратора
+    if claims is None:
+        session.require_admin(claims)
+    owner_id = None
+    if claims and not claims['admin']:
+        if set(body_data) - CLIENT_EDITABLE_FIELDS:
+            raise session.SessionError(403, 'Недостаточно прав')
+        owner_id = claims['sub']
+
+    # Динамическое формирование UPDATE запроса только для переданных полей
+    update_fields = []
+    update_values = []
+    for field in UPDATABLE_FIELDS:
+        if field in body_data:
+            update_fields.append(f'{field} = %s')
+            update_values.append(body_data[field])
+
+    if not update_fields:
+        raise api.HttpError(400, 'No fields to update')
+
+    update_values.append(card_id)
+    owner_sql = ''
+    if owner_id is not None:
+        owner_sql = ' AND client_id = %s'
+        update_values.append(owner_id)
+    update_query = f"""
+        UPDATE fuel_cards
+        SET {', '.join(update_fields)}
+        WHERE id = %s{owner_sql}
+    """ + CARD_RETURNING
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute(update_query, tuple(update_values))
-            
             row = cursor.fetchone()
-            
-            if row:
-                cursor.execute("""
-                    SELECT c.name, ft.name
-                    FROM clients c, fuel_types ft
-                    WHERE c.id = %s AND ft.id = %s
-                """, (row[2], row[3]))
-                
-                names = cursor.fetchone()
-                conn.commit()
-                cursor.close()
-                conn.close()
-                
-                card = {
-                    'id': row[0],
-                    'card_code': row[1],
-                    'client_id': row[2],
-                    'fuel_type_id': row[3],
-                    'balance_liters': float(row[4]) if row[4] else 0.0,
-                    'pin_code': row[5],
-                    'status': row[6] if row[6] else 'активна',
-                    'block_reason': row[7] if row[7] else '',
-                    'daily_limit': float(row[8]) if row[8] else 0.0,
-                    'client_name': names[0] if names else '',
-                    'fuel_type': names[1] if names else ''
-                }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'card': card}),
-                    'isBase64Encoded': False
-                }
-            else:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Card not found'}),
-                    'isBase64Encoded': False
-                }
-        
-        if method == 'DELETE':
-            params = event.get('queryStringParameters') or {}
-            card_id = params.get('id')
-            
-            if not card_id:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Card ID required'}),
-                    'isBase64Encoded': False
-                }
-            
+            card = card_with_names(cursor, row) if row else None
+        conn.commit()
+
+    if not card:
+        raise api.HttpError(404, 'Card not found')
+    if owner_id is not None:
+        card.pop('pin_code')
+    return api.json_response({'card': card})
+
+def delete_card(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    card_id = request.params.get('id')
+    if not card_id:
+        raise api.HttpError(400, 'Card ID required')
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("DELETE FROM fuel_cards WHERE id = %s", (card_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
\ No newline at end of file
+        conn.commit()
+
+    return api.json_response({'success': True})
+
+router = api.Router(
+    {'GET': list_cards, 'POST': create_card, 'PUT': update_card, 'DELETE': delete_card},
+    allow_headers=('Content-Type', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Server error: ',
+    compress=True
+)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для управления топливными картами: получение, создание, обновление и удаление.
+    GET поддерживает фильтры id, client_id, client_login, status, fuel_type_id, card_code
+    и постраничную выборку limit + after_id; pin_code отдается только администратору; ?layout=columns — список в виде {fields, rows}.
+    Ответы от COMPRESS_MIN_BYTES сжимаются br/gzip по Accept-Encoding
+    Args: event - dict с httpMethod, body, queryStringParameters
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict
+    '''
+    return router(event, context)
@@ -0,0 +1,401 @@
+import functools
+import inspect
+import json
+import os
+import re
+import select
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '5'))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+# Соединение, простоявшее в пуле дольше DB_POOL_HEALTHCHECK_IDLE секунд, перед выдачей проверяется
+# запросом SELECT 1. Более свежие выдаются без запроса: закрытие сервером (перезапуск, завершение сеанса)
+# видно и без него — сокет такого соединения становится читаемым (см. _is_alive). Ограничение: соединение,
+# пропавшее без ответа сервера (обрыв сети) за это окно, обнаружится только на первом запросе,
+# и тот вызов завершится ошибкой; такие соединения со временем закрывают keepalives
+HEALTHCHECK_IDLE_SECONDS = float(os.environ.get('DB_POOL_HEALTHCHECK_IDLE', '30'))
+SLOW_QUERY_MS = float(os.environ.get('DB_SLOW_QUERY_MS', '200'))
+LOG_REQUESTS = os.environ.get('DB_LOG_REQUESTS', '1') != '0'
+# 0 — выполнять Statement обычными запросами (например, за pgbouncer в режиме транзакций,
+# где следующий запрос может попасть в другой сеанс, не знающий PREPARE)
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1') != '0'
+MAX_LOGGED_STATEMENT_LENGTH = 500
+
+# ContextVar, а не threading.local: статистика своя и у каждого потока, и у каждой задачи asyncio
+_request_stats: ContextVar[Optional['RequestStats']] = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    '''
+    Разбивка времени одного вызова функции: ожидание/создание соединения (pool),
+    запросы к БД (db), число запросов
+    '''
+    __slots__ = ('function_name', 'started', 'pool_ms', 'db_ms', 'queries')
+
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.started = time.perf_counter()
+        self.pool_ms = 0.0
+        self.db_ms = 0.0
+        self.queries = 0
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def _log(record: Dict[str, Any]) -> None:
+    print(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _statement_text(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', errors='replace')
+    return ' '.join(str(query).split())[:MAX_LOGGED_STATEMENT_LENGTH]
+
+
+def record_query(query: Any, started: float, counted: bool = True) -> None:
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = current_stats()
+    if stats is not None:
+        stats.db_ms += elapsed_ms
+        if counted:
+            stats.queries += 1
+    if counted and elapsed_ms >= SLOW_QUERY_MS:
+        _log({
+            'event': 'slow_query',
+            'function': stats.function_name if stats else None,
+            'ms': round(elapsed_ms, 1),
+            'statement': _statement_text(query),
+        })
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор с учетом времени запросов в статистике текущего вызова; медленные запросы
+    (от DB_SLOW_QUERY_MS) пишутся в лог с текстом оператора. Для именованных (серверных)
+    курсоров учитывается и чтение строк — данные приходят с сервера при выборке
+    '''
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, started)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, started)
+
+    def fetchmany(self, size: Any = None) -> Any:
+        if self.name is None:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        finally:
+            record_query(None, started, counted=False)
+
+    def __next__(self) -> Any:
+        if self.name is None:
+            return super().__next__()
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            record_query(None, started, counted=False)
+
+
+class Connection(psycopg2.extensions.connection):
+    '''
+    Соединение пула; prepared — имена Statement, уже подготовленных в его сеансе
+    '''
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.prepared: Set[str] = set()
+
+
+def positional(query: str, types: Dict[str, str]) -> Tuple[str, Tuple[str, ...]]:
+    '''
+    Запрос с %(name)s → запрос с $1, $2... и явными типами (PREPARE, asyncpg)
+    и порядок имен параметров
+    '''
+    names: List[str] = []
+
+    def replace(match: Any) -> str:
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}::{types[name]}'
+
+    return re.sub(r'%\((\w+)\)s', replace, query), tuple(names)
+
+
+_statements: Dict[str, str] = {}
+
+
+class Statement:
+    '''
+    Фиксированный горячий запрос, выполняемый как серверный prepared statement:
+    на каждом соединении пула он один раз готовится (PREPARE), дальше вызывается
+    EXECUTE name(...) — сервер не разбирает и не переписывает текст запроса, а после
+    пяти вызовов переходит на сохраненный общий план и перестает планировать.
+    query — текст с %(name)s, types — типы параметров PostgreSQL.
+    text / params — тот же запрос с $1... для asyncpg, который готовит запросы сам
+    '''
+
+    def __init__(self, name: str, query: str, types: Dict[str, str]):
+        self.name = name
+        self.query = query
+        self.text, self.params = positional(query, types)
+        if _statements.setdefault(name, self.text) != self.text:
+            raise ValueError(f'Statement {name} уже объявлен с другим текстом')
+        placeholders = ', '.join(['%s'] * len(self.params))
+        self.execute_sql = f'EXECUTE {name} ({placeholders})' if self.params else f'EXECUTE {name}'
+
+    def args(self, params: Dict[str, Any]) -> List[Any]:
+        return [params[name] for name in self.params]
+
+    def execute(self, cur: Any, params: Dict[str, Any]) -> None:
+        prepared = getattr(cur.connection, 'prepared', None)
+        if not PREPARED_STATEMENTS or prepared is None:
+            cur.execute(self.query, params)
+            return
+        if self.name not in prepared:
+            # PREPARE не откатывается вместе с транзакцией: имя запоминается сразу после успеха
+            cur.execute(f'PREPARE {self.name} AS {self.text}')
+            prepared.add(self.name)
+        cur.execute(self.execute_sql, self.args(params))
+
+
+CONNECT_KWARGS = {
+    'connection_factory': Connection,
+    'cursor_factory': TimedCursor,
+    'connect_timeout': 5,
+    'keepalives': 1,
+    'keepalives_idle': 30,
+    'keepalives_interval': 10,
+    'keepalives_count': 3,
+}
+
+_pool: Optional[pg_pool.ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+_last_used: Dict[int, float] = {}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+def get_pool() -> pg_pool.ThreadedConnectionPool:
+    '''
+    Пул соединений уровня модуля: создается при первом вызове и переживает
+    «теплые» вызовы функции, поэтому повторный запрос не платит за TCP+TLS+auth
+    '''
+    global _pool
+    if _pool is None or _pool.closed:
+        with _pool_lock:
+            if _pool is None or _pool.closed:
+                dsn = os.environ.get('DATABASE_URL')
+                if not dsn:
+                    raise RuntimeError('DATABASE_URL не настроен')
+                _pool = pg_pool.ThreadedConnectionPool(
+                    POOL_MIN_SIZE, POOL_MAX_SIZE, dsn, **CONNECT_KWARGS
+                )
+    return _pool
+
+
+def _is_alive(conn: Any) -> bool:
+    if conn.closed:
+        return False
+    # Простаивающему соединению сервер ничего не присылает; читаемый сокет — это сообщение
+    # о завершении сеанса или закрытие TCP. Проверка без обращения к серверу, для любого простоя
+    try:
+        readable, _, _ = select.select([conn], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    if readable:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < HEALTHCHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _discard(pool: pg_pool.ThreadedConnectionPool, conn: Any) -> None:
+    _last_used.pop(id(conn), None)
+    try:
+        pool.putconn(conn, close=True)
+    except pg_pool.PoolError:
+        pass
+
+
+def acquire() -> Any:
+    '''
+    Берет соединение из пула с проверкой живости; битое соединение
+    закрывается и заменяется новым. Блокирует не дольше POOL_ACQUIRE_TIMEOUT
+    '''
+    started = time.perf_counter()
+    try:
+        if not _slots.acquire(timeout=POOL_ACQUIRE_TIMEOUT):
+            raise PoolTimeout('Нет свободных соединений с базой данных')
+        try:
+            pool = get_pool()
+            # Каждое выброшенное соединение уменьшает число простаивающих в пуле; когда они
+            # кончаются, пул открывает новое — оно проходит проверку (или connect бросает ошибку)
+            while True:
+                conn = pool.getconn()
+                if _is_alive(conn):
+                    return conn
+                _discard(pool, conn)
+        except Exception:
+            _slots.release()
+            raise
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.pool_ms += (time.perf_counter() - started) * 1000
+
+
+def release(conn: Any, broken: bool = False) -> None:
+    '''
+    Возвращает соединение в пул: незавершенная транзакция откатывается,
+    autocommit сбрасывается; закрытое или сломанное соединение выбрасывается
+    '''
+    pool = get_pool()
+    try:
+        if broken or conn.closed:
+            _discard(pool, conn)
+            return
+        try:
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            if conn.autocommit:
+                conn.autocommit = False
+        except psycopg2.Error:
+            _discard(pool, conn)
+            return
+        _last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn)
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    '''
+    Контекстный менеджер для работы с соединением из пула:
+    with db.connection() as conn: ...
+    '''
+    conn = acquire()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        release(conn, broken=broken)
+
+
+def table_version(cursor: Any, tables: Sequence[str]) -> Tuple[str, Optional[datetime]]:
+    '''
+    Версия набора таблиц по счетчикам table_versions (триггеры *_version):
+    строка вида «clients:12,fuel_cards:3051» и время последнего изменения
+    '''
+    cursor.execute("""
+        SELECT table_name, SUM(version), MAX(updated_at)
+        FROM table_versions
+        WHERE table_name = ANY(%s)
+        GROUP BY table_name
+    """, (list(tables),))
+    found = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    version = ','.join(f'{name}:{found[name][0] if name in found else 0}' for name in sorted(tables))
+    updated = [found[name][1] for name in tables if name in found]
+    return version, max(updated) if updated else None
+
+
+def _finish_request(stats: RequestStats, event: Dict[str, Any], response: Any) -> None:
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    app_ms = max(total_ms - stats.db_ms - stats.pool_ms, 0.0)
+    status = response.get('statusCode') if isinstance(response, dict) else 500
+    if isinstance(response, dict):
+        headers = response.get('headers') or {}
+        headers['Server-Timing'] = (
+            f'pool;dur={stats.pool_ms:.1f}, db;dur={stats.db_ms:.1f};desc="{stats.queries} queries", '
+            f'app;dur={app_ms:.1f}, total;dur={total_ms:.1f}'
+        )
+        headers['Timing-Allow-Origin'] = '*'
+        response['headers'] = headers
+    if LOG_REQUESTS:
+        _log({
+            'event': 'request',
+            'function': stats.function_name,
+            'method': (event or {}).get('httpMethod'),
+            'status': status,
+            'total_ms': round(total_ms, 1),
+            'pool_ms': round(stats.pool_ms, 1),
+            'db_ms': round(stats.db_ms, 1),
+            'app_ms': round(app_ms, 1),
+            'queries': stats.queries,
+        })
+
+
+def _function_name(context: Any) -> str:
+    return getattr(context, 'function_name', None) or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+
+
+def instrumented(handler: Callable[[Dict[str, Any], Any], Any]) -> Callable[[Dict[str, Any], Any], Any]:
+    '''
+    Декоратор handler: собирает разбивку времени вызова, добавляет заголовок
+    Server-Timing (pool, db, app — Python, включая сериализацию JSON, total)
+    и пишет структурированную строку лога с итогами запроса.
+    Подходит и для async handler (adb): статистика хранится в контексте задачи
+    '''
+    if inspect.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def async_wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            stats = RequestStats(_function_name(context))
+            token = _request_stats.set(stats)
+            response: Any = None
+            try:
+                response = await handler(event, context)
+                return response
+            finally:
+                _request_stats.reset(token)
+                _finish_request(stats, event, response)
+        return async_wrapper
+
+    @functools.wraps(handler)
+    def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        stats = RequestStats(_function_name(context))
+        token = _request_stats.set(stats)
+        response: Any = None
+        try:
+            response = handler(event, context)
+            return response
+        finally:
+            _request_stats.reset(token)
+            _finish_request(stats, event, response)
+    return wrapper
@@ -1,79 +1,41 @@
-import json
-import os
-import psycopg2
+import api
+import db
+import refcache
+import session
 from typing import Dict, Any
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    API для управления видами топлива: получение, создание, обновление и удаление
-    Args: event - dict с httpMethod, body, queryStringParameters
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Database configuration error'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        
-        if method == 'GET':
+FUEL_TYPE_COLUMNS = ('id', 'name', 'code_1c')
+
+def list_fuel_types(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event)
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            conditional = api.Conditional(request, *db.table_version(cursor, ('fuel_types',)))
+            if conditional.fresh:
+                return conditional.not_modified()
             cursor.execute("""
                 SELECT id, name, code_1c, created_at
                 FROM fuel_types
                 ORDER BY id
             """)
             rows = cursor.fetchall()
-            
-            fuel_types = []
-            for row in rows:
-                fuel_types.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'code_1c': row[2],
-                    'created_at': row[3].isoformat() if row[3] else None
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'fuel_types': fuel_types}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            
+
+    fuel_types = [
+        {
+            'id': row[0],
+            'name': row[1],
+            'code_1c': row[2],
+            'created_at': row[3].isoformat() if row[3] else None
+        }
+        for row in rows
+    ]
+    return conditional.response({'fuel_types': fuel_types})
+
+def create_fuel_type(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
                 INSERT INTO fuel_types (name, code_1c)
                 VALUES (%s, %s)
@@ -82,32 +44,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('name'),
                 body_data.get('code_1c')
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            fuel_type = {
-                'id': row[0],
-                'name': row[1],
-                'code_1c': row[2]
-            }
-            
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'fuel_type': fuel_type}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            fuel_type_id = body_data.get('id')
-            
+        conn.commit()
+    refcache.invalidate('fuel_types')
+
+    return api.json_response({'fuel_type': dict(zip(FUEL_TYPE_COLUMNS, row))}, 201)
+
+def update_fuel_type(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
                 UPDATE fuel_types
                 SET name = %s, code_1c = %s
@@ -116,91 +63,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             """, (
                 body_data.get('name'),
                 body_data.get('code_1c'),
-                fuel_type_id
+                body_data.get('id')
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            if row:
-                fuel_type = {
-                    'id': row[0],
-                    'name': row[1],
-                    'code_1c': row[2]
-                }
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'fuel_type': fuel_type}),
-                    'isBase64Encoded': False
-                }
-            else:
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Fuel type not found'}),
-                    'isBase64Encoded': False
-                }
-        
-        if method == 'DELETE':
-            params = event.get('queryStringParameters') or {}
-            fuel_type_id = params.get('id')
-            
-            if not fuel_type_id:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Fuel type ID required'}),
-                    'isBase64Encoded': False
-                }
-            
+        conn.commit()
+    refcache.invalidate('fuel_types')
+
+    if not row:
+        raise api.HttpError(404, 'Fuel type not found')
+    return api.json_response({'fuel_type': dict(zip(FUEL_TYPE_COLUMNS, row))})
+
+def delete_fuel_type(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    fuel_type_id = request.params.get('id')
+    if not fuel_type_id:
+        raise api.HttpError(400, 'Fuel type ID required')
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("DELETE FROM fuel_types WHERE id = %s", (fuel_type_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+        conn.commit()
+    refcache.invalidate('fuel_types')
+
+    return api.json_response({'success': True})
+
+router = api.Router(
+    {'GET': list_fuel_types, 'POST': create_fuel_type, 'PUT': update_fuel_type, 'DELETE': delete_fuel_type},
+    allow_headers=('Content-Type', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Server error: '
+)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для управления видами топлива: получение, создание, обновление и удаление
+    Args: event - dict с httpMethod, body, queryStringParameters
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict
+    '''
+    return router(event, context)
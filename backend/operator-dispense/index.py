@@ -1,211 +1,184 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
-from datetime import datetime, date
+import math
+import api
+import db
+import session
+import refcache
+import journal
+from typing import Dict, Any, Optional
+from datetime import date
+from psycopg2.errors import UniqueViolation
+from dispense import (
+    dispense, dispense_journaled, DispenseError, get_idempotency_key, validate_idempotency_key,
+    find_stored_response, store_response, group_commit
+)
+
+REPLAYED_HEADERS = {'Idempotent-Replayed': 'true'}
+
+CARD_INFO = db.Statement('operator_card_info', """
+    SELECT fc.id, fc.card_code, fc.fuel_type_id,
+           fc.balance_liters, c.name as client_name, fc.daily_limit,
+           COALESCE(u.liters, 0) as today_refueled
+    FROM fuel_cards fc
+    LEFT JOIN clients c ON fc.client_id = c.id
+    LEFT JOIN card_daily_usage u ON u.fuel_card_id = fc.id AND u.usage_date = %(today)s
+    WHERE fc.card_code = %(card_code)s
+""", {'today': 'date', 'card_code': 'varchar'})
+
+def replayed_response(body: Dict[str, Any], status_code: int = 200) -> Dict[str, Any]:
+    return api.json_response(body, status_code, REPLAYED_HEADERS)
+
+def card_info(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    card_code = request.params.get('card_code', '').strip()
+    if not card_code:
+        raise api.HttpError(400, 'Не указан номер карты')
+
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            CARD_INFO.execute(cur, {'today': date.today(), 'card_code': card_code})
+            row = cur.fetchone()
+
+            if not row:
+                raise api.HttpError(404, f'Карта {card_code} не найдена')
+
+            balance_liters = float(row[3]) if row[3] is not None else 0.0
+            daily_limit = float(row[5]) if row[5] is not None else 0.0
+            today_refueled = float(row[6]) if row[6] else 0.0
+            fuel_type = refcache.fuel_type_by_id(cur, row[2]) if row[2] is not None else None
+
+    available = balance_liters
+    if daily_limit > 0:
+        available = min(balance_liters, daily_limit - today_refueled)
+        available = max(0.0, available)
+
+    return api.json_response({
+        'card_code': row[1],
+        'fuel_type': fuel_type['name'] if fuel_type else '',
+        'balance_liters': balance_liters,
+        'daily_limit': daily_limit,
+        'available_balance': available,
+        'client_name': row[4] or ''
+    })
+
+def dispensed_body(card_code: str, quantity: float, result: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'success': True,
+        'card_code': card_code,
+        'quantity': quantity,
+        'previous_balance': result['previous_balance'],
+        'new_balance': result['new_balance']
+    }
+
+def validate_dispense(body: Any) -> Optional[str]:
+    '''
+    Проверка полей списания, как validate_refuel в refuel; возвращает текст ошибки или None.
+    Количество и код АЗС, как и раньше, принимаются и строками ("10", "1")
+    '''
+    if not isinstance(body, dict):
+        return 'Некорректный JSON'
+    if not str(body.get('card_code') or '').strip():
+        return 'Не указан номер карты'
+    quantity = body.get('quantity', 0)
+    try:
+        if isinstance(quantity, bool) or not math.isfinite(float(quantity)) or float(quantity) <= 0:
+            return 'Количество топлива должно быть больше 0'
+    except (TypeError, ValueError):
+        return 'Количество топлива должно быть больше 0'
+    station_id = body.get('station_id', 1)
+    try:
+        if isinstance(station_id, (bool, float)):
+            raise ValueError
+        int(station_id)
+    except (TypeError, ValueError):
+        return 'Некорректный код АЗС (station_id)'
+    return None
+
+def dispense_fuel(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body = request.json
+    error = validate_dispense(body)
+    if error:
+        raise api.HttpError(400, error)
+
+    card_code = str(body['card_code']).strip()
+    quantity = float(body['quantity'])
+    station_id = int(body.get('station_id', 1))
+    idempotency_key = get_idempotency_key(request.event, body)
+
+    key_error = validate_idempotency_key(idempotency_key)
+    if key_error:
+        raise api.HttpError(400, key_error)
+
+    # С журналом операций списание и так укорочено до одного запроса и фиксируется само
+    coordinator = None if journal.enabled() else group_commit()
+    if coordinator is not None:
+        def apply(cur: Any) -> Dict[str, Any]:
+            result = dispense(cur, card_code, quantity, comment='Панель оператора', station_id=station_id)
+            return dispensed_body(card_code, quantity, result)
+
+        status_code, response_body, replayed = coordinator.submit(card_code, 'operator-dispense', idempotency_key, apply).result()
+        if replayed:
+            return replayed_response(response_body, status_code)
+        return api.json_response(response_body, status_code)
+
+    with db.connection() as conn:
+        conn.autocommit = False
+        with conn.cursor() as cur:
+            if idempotency_key:
+                stored = find_stored_response(cur, idempotency_key)
+                if stored:
+                    return replayed_response(stored[1], stored[0])
+
+            entry = None
+            try:
+                if journal.enabled():
+                    result, entry = dispense_journaled(cur, card_code, quantity, station_id, comment='Панель оператора')
+                else:
+                    result = dispense(cur, card_code, quantity, comment='Панель оператора', station_id=station_id)
+            except DispenseError as e:
+                return api.json_response(e.body, e.status_code)
+
+            response_body = dispensed_body(card_code, quantity, result)
+
+            if idempotency_key:
+                try:
+                    store_response(cur, idempotency_key, 'operator-dispense', response_body)
+                except UniqueViolation:
+                    conn.rollback()
+                    stored = find_stored_response(cur, idempotency_key)
+                    return replayed_response(stored[1], stored[0])
+
+            if entry is not None:
+                # Запись операции на диске раньше, чем зафиксировано списание
+                journal.append(entry)
+            conn.commit()
+
+    return api.json_response(response_body)
+
+router = api.Router(
+    {'GET': card_info, 'POST': dispense_fuel},
+    allow_headers=('Content-Type', 'Idempotency-Key', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Ошибка: ',
+    method_not_allowed='Метод не поддерживается',
+    database_error='DATABASE_URL не настроен',
+    invalid_json='Некорректный JSON'
+)
+
+def start() -> None:
+    '''
+    Запуск в долгоживущем процессе (шлюз): с журналом операций разборщик сразу
+    дочитывает сегменты, оставшиеся от прошлого запуска
+    '''
+    if journal.enabled():
+        journal.get_journal()
 
+@db.instrumented
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Панель оператора: получение данных карты по коду и списание топлива.
     GET ?card_code=XXXX — получить данные карты
-    POST {card_code, quantity} — списать топливо
+    POST {card_code, quantity, station_id, idempotency_key} — списать топливо
+    С DISPENSE_JOURNAL_DIR строка операции пишется в локальный журнал и переносится в БД позже,
+    с DISPENSE_GROUP_COMMIT_MS одновременные списания фиксируются одной транзакцией
     '''
-    method: str = event.get('httpMethod', 'GET')
-
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'DATABASE_URL не настроен'})
-        }
-
-    conn = psycopg2.connect(dsn)
-
-    if method == 'GET':
-        params = event.get('queryStringParameters', {}) or {}
-        card_code = params.get('card_code', '').strip()
-
-        if not card_code:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Не указан номер карты'})
-            }
-
-        try:
-            with conn.cursor() as cur:
-                escaped = card_code.replace("'", "''")
-                cur.execute(f"""
-                    SELECT fc.id, fc.card_code, ft.name as fuel_type,
-                           fc.balance_liters, c.name as client_name, fc.daily_limit
-                    FROM fuel_cards fc
-                    LEFT JOIN clients c ON fc.client_id = c.id
-                    LEFT JOIN fuel_types ft ON fc.fuel_type_id = ft.id
-                    WHERE fc.card_code = '{escaped}'
-                """)
-                row = cur.fetchone()
-
-                if not row:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Карта {card_code} не найдена'})
-                    }
-
-                card_id = row[0]
-                balance_liters = float(row[3]) if row[3] is not None else 0.0
-                daily_limit = float(row[5]) if row[5] is not None else 0.0
-                available = balance_liters
-
-                if daily_limit > 0:
-                    today_start = date.today().strftime('%Y-%m-%d 00:00:00')
-                    today_end = date.today().strftime('%Y-%m-%d 23:59:59')
-                    cur.execute(f"""
-                        SELECT COALESCE(SUM(quantity), 0)
-                        FROM card_operations
-                        WHERE fuel_card_id = {card_id}
-                        AND operation_type = 'заправка'
-                        AND operation_date >= '{today_start}'
-                        AND operation_date <= '{today_end}'
-                    """)
-                    today_row = cur.fetchone()
-                    today_refueled = float(today_row[0]) if today_row and today_row[0] else 0.0
-                    available = min(balance_liters, daily_limit - today_refueled)
-                    available = max(0.0, available)
-
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'card_code': row[1],
-                        'fuel_type': row[2] or '',
-                        'balance_liters': balance_liters,
-                        'daily_limit': daily_limit,
-                        'available_balance': available,
-                        'client_name': row[4] or ''
-                    }, ensure_ascii=False)
-                }
-        finally:
-            conn.close()
-
-    if method == 'POST':
-        try:
-            body = json.loads(event.get('body', '{}'))
-        except json.JSONDecodeError:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Некорректный JSON'})
-            }
-
-        card_code = body.get('card_code', '').strip()
-        quantity = body.get('quantity', 0)
-        station_id = body.get('station_id', 1)
-
-        if not card_code:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Не указан номер карты'})
-            }
-
-        if not quantity or float(quantity) <= 0:
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Количество топлива должно быть больше 0'})
-            }
-
-        quantity = float(quantity)
-        station_id = int(station_id)
-
-        try:
-            conn.autocommit = False
-            with conn.cursor() as cur:
-                escaped = card_code.replace("'", "''")
-                cur.execute(f"""
-                    SELECT id, balance_liters FROM fuel_cards WHERE card_code = '{escaped}'
-                """)
-                row = cur.fetchone()
-
-                if not row:
-                    conn.rollback()
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Карта {card_code} не найдена'})
-                    }
-
-                card_id = row[0]
-                current_balance = float(row[1]) if row[1] is not None else 0.0
-
-                if current_balance < quantity:
-                    conn.rollback()
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'error': 'Недостаточно топлива на карте',
-                            'current_balance': current_balance,
-                            'requested_quantity': quantity
-                        })
-                    }
-
-                new_balance = current_balance - quantity
-                cur.execute(f"""
-                    UPDATE fuel_cards SET balance_liters = {new_balance} WHERE id = {card_id}
-                """)
-
-                operation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                cur.execute(f"""
-                    INSERT INTO card_operations
-                    (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
-                    VALUES ({card_id}, {station_id}, '{operation_date}', 'заправка', {quantity}, 0, 0, 'Панель оператора')
-                """)
-
-                conn.commit()
-
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'card_code': card_code,
-                        'quantity': quantity,
-                        'previous_balance': current_balance,
-                        'new_balance': new_balance
-                    }, ensure_ascii=False)
-                }
-        except Exception as e:
-            conn.rollback()
-            return {
-                'statusCode': 500,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': f'Ошибка: {str(e)}'})
-            }
-        finally:
-            conn.close()
-
-    conn.close()
-    return {
-        'statusCode': 405,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'error': 'Метод не поддерживается'})
-    }
\ No newline at end of file
+    return router(event, context)
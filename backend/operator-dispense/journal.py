@@ -0,0 +1,259 @@
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+import db
+
+# Журнал операций с отложенной записью в БД (режим включается DISPENSE_JOURNAL_DIR, только для
+# долгоживущего процесса — локального шлюза). Списание баланса фиксируется синхронно одним запросом,
+# а строка card_operations дописывается в локальный файл и переносится в БД пакетами фоновым потоком.
+# Порядок: запись журнала и fsync → COMMIT списания. Каждая запись несет txid транзакции списания:
+# разборщик вставляет только зафиксированные (txid_status), поэтому сбой между fsync и COMMIT
+# не оставляет операций без списания. Смещение разобранной части сегмента хранится
+# в dispense_journal_segments и меняется в той же транзакции, что и вставка
+JOURNAL_DIR = os.environ.get('DISPENSE_JOURNAL_DIR', '')
+# Ожидание перед fsync, чтобы собрать записи параллельных запросов; 0 — записи, пришедшие
+# во время текущего fsync, и так попадают в следующий
+FSYNC_WINDOW_MS = float(os.environ.get('DISPENSE_JOURNAL_FSYNC_WINDOW_MS', '0'))
+DRAIN_INTERVAL = float(os.environ.get('DISPENSE_JOURNAL_DRAIN_INTERVAL', '0.5'))
+DRAIN_BATCH = int(os.environ.get('DISPENSE_JOURNAL_DRAIN_BATCH', '500'))
+SEGMENT_MAX_BYTES = int(os.environ.get('DISPENSE_JOURNAL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+SEGMENT_SUFFIX = '.jnl'
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+def read_entries(path: str, offset: int, limit: int) -> List[Tuple[int, Dict[str, Any]]]:
+    '''
+    Записи сегмента начиная с offset: (смещение конца записи, запись).
+    Недописанная последняя строка (сбой во время записи) пропускается: подтверждения
+    она не получила, и транзакция списания по ней не фиксировалась
+    '''
+    entries: List[Tuple[int, Dict[str, Any]]] = []
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(READ_CHUNK_BYTES)
+    position = offset
+    for line in data.splitlines(keepends=True):
+        if not line.endswith(b'\n') or len(entries) >= limit:
+            break
+        position += len(line)
+        entries.append((position, json.loads(line)))
+    return entries
+
+
+class OperationJournal:
+    '''
+    Сегменты журнала процесса и фоновый разборщик. Сегмент заблокирован (flock) открывшим
+    его процессом; сегменты без блокировки остались от завершившихся процессов и дочитываются
+    разборщиком любого живого процесса
+    '''
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.sync_condition = threading.Condition()
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+        # Свои сегменты: имя → дескриптор, который держит блокировку до полного разбора
+        self.owned: Dict[str, int] = {}
+        self.segment = ''
+        self.segment_size = 0
+        self.open_segment()
+        self.wakeup = threading.Event()
+        self.drainer = threading.Thread(target=self.drain_forever, name='journal-drainer', daemon=True)
+        self.drainer.start()
+
+    def open_segment(self) -> None:
+        name = f'{socket.gethostname()}-{os.getpid()}-{time.time_ns()}{SEGMENT_SUFFIX}'
+        fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Новый файл переживает сбой только после fsync каталога
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        self.owned[name] = fd
+        self.segment = name
+        self.segment_size = 0
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        '''
+        Дописывает запись и возвращается, когда она на диске. fsync общий для всех записей,
+        пришедших к моменту его начала: параллельные запросы платят за один fsync
+        '''
+        line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        with self.lock:
+            if self.segment_size >= SEGMENT_MAX_BYTES:
+                # Смена сегмента редка: прежний дописывается на диск сразу, под блокировкой
+                os.fsync(self.owned[self.segment])
+                self.open_segment()
+            os.write(self.owned[self.segment], line)
+            self.segment_size += len(line)
+            self.written += 1
+            sequence = self.written
+        self.wait_durable(sequence)
+
+    def wait_durable(self, sequence: int) -> None:
+        with self.sync_condition:
+            while self.synced < sequence:
+                if not self.syncing:
+                    self.syncing = True
+                    break
+                self.sync_condition.wait()
+            else:
+                return
+        try:
+            if FSYNC_WINDOW_MS > 0:
+                time.sleep(FSYNC_WINDOW_MS / 1000)
+            with self.lock:
+                target = self.written
+                fd = self.owned[self.segment]
+            os.fsync(fd)
+        except BaseException:
+            with self.sync_condition:
+                self.syncing = False
+                self.sync_condition.notify_all()
+            raise
+        with self.sync_condition:
+            self.synced = max(self.synced, target)
+            self.syncing = False
+            self.sync_condition.notify_all()
+
+    def drain_forever(self) -> None:
+        while True:
+            self.wakeup.wait(DRAIN_INTERVAL)
+            self.wakeup.clear()
+            try:
+                self.drain()
+            except Exception:
+                # БД недоступна: записи ждут в журнале до следующей попытки
+                print(traceback.format_exc())
+
+    def drain(self) -> None:
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(SEGMENT_SUFFIX):
+                continue
+            if name in self.owned:
+                self.drain_segment(name)
+                continue
+            try:
+                fd = os.open(os.path.join(self.directory, name), os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Сегмент живого процесса: его разбирает он сам
+                os.close(fd)
+                continue
+            print(json.dumps({'event': 'journal_replay', 'segment': name}, ensure_ascii=False))
+            self.owned[name] = fd
+            self.drain_segment(name)
+
+    def drain_segment(self, name: str) -> None:
+        path = os.path.join(self.directory, name)
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT applied_offset FROM dispense_journal_segments WHERE segment = %s", (name,))
+                row = cur.fetchone()
+                offset = row[0] if row else 0
+                conn.rollback()
+                while True:
+                    entries = read_entries(path, offset, DRAIN_BATCH)
+                    applied = self.apply(cur, name, offset, entries) if entries else offset
+                    conn.commit()
+                    if applied == offset:
+                        break
+                    offset = applied
+        if name != self.segment and offset >= os.path.getsize(path):
+            self.release_segment(name)
+
+    def apply(self, cur: Any, name: str, offset: int, entries: List[Tuple[int, Dict[str, Any]]]) -> int:
+        '''
+        Переносит записи в card_operations и сдвигает смещение сегмента; возвращает новое смещение.
+        Разбор останавливается на записи, транзакция которой еще не завершена
+        '''
+        cur.execute(
+            "SELECT txid_status(t) FROM unnest(%s::bigint[]) WITH ORDINALITY AS u(t, n) ORDER BY n",
+            ([entry['txid'] for _, entry in entries],)
+        )
+        statuses = [row[0] for row in cur.fetchall()]
+        operations = []
+        applied = offset
+        for (end, entry), status in zip(entries, statuses):
+            if status == 'in progress':
+                break
+            if status is None:
+                # Статус слишком старой транзакции уже не хранится: запись подтверждалась
+                # перед COMMIT, и почти всегда он прошел
+                print(json.dumps({'event': 'journal_unknown_txid', 'segment': name, 'txid': entry['txid']}))
+            if status != 'aborted':
+                operations.append((
+                    entry['fuel_card_id'], entry['station_id'], entry['operation_date'], entry['operation_type'],
+                    entry['quantity'], entry['price'], entry['amount'], entry['comment']
+                ))
+            applied = end
+        if applied == offset:
+            return offset
+        if operations:
+            execute_values(cur, """
+                INSERT INTO card_operations
+                (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
+                VALUES %s
+            """, operations, page_size=len(operations))
+        cur.execute("""
+            INSERT INTO dispense_journal_segments (segment, applied_offset, updated_at)
+            VALUES (%s, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (segment) DO UPDATE
+            SET applied_offset = EXCLUDED.applied_offset, updated_at = EXCLUDED.updated_at
+        """, (name, applied))
+        return applied
+
+    def release_segment(self, name: str) -> None:
+        '''
+        Полностью разобранный сегмент удаляется. Файл удаляется раньше строки смещения:
+        строка без файла безвредна, а файл без строки был бы разобран повторно
+        '''
+        os.unlink(os.path.join(self.directory, name))
+        os.close(self.owned.pop(name))
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM dispense_journal_segments WHERE segment = %s", (name,))
+            conn.commit()
+
+
+_journal: Optional[OperationJournal] = None
+_journal_pid = 0
+_journal_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(JOURNAL_DIR)
+
+
+def get_journal() -> OperationJournal:
+    '''
+    Журнал текущего процесса; создается при первом обращении, после fork — заново
+    (потоки и блокировки сегментов родителя дочернему процессу не принадлежат)
+    '''
+    global _journal, _journal_pid
+    if _journal is None or _journal_pid != os.getpid():
+        with _journal_lock:
+            if _journal is None or _journal_pid != os.getpid():
+                _journal = OperationJournal(JOURNAL_DIR)
+                _journal_pid = os.getpid()
+    return _journal
+
+
+def append(entry: Dict[str, Any]) -> None:
+    get_journal().append(entry)
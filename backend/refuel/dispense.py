@@ -0,0 +1,660 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from psycopg2.errors import DeadlockDetected, UniqueViolation
+from psycopg2.extras import Json, execute_values
+
+import db
+import refcache
+
+OPERATION_TYPE = 'заправка'
+IDEMPOTENCY_HEADER = 'idempotency-key'
+MAX_IDEMPOTENCY_KEY_LENGTH = 100
+# Групповая фиксация списаний (долгоживущий процесс, локальный шлюз): одиночные списания refuel
+# и operator-dispense, пришедшие в течение окна, применяются в одной транзакции с одним COMMIT.
+# 0 — выключено, каждое списание фиксируется своей транзакцией
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get('DISPENSE_GROUP_COMMIT_MS', '0'))
+GROUP_COMMIT_MAX_ITEMS = int(os.environ.get('DISPENSE_GROUP_COMMIT_MAX_ITEMS', '100'))
+# Сколько раз пакет применяется заново после взаимоблокировки (40P01)
+GROUP_COMMIT_DEADLOCK_RETRIES = int(os.environ.get('DISPENSE_GROUP_COMMIT_DEADLOCK_RETRIES', '3'))
+
+# Списание одной командой: поиск карты и АЗС, проверка дневного лимита и баланса,
+# уменьшение баланса, счетчик за день и запись операции.
+# Проверки выполняются в условиях UPDATE / ON CONFLICT DO UPDATE, которые PostgreSQL
+# перепроверяет на последней версии заблокированной строки, поэтому параллельные
+# списания по одной карте не теряют обновлений и не уводят баланс в минус.
+# Строка карты блокируется первой (FOR UPDATE), затем счетчик за день — тот же порядок,
+# что и в пакетном списании. Вставка операции блокирует еще и строки operation_daily_rollups
+# (триггер агрегата), поэтому транзакции из нескольких списаний (dispense_batch, GroupCommit,
+# перемещение) могут взаимоблокироваться между собой и с одиночным списанием; GroupCommit
+# в этом случае применяет пакет заново.
+# Если лимит прошел, а баланс нет, счетчик уже увеличен — вызывающий обязан откатить транзакцию.
+DISPENSE_SQL_TEMPLATE = """
+    WITH card AS (
+        SELECT fc.id, fc.balance_liters, fc.daily_limit, COALESCE(u.liters, 0) AS today_refueled
+        FROM fuel_cards fc
+        LEFT JOIN card_daily_usage u ON u.fuel_card_id = fc.id AND u.usage_date = %(usage_date)s
+        WHERE fc.card_code = %(card_code)s
+        FOR UPDATE OF fc
+    ),
+    station AS (
+        SELECT id, name FROM stations WHERE {station_filter} LIMIT 1
+    ),
+    usage AS (
+        INSERT INTO card_daily_usage AS cu (fuel_card_id, usage_date, liters)
+        SELECT card.id, %(usage_date)s, %(quantity)s
+        FROM card, station
+        WHERE card.daily_limit <= 0 OR %(quantity)s <= card.daily_limit
+        ON CONFLICT (fuel_card_id, usage_date) DO UPDATE
+        SET liters = cu.liters + EXCLUDED.liters
+        WHERE (SELECT daily_limit FROM fuel_cards WHERE id = cu.fuel_card_id) <= 0
+           OR cu.liters + EXCLUDED.liters <= (SELECT daily_limit FROM fuel_cards WHERE id = cu.fuel_card_id)
+        RETURNING cu.fuel_card_id, cu.liters
+    ),
+    debit AS (
+        UPDATE fuel_cards fc
+        SET balance_liters = fc.balance_liters - %(quantity)s
+        FROM usage
+        WHERE fc.id = usage.fuel_card_id AND fc.balance_liters >= %(quantity)s
+        RETURNING fc.id, fc.balance_liters + %(quantity)s AS previous_balance, fc.balance_liters AS new_balance
+    ){operation}
+    SELECT card.id, card.balance_liters, card.daily_limit, card.today_refueled,
+           station.id, station.name,
+           usage.liters,
+           debit.previous_balance, debit.new_balance,
+           {applied}
+    FROM (VALUES (1)) AS one(x)
+    LEFT JOIN card ON true
+    LEFT JOIN station ON true
+    LEFT JOIN usage ON true
+    LEFT JOIN debit ON true{operation_join}
+"""
+
+OPERATION_CTE = """,
+    operation AS (
+        INSERT INTO card_operations
+        (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
+        SELECT debit.id, station.id, %(operation_date)s, %(operation_type)s,
+               %(quantity)s, %(price)s, %(amount)s, %(comment)s
+        FROM debit, station
+        RETURNING id
+    )"""
+
+
+def dispense_sql(station_filter: str) -> str:
+    return DISPENSE_SQL_TEMPLATE.format(
+        station_filter=station_filter,
+        operation=OPERATION_CTE,
+        applied='operation.id',
+        operation_join='\n    LEFT JOIN operation ON true'
+    )
+
+
+DISPENSE_BY_CODE_1C_SQL = dispense_sql('code_1c = %(code_1c)s')
+DISPENSE_BY_STATION_ID_SQL = dispense_sql('id = %(station_id)s')
+# Списание без записи операции (журнал операций, journal.py): строка card_operations
+# пишется позже пакетом, а вместо ее id запрос возвращает номер транзакции —
+# по нему разборщик журнала узнает, была ли транзакция списания зафиксирована
+JOURNALED_DISPENSE_SQL = DISPENSE_SQL_TEMPLATE.format(
+    station_filter='id = %(station_id)s',
+    operation='',
+    applied='CASE WHEN debit.id IS NOT NULL THEN txid_current() END',
+    operation_join=''
+)
+
+# Типы параметров для PREPARE и asyncpg: сервер выводит тип параметра из первого места использования,
+# а в SELECT списка INSERT ... SELECT вывести его не из чего — типы задаются явно
+DISPENSE_PARAM_TYPES = {
+    'card_code': 'varchar',
+    'code_1c': 'varchar',
+    'station_id': 'integer',
+    'quantity': 'numeric',
+    'price': 'numeric',
+    'amount': 'numeric',
+    'comment': 'varchar',
+    'operation_date': 'timestamp',
+    'usage_date': 'date',
+    'operation_type': 'varchar',
+}
+
+
+DISPENSE_BY_CODE_1C = db.Statement('dispense_by_code_1c', DISPENSE_BY_CODE_1C_SQL, DISPENSE_PARAM_TYPES)
+DISPENSE_BY_STATION_ID = db.Statement('dispense_by_station_id', DISPENSE_BY_STATION_ID_SQL, DISPENSE_PARAM_TYPES)
+JOURNALED_DISPENSE = db.Statement('journaled_dispense', JOURNALED_DISPENSE_SQL, DISPENSE_PARAM_TYPES)
+FIND_STORED_RESPONSE = db.Statement(
+    'find_stored_response',
+    "SELECT status_code, response FROM dispense_requests WHERE idempotency_key = %(key)s",
+    {'key': 'varchar'}
+)
+
+
+class DispenseError(Exception):
+    '''
+    Отказ в списании: status_code и тело ответа для клиента.
+    Транзакция после такой ошибки должна быть откатана
+    '''
+    def __init__(self, status_code: int, body: Dict[str, Any]):
+        super().__init__(body.get('error', ''))
+        self.status_code = status_code
+        self.body = body
+
+
+def dispense_params(
+    card_code: str,
+    quantity: float,
+    price: float = 0,
+    comment: str = '',
+    code_1c: Optional[str] = None,
+    station_id: Optional[int] = None,
+    operation_date: Optional[datetime] = None
+) -> Dict[str, Any]:
+    operation_date = operation_date or datetime.now().replace(microsecond=0)
+    return {
+        'card_code': card_code,
+        'code_1c': code_1c,
+        'station_id': station_id,
+        'quantity': quantity,
+        'price': price,
+        'amount': quantity * price,
+        'comment': comment,
+        'operation_date': operation_date,
+        'usage_date': operation_date.date(),
+        'operation_type': OPERATION_TYPE,
+    }
+
+
+def dispense_result(row: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Разбор строки запроса списания: результат операции либо DispenseError
+    '''
+    (card_id, balance, daily_limit, today_refueled, found_station_id, station_name,
+     usage_total, previous_balance, new_balance, operation_id) = row
+    card_code = params['card_code']
+    quantity = params['quantity']
+
+    if card_id is None:
+        raise DispenseError(404, {'error': f'Карта {card_code} не найдена'})
+
+    if found_station_id is None:
+        station_ref = params['station_id'] if params['code_1c'] is None else params['code_1c']
+        raise DispenseError(404, {'error': f'АЗС с кодом {station_ref} не найдена'})
+
+    if usage_total is None:
+        limit = float(daily_limit or 0)
+        raise DispenseError(400, {
+            'error': 'Превышен дневной лимит карты',
+            'daily_limit': limit,
+            'today_refueled': float(today_refueled or 0),
+            'available_today': max(0.0, limit - float(today_refueled or 0)),
+            'requested_quantity': quantity
+        })
+
+    if operation_id is None:
+        raise DispenseError(400, {
+            'error': 'Недостаточно топлива на карте',
+            'current_balance': float(balance) if balance is not None else 0.0,
+            'requested_quantity': quantity
+        })
+
+    return {
+        'success': True,
+        'card_code': card_code,
+        'operation_type': OPERATION_TYPE,
+        'quantity': quantity,
+        'price': params['price'],
+        'amount': params['amount'],
+        'previous_balance': float(previous_balance),
+        'new_balance': float(new_balance),
+        'code_1c': params['code_1c'],
+        'station_id': found_station_id,
+        'station_name': station_name,
+        'operation_id': operation_id,
+        'operation_date': params['operation_date'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+def dispense(
+    cur: Any,
+    card_code: str,
+    quantity: float,
+    price: float = 0,
+    comment: str = '',
+    code_1c: Optional[str] = None,
+    station_id: Optional[int] = None,
+    operation_date: Optional[datetime] = None
+) -> Dict[str, Any]:
+    '''
+    Списание топлива с карты одним запросом к БД.
+    АЗС задается идентификатором (station_id) либо кодом 1С (code_1c);
+    если известны оба, поиск идет по station_id, а code_1c только попадает в ответ.
+    Args: cur - курсор открытой транзакции; фиксацию делает вызывающий код
+    Returns: dict с результатом операции; при отказе бросает DispenseError
+    '''
+    params = dispense_params(card_code, quantity, price, comment, code_1c, station_id, operation_date)
+    statement = DISPENSE_BY_STATION_ID if station_id is not None else DISPENSE_BY_CODE_1C
+    statement.execute(cur, params)
+    return dispense_result(cur.fetchone(), params)
+
+
+async def dispense_async(
+    conn: Any,
+    card_code: str,
+    quantity: float,
+    price: float = 0,
+    comment: str = '',
+    code_1c: Optional[str] = None,
+    station_id: Optional[int] = None,
+    operation_date: Optional[datetime] = None
+) -> Dict[str, Any]:
+    '''
+    dispense для соединения asyncpg (adb) в открытой транзакции: тот же запрос и те же ответы
+    '''
+    params = dispense_params(card_code, quantity, price, comment, code_1c, station_id, operation_date)
+    statement = DISPENSE_BY_STATION_ID if station_id is not None else DISPENSE_BY_CODE_1C
+    # numeric передается как Decimal из строкового вида: 0.1 попадает в БД ровно 0.1, как у psycopg2
+    args = [
+        Decimal(str(params[name])) if DISPENSE_PARAM_TYPES[name] == 'numeric' else params[name]
+        for name in statement.params
+    ]
+    # asyncpg сам готовит запрос и хранит его в кэше соединения по тексту
+    return dispense_result(await conn.fetchrow(statement.text, *args), params)
+
+
+def dispense_journaled(
+    cur: Any,
+    card_code: str,
+    quantity: float,
+    station_id: int,
+    price: float = 0,
+    comment: str = '',
+    operation_date: Optional[datetime] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    '''
+    Списание одним запросом без вставки в card_operations: строка операции возвращается
+    записью для журнала (journal.append) и должна попасть в журнал до фиксации транзакции.
+    Returns: (результат операции без operation_id, запись журнала с txid транзакции списания)
+    '''
+    params = dispense_params(card_code, quantity, price, comment, station_id=station_id, operation_date=operation_date)
+    JOURNALED_DISPENSE.execute(cur, params)
+    row = cur.fetchone()
+    result = dispense_result(row, params)
+    result['operation_id'] = None
+    entry = {
+        'txid': row[-1],
+        'fuel_card_id': row[0],
+        'station_id': row[4],
+        'operation_date': result['operation_date'],
+        'operation_type': OPERATION_TYPE,
+        'quantity': quantity,
+        'price': price,
+        'amount': params['amount'],
+        'comment': comment
+    }
+    return result, entry
+
+
+def dispense_batch(cur: Any, items: List[Dict[str, Any]], operation_date: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    '''
+    Пакетное списание (выгрузка накопленных в 1С заправок): карты и счетчики
+    читаются по одному запросу на весь пакет, АЗС берутся из кэша справочников,
+    карты блокируются в порядке id,
+    позиции применяются по порядку, изменения пишутся многострочными запросами.
+    Баланс, лимит и счетчик за день считаются в Decimal — так же, как numeric в запросе одиночного списания.
+    Args: cur - курсор открытой транзакции; items - dict с card_code, quantity, price, code_1c, comment
+    Returns: список результатов по позициям: результат операции либо {'error', 'status'}
+    '''
+    operation_date = operation_date or datetime.now().replace(microsecond=0)
+    usage_date = operation_date.date()
+    card_codes = sorted({item['card_code'] for item in items})
+    station_codes = sorted({item['code_1c'] for item in items})
+
+    cur.execute("""
+        SELECT id, card_code, balance_liters, daily_limit
+        FROM fuel_cards
+        WHERE card_code = ANY(%s)
+        ORDER BY id
+        FOR UPDATE
+    """, (card_codes,))
+    cards = {
+        row[1]: {'id': row[0], 'balance': Decimal(str(row[2] or 0)), 'daily_limit': Decimal(str(row[3] or 0)), 'today': Decimal(0)}
+        for row in cur.fetchall()
+    }
+    cards_by_id = {card['id']: card for card in cards.values()}
+
+    if cards_by_id:
+        cur.execute("""
+            SELECT fuel_card_id, liters FROM card_daily_usage
+            WHERE fuel_card_id = ANY(%s) AND usage_date = %s
+        """, (list(cards_by_id), usage_date))
+        for card_id, liters in cur.fetchall():
+            cards_by_id[card_id]['today'] = Decimal(str(liters or 0))
+
+    stations = {code: refcache.station_by_code_1c(cur, code) for code in station_codes}
+
+    results: List[Dict[str, Any]] = []
+    operations = []
+    usage_delta: Dict[int, Decimal] = {}
+    touched: Dict[int, Dict[str, Any]] = {}
+    formatted_date = operation_date.strftime('%Y-%m-%d %H:%M:%S')
+
+    for item in items:
+        card = cards.get(item['card_code'])
+        station = stations.get(item['code_1c'])
+        quantity = item['quantity']
+        liters = Decimal(str(quantity))
+        if card is None:
+            results.append({'status': 404, 'error': f"Карта {item['card_code']} не найдена"})
+            continue
+        if station is None:
+            results.append({'status': 404, 'error': f"АЗС с кодом {item['code_1c']} не найдена"})
+            continue
+        if card['daily_limit'] > 0 and card['today'] + liters > card['daily_limit']:
+            results.append({
+                'status': 400,
+                'error': 'Превышен дневной лимит карты',
+                'daily_limit': float(card['daily_limit']),
+                'today_refueled': float(card['today']),
+                'available_today': max(0.0, float(card['daily_limit'] - card['today'])),
+                'requested_quantity': quantity
+            })
+            continue
+        if card['balance'] < liters:
+            results.append({
+                'status': 400,
+                'error': 'Недостаточно топлива на карте',
+                'current_balance': float(card['balance']),
+                'requested_quantity': quantity
+            })
+            continue
+
+        previous_balance = card['balance']
+        card['balance'] = previous_balance - liters
+        card['today'] += liters
+        usage_delta[card['id']] = usage_delta.get(card['id'], Decimal(0)) + liters
+        touched[card['id']] = card
+        amount = quantity * item['price']
+        operations.append((
+            card['id'], station['id'], operation_date, OPERATION_TYPE,
+            quantity, item['price'], amount, item['comment']
+        ))
+        results.append({
+            'status': 200,
+            'success': True,
+            'card_code': item['card_code'],
+            'operation_type': OPERATION_TYPE,
+            'quantity': quantity,
+            'price': item['price'],
+            'amount': amount,
+            'previous_balance': float(previous_balance),
+            'new_balance': float(card['balance']),
+            'code_1c': item['code_1c'],
+            'station_id': station['id'],
+            'station_name': station['name'],
+            'operation_date': formatted_date
+        })
+
+    if not operations:
+        return results
+
+    execute_values(cur, """
+        UPDATE fuel_cards AS fc SET balance_liters = v.balance
+        FROM (VALUES %s) AS v(id, balance)
+        WHERE fc.id = v.id
+    """, [(card_id, card['balance']) for card_id, card in touched.items()])
+
+    execute_values(cur, """
+        INSERT INTO card_daily_usage (fuel_card_id, usage_date, liters)
+        VALUES %s
+        ON CONFLICT (fuel_card_id, usage_date)
+        DO UPDATE SET liters = card_daily_usage.liters + EXCLUDED.liters
+    """, [(card_id, usage_date, liters) for card_id, liters in usage_delta.items()])
+
+    operation_ids = execute_values(cur, """
+        INSERT INTO card_operations
+        (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
+        VALUES %s
+        RETURNING id
+    """, operations, page_size=len(operations), fetch=True)
+
+    applied = iter(operation_ids)
+    for result in results:
+        if result.get('success'):
+            result['operation_id'] = next(applied)[0]
+
+    return results
+
+
+def get_idempotency_key(event: Dict[str, Any], body: Any) -> Optional[str]:
+    '''
+    Ключ идемпотентности из поля idempotency_key тела запроса или заголовка Idempotency-Key
+    '''
+    key = body.get('idempotency_key') if isinstance(body, dict) else None
+    if not key:
+        headers = event.get('headers') or {}
+        key = next((value for name, value in headers.items() if name.lower() == IDEMPOTENCY_HEADER), None)
+    key = str(key).strip() if key else ''
+    return key or None
+
+
+def validate_idempotency_key(key: Optional[str]) -> Optional[str]:
+    if key and len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        return f'idempotency_key длиннее {MAX_IDEMPOTENCY_KEY_LENGTH} символов'
+    return None
+
+
+def find_stored_response(cur: Any, key: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    FIND_STORED_RESPONSE.execute(cur, {'key': key})
+    row = cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def find_stored_responses(cur: Any, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+    if not keys:
+        return {}
+    cur.execute(
+        "SELECT idempotency_key, response FROM dispense_requests WHERE idempotency_key = ANY(%s)",
+        (keys,)
+    )
+    return {row[0]: row[1] for row in cur.fetchall()}
+
+
+def store_response(cur: Any, key: str, endpoint: str, body: Dict[str, Any], status_code: int = 200) -> None:
+    '''
+    Сохраняет ответ в той же транзакции, что и списание. Параллельный повтор с тем же ключом
+    ждет на уникальном индексе и получает UniqueViolation — тогда транзакцию нужно откатить
+    и вернуть сохраненный ответ
+    '''
+    cur.execute("""
+        INSERT INTO dispense_requests (idempotency_key, endpoint, status_code, response)
+        VALUES (%s, %s, %s, %s)
+    """, (key, endpoint, status_code, Json(body)))
+
+
+async def find_stored_response_async(conn: Any, key: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    row = await conn.fetchrow(FIND_STORED_RESPONSE.text, key)
+    return (row[0], row[1]) if row else None
+
+
+async def store_response_async(conn: Any, key: str, endpoint: str, body: Dict[str, Any], status_code: int = 200) -> None:
+    await conn.execute("""
+        INSERT INTO dispense_requests (idempotency_key, endpoint, status_code, response)
+        VALUES ($1, $2, $3, $4)
+    """, key, endpoint, status_code, body)
+
+
+def store_responses(cur: Any, endpoint: str, responses: List[Tuple[str, Dict[str, Any]]]) -> None:
+    if not responses:
+        return
+    execute_values(cur, """
+        INSERT INTO dispense_requests (idempotency_key, endpoint, status_code, response)
+        VALUES %s
+    """, [(key, endpoint, 200, Json(body)) for key, body in responses])
+
+
+# (код ответа, тело, повтор сохраненного ответа)
+Outcome = Tuple[int, Dict[str, Any], bool]
+
+
+class PendingDispense:
+    __slots__ = ('card_code', 'endpoint', 'idempotency_key', 'apply', 'future')
+
+    def __init__(self, card_code: str, endpoint: str, idempotency_key: Optional[str], apply: Callable[[Any], Dict[str, Any]]):
+        self.card_code = card_code
+        self.endpoint = endpoint
+        self.idempotency_key = idempotency_key
+        self.apply = apply
+        self.future: 'Future[Outcome]' = Future()
+
+
+class GroupCommit:
+    '''
+    Координатор групповой фиксации: поток собирает списания, пришедшие за окно
+    (не больше GROUP_COMMIT_MAX_ITEMS), и применяет их в одной транзакции.
+    Каждое списание выполняется под своей точкой сохранения: отказ или ошибка откатывает
+    только его. Результаты отдаются вызывающим после COMMIT; если COMMIT не прошел,
+    ошибку получают все списания пакета. Пока пакет применяется, следующие копятся в очереди
+    '''
+
+    def __init__(self, window_ms: float, max_items: int):
+        self.window = window_ms / 1000
+        self.max_items = max_items
+        self.queue: 'queue.Queue[PendingDispense]' = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='dispense-group-commit', daemon=True)
+        self.thread.start()
+
+    def submit(self, card_code: str, endpoint: str, idempotency_key: Optional[str],
+               apply: Callable[[Any], Dict[str, Any]]) -> 'Future[Outcome]':
+        '''
+        apply(cur) выполняет списание и возвращает тело ответа либо бросает DispenseError.
+        Поиск и сохранение ответа по ключу идемпотентности выполняет координатор
+        '''
+        pending = PendingDispense(card_code, endpoint, idempotency_key, apply)
+        self.queue.put(pending)
+        return pending.future
+
+    def collect(self) -> List[PendingDispense]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.collect()
+            try:
+                outcomes = self.apply(batch)
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            for pending, outcome in zip(batch, outcomes):
+                if isinstance(outcome, BaseException):
+                    pending.future.set_exception(outcome)
+                else:
+                    pending.future.set_result(outcome)
+
+    def apply(self, batch: List[PendingDispense]) -> List[Any]:
+        '''
+        Применяет пакет. Строки агрегата operation_daily_rollups блокируются в порядке списаний,
+        а не карт, и взаимоблокировка с другой транзакцией возможна при любом порядке —
+        тогда пакет откатывается целиком и применяется заново. На последней попытке
+        ошибку получает только попавшее во взаимоблокировку списание
+        '''
+        with db.connection() as conn:
+            conn.autocommit = False
+            for attempt in range(GROUP_COMMIT_DEADLOCK_RETRIES):
+                try:
+                    outcomes = self.apply_all(conn, batch, True)
+                    break
+                except DeadlockDetected:
+                    conn.rollback()
+                    print(json.dumps({'event': 'group_commit_deadlock', 'items': len(batch), 'attempt': attempt + 1}))
+            else:
+                outcomes = self.apply_all(conn, batch, False)
+            conn.commit()
+        return outcomes
+
+    def apply_all(self, conn: Any, batch: List[PendingDispense], retry_deadlock: bool) -> List[Any]:
+        outcomes: List[Any] = [None] * len(batch)
+        with conn.cursor() as cur:
+            # Карты блокируются по возрастанию id, как в dispense_batch и перемещении между картами
+            # (списания одной карты — в порядке поступления), несуществующие карты идут первыми.
+            # Это сокращает число взаимоблокировок, но не исключает их: см. apply
+            cur.execute(
+                "SELECT card_code, id FROM fuel_cards WHERE card_code = ANY(%s)",
+                (sorted({pending.card_code for pending in batch}),)
+            )
+            card_ids = dict(cur.fetchall())
+            order = sorted(range(len(batch)), key=lambda index: card_ids.get(batch[index].card_code, 0))
+            cur.execute("SAVEPOINT dispense_item")
+            for position, index in enumerate(order):
+                if position:
+                    # Отпустить точку предыдущего списания и поставить новую — один запрос
+                    cur.execute("RELEASE SAVEPOINT dispense_item; SAVEPOINT dispense_item")
+                try:
+                    outcomes[index] = self.apply_one(cur, batch[index])
+                except DeadlockDetected as e:
+                    if retry_deadlock:
+                        raise
+                    cur.execute("ROLLBACK TO SAVEPOINT dispense_item")
+                    outcomes[index] = e
+                except Exception as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT dispense_item")
+                    outcomes[index] = e
+        return outcomes
+
+    def apply_one(self, cur: Any, pending: PendingDispense) -> Outcome:
+        key = pending.idempotency_key
+        if key:
+            # Видит и ответы более ранних списаний этого же пакета
+            stored = find_stored_response(cur, key)
+            if stored:
+                return stored[0], stored[1], True
+        try:
+            body = pending.apply(cur)
+        except DispenseError as e:
+            cur.execute("ROLLBACK TO SAVEPOINT dispense_item")
+            return e.status_code, e.body, False
+        if key:
+            try:
+                store_response(cur, key, pending.endpoint, body)
+            except UniqueViolation:
+                cur.execute("ROLLBACK TO SAVEPOINT dispense_item")
+                stored = find_stored_response(cur, key)
+                return stored[0], stored[1], True
+        return 200, body, False
+
+
+_group_commit: Optional[GroupCommit] = None
+_group_commit_pid = 0
+_group_commit_lock = threading.Lock()
+
+
+def group_commit() -> Optional[GroupCommit]:
+    '''
+    Координатор процесса или None, если групповая фиксация выключена.
+    Создается при первом обращении, после fork — заново
+    '''
+    global _group_commit, _group_commit_pid
+    if GROUP_COMMIT_WINDOW_MS <= 0:
+        return None
+    if _group_commit is None or _group_commit_pid != os.getpid():
+        with _group_commit_lock:
+            if _group_commit is None or _group_commit_pid != os.getpid():
+                _group_commit = GroupCommit(GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_ITEMS)
+                _group_commit_pid = os.getpid()
+    return _group_commit
@@ -1,183 +1,263 @@
-import json
-import os
-import psycopg2
-from typing import Dict, Any
-from datetime import datetime
+import asyncio
+import math
+import api
+import adb
+import db
+import refcache
+from concurrent.futures import Future
+from typing import Dict, Any, List, Optional
+from asyncpg import UniqueViolationError
+from psycopg2.errors import UniqueViolation
+from dispense import (
+    dispense, dispense_async, dispense_batch, DispenseError, get_idempotency_key, validate_idempotency_key,
+    find_stored_response, find_stored_response_async, find_stored_responses,
+    store_response, store_response_async, store_responses, group_commit, Outcome
+)
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+MAX_BATCH_SIZE = 1000
+REPLAYED_HEADERS = {'Idempotent-Replayed': 'true'}
+
+def validate_refuel(data: Dict[str, Any]) -> Optional[str]:
     '''
-    Выполнение операции заправки: уменьшение баланса карты и запись в историю операций
-    Args: event - dict с httpMethod, body (card_code, quantity, price, code_1c, comment)
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict с результатом операции
+    Проверка полей одной заправки; возвращает текст ошибки или None
     '''
-    method: str = event.get('httpMethod', 'POST')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Api-Key',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается. Используйте POST'})
-        }
+    if not str(data.get('card_code') or '').strip():
+        return 'Не указан номер карты (card_code)'
+    quantity = data.get('quantity', 0)
+    # json.loads принимает NaN и Infinity: сравнения с NaN ложны, и проверка > 0 его бы пропустила
+    if not isinstance(quantity, (int, float)) or isinstance(quantity, bool) or not math.isfinite(quantity) or quantity <= 0:
+        return 'Количество топлива должно быть больше 0'
+    price = data.get('price', 0)
+    if not isinstance(price, (int, float)) or isinstance(price, bool) or not math.isfinite(price) or price < 0:
+        return 'Цена должна быть неотрицательным числом'
+    if not str(data.get('code_1c') or '').strip():
+        return 'Не указан код АЗС (code_1c)'
+    return None
+
+def replayed_response(body: Dict[str, Any], status_code: int = 200) -> Dict[str, Any]:
+    return api.json_response(body, status_code, REPLAYED_HEADERS)
+
+def refuel_batch(refuels: List[Any]) -> Dict[str, Any]:
+    '''
+    Пакетная загрузка заправок из 1С: все позиции применяются в одной транзакции,
+    по каждой возвращается отдельный результат в порядке следования
+    '''
+    if len(refuels) > MAX_BATCH_SIZE:
+        raise api.HttpError(400, f'Не более {MAX_BATCH_SIZE} заправок в одном пакете')
     
-    try:
-        body_data = json.loads(event.get('body', '{}'))
-    except json.JSONDecodeError:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Некорректный JSON'})
-        }
+    results: List[Optional[Dict[str, Any]]] = []
+    items: List[Dict[str, Any]] = []
+    positions: List[int] = []
+    seen_keys = set()
+    for index, data in enumerate(refuels):
+        error = validate_refuel(data) if isinstance(data, dict) else 'Некорректная позиция пакета'
+        key = get_idempotency_key({}, data) if not error else None
+        error = error or validate_idempotency_key(key)
+        if error:
+            results.append({'index': index, 'status': 400, 'error': error})
+            continue
+        if key and key in seen_keys:
+            results.append({'index': index, 'status': 409, 'error': f'Повтор idempotency_key {key} в пакете'})
+            continue
+        if key:
+            seen_keys.add(key)
+        results.append(None)
+        positions.append(index)
+        items.append({
+            'card_code': str(data['card_code']).strip(),
+            'quantity': data['quantity'],
+            'price': data.get('price', 0),
+            'code_1c': str(data['code_1c']).strip(),
+            'comment': (data.get('comment') or '').strip(),
+            'idempotency_key': key
+        })
     
-    card_code = body_data.get('card_code', '').strip()
-    quantity = body_data.get('quantity', 0)
-    price = body_data.get('price', 0)
-    code_1c = body_data.get('code_1c', '').strip()
-    comment = body_data.get('comment', '').strip()
+    if items:
+        with db.connection() as conn:
+            conn.autocommit = False
+            # Повтор при UniqueViolation: параллельный запрос успел сохранить те же ключи,
+            # во второй попытке они вернутся как сохраненные ответы
+            for attempt in range(2):
+                try:
+                    with conn.cursor() as cur:
+                        stored = find_stored_responses(cur, [item['idempotency_key'] for item in items if item['idempotency_key']])
+                        pending = []
+                        for index, item in zip(positions, items):
+                            if item['idempotency_key'] in stored:
+                                results[index] = {'index': index, 'status': 200, 'replayed': True, **stored[item['idempotency_key']]}
+                            else:
+                                pending.append((index, item))
+                        applied_results = dispense_batch(cur, [item for _, item in pending]) if pending else []
+                        to_store = []
+                        for (index, item), result in zip(pending, applied_results):
+                            results[index] = {'index': index, **result}
+                            if result.get('success') and item['idempotency_key']:
+                                to_store.append((item['idempotency_key'], {k: v for k, v in result.items() if k != 'status'}))
+                        store_responses(cur, 'refuel', to_store)
+                    conn.commit()
+                    break
+                except UniqueViolation:
+                    conn.rollback()
+                    if attempt:
+                        raise
     
-    if not card_code:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не указан номер карты (card_code)'})
-        }
+    applied = sum(1 for result in results if result and result.get('success'))
+    return api.json_response({
+        'success': True,
+        'applied': applied,
+        'failed': len(results) - applied,
+        'results': results
+    })
+
+def single_refuel(request: api.Request, body_data: Any) -> Dict[str, Any]:
+    '''
+    Поля одиночной заправки из тела запроса; при ошибке HttpError 400
+    '''
+    error = validate_refuel(body_data) if isinstance(body_data, dict) else 'Некорректный JSON'
+    if error:
+        raise api.HttpError(400, error)
     
-    if not quantity or quantity <= 0:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Количество топлива должно быть больше 0'})
-        }
+    idempotency_key = get_idempotency_key(request.event, body_data)
+    key_error = validate_idempotency_key(idempotency_key)
+    if key_error:
+        raise api.HttpError(400, key_error)
     
-    if not code_1c:
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не указан код АЗС (code_1c)'})
-        }
+    return {
+        'card_code': str(body_data['card_code']).strip(),
+        'quantity': body_data['quantity'],
+        'price': body_data.get('price', 0),
+        'code_1c': str(body_data['code_1c']).strip(),
+        'comment': (body_data.get('comment') or '').strip(),
+        'idempotency_key': idempotency_key
+    }
+
+def apply_refuel(cur: Any, item: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Списание одиночной заправки в открытой транзакции; при отказе DispenseError
+    '''
+    station = refcache.station_by_code_1c(cur, item['code_1c'])
+    if station is None:
+        raise DispenseError(404, {'error': f"АЗС с кодом {item['code_1c']} не найдена"})
+    return dispense(
+        cur, item['card_code'], item['quantity'], price=item['price'], comment=item['comment'],
+        code_1c=item['code_1c'], station_id=station['id']
+    )
+
+def submit_refuel(item: Dict[str, Any]) -> Optional[Future]:
+    '''
+    Передает заправку координатору групповой фиксации (DISPENSE_GROUP_COMMIT_MS);
+    None — групповая фиксация выключена
+    '''
+    coordinator = group_commit()
+    if coordinator is None:
+        return None
+    return coordinator.submit(item['card_code'], 'refuel', item['idempotency_key'], lambda cur: apply_refuel(cur, item))
+
+def outcome_response(outcome: Outcome) -> Dict[str, Any]:
+    status_code, body, replayed = outcome
+    return replayed_response(body, status_code) if replayed else api.json_response(body, status_code)
+
+def refuel(request: api.Request) -> Dict[str, Any]:
+    body_data = request.json
+    if isinstance(body_data, dict) and isinstance(body_data.get('refuels'), list):
+        return refuel_batch(body_data['refuels'])
     
-    dsn = os.environ.get('DATABASE_URL')
-    if not dsn:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'DATABASE_URL не настроен'})
-        }
+    item = single_refuel(request, body_data)
+    future = submit_refuel(item)
+    if future is not None:
+        return outcome_response(future.result())
+    idempotency_key = item['idempotency_key']
     
-    conn = psycopg2.connect(dsn)
-    try:
+    with db.connection() as conn:
         conn.autocommit = False
         with conn.cursor() as cur:
-            escaped_card_code = card_code.replace("'", "''")
-            
-            cur.execute(f"""
-                SELECT id, card_code, balance_liters
-                FROM fuel_cards
-                WHERE card_code = '{escaped_card_code}'
-            """)
-            
-            card_row = cur.fetchone()
-            
-            if not card_row:
-                conn.rollback()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'Карта {card_code} не найдена'})
-                }
-            
-            card_id = card_row[0]
-            current_balance = float(card_row[2]) if card_row[2] is not None else 0.0
+            if idempotency_key:
+                stored = find_stored_response(cur, idempotency_key)
+                if stored:
+                    return replayed_response(stored[1], stored[0])
             
-            if current_balance < quantity:
-                conn.rollback()
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'error': 'Недостаточно топлива на карте',
-                        'current_balance': current_balance,
-                        'requested_quantity': quantity
-                    })
-                }
+            try:
+                result = apply_refuel(cur, item)
+            except DispenseError as e:
+                return api.json_response(e.body, e.status_code)
             
-            new_balance = current_balance - quantity
-            
-            cur.execute(f"""
-                UPDATE fuel_cards
-                SET balance_liters = {new_balance}
-                WHERE id = {card_id}
-            """)
-            
-            amount = quantity * price
-            operation_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            escaped_code = code_1c.replace("'", "''")
-            escaped_comment = comment.replace("'", "''")
-            
-            cur.execute(f"""
-                SELECT id, name FROM stations WHERE code_1c = '{escaped_code}' LIMIT 1
-            """)
-            station_row = cur.fetchone()
-            
-            if not station_row:
-                conn.rollback()
-                return {
-                    'statusCode': 404,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': f'АЗС с кодом {code_1c} не найдена'})
-                }
-            
-            station_id = station_row[0]
-            station_name = station_row[1]
-            
-            cur.execute(f"""
-                INSERT INTO card_operations 
-                (fuel_card_id, station_id, operation_date, operation_type, quantity, price, amount, comment)
-                VALUES 
-                ({card_id}, {station_id}, '{operation_date}', 'заправка', {quantity}, {price}, {amount}, '{escaped_comment}')
-            """)
+            if idempotency_key:
+                try:
+                    store_response(cur, idempotency_key, 'refuel', result)
+                except UniqueViolation:
+                    conn.rollback()
+                    stored = find_stored_response(cur, idempotency_key)
+                    return replayed_response(stored[1], stored[0])
             
             conn.commit()
-            
-            result = {
-                'success': True,
-                'card_code': card_code,
-                'operation_type': 'заправка',
-                'quantity': quantity,
-                'price': price,
-                'amount': amount,
-                'previous_balance': current_balance,
-                'new_balance': new_balance,
-                'code_1c': code_1c,
-                'station_name': station_name,
-                'operation_date': operation_date
-            }
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps(result, ensure_ascii=False)
-            }
-    except Exception as e:
-        conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка выполнения операции: {str(e)}'})
-        }
-    finally:
-        conn.close()
\ No newline at end of file
+    
+    return api.json_response(result)
+
+async def refuel_async(request: api.Request) -> Dict[str, Any]:
+    body_data = request.json
+    if isinstance(body_data, dict) and isinstance(body_data.get('refuels'), list):
+        # Пакеты из 1С редки и тяжелы: выполняются синхронным кодом в пуле потоков
+        return await asyncio.to_thread(refuel_batch, body_data['refuels'])
+    
+    item = single_refuel(request, body_data)
+    future = submit_refuel(item)
+    if future is not None:
+        return outcome_response(await asyncio.wrap_future(future))
+    idempotency_key = item['idempotency_key']
+    
+    async with adb.connection() as conn:
+        if idempotency_key:
+            stored = await find_stored_response_async(conn, idempotency_key)
+            if stored:
+                return replayed_response(stored[1], stored[0])
+        
+        try:
+            async with conn.transaction():
+                station = await refcache.station_by_code_1c_async(conn, item['code_1c'])
+                if station is None:
+                    raise DispenseError(404, {'error': f"АЗС с кодом {item['code_1c']} не найдена"})
+                result = await dispense_async(
+                    conn, item['card_code'], item['quantity'], price=item['price'], comment=item['comment'],
+                    code_1c=item['code_1c'], station_id=station['id']
+                )
+                if idempotency_key:
+                    await store_response_async(conn, idempotency_key, 'refuel', result)
+        except DispenseError as e:
+            return api.json_response(e.body, e.status_code)
+        except UniqueViolationError:
+            stored = await find_stored_response_async(conn, idempotency_key)
+            return replayed_response(stored[1], stored[0])
+    
+    return api.json_response(result)
+
+ROUTER_OPTIONS = {
+    'allow_headers': ('Content-Type', 'X-Api-Key', 'Idempotency-Key'),
+    'default_method': 'POST',
+    'error_prefix': 'Ошибка выполнения операции: ',
+    'method_not_allowed': 'Метод не поддерживается. Используйте POST',
+    'database_error': 'DATABASE_URL не настроен',
+    'invalid_json': 'Некорректный JSON'
+}
+
+router = api.Router({'POST': refuel}, **ROUTER_OPTIONS)
+async_router = api.AsyncRouter({'POST': refuel_async}, **ROUTER_OPTIONS)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Выполнение операции заправки: уменьшение баланса карты и запись в историю операций
+    Args: event - dict с httpMethod, body (card_code, quantity, price, code_1c, comment, idempotency_key)
+          или body {refuels: [...]} для пакетной загрузки
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict с результатом операции
+    '''
+    return router(event, context)
+
+
+@db.instrumented
+async def async_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    То же, что handler, на asyncpg (adb): ожидание БД не занимает поток,
+    локальный шлюз в режиме --async держит сотни одновременных запросов колонок
+    '''
+    return await async_router(event, context)
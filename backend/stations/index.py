@@ -1,80 +1,42 @@
-import json
-import os
-import psycopg2
+import api
+import db
+import refcache
+import session
 from typing import Dict, Any
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    '''
-    API для управления АЗС: получение, создание, обновление и удаление станций
-    Args: event - dict с httpMethod, body, queryStringParameters
-          context - объект с атрибутами request_id, function_name
-    Returns: HTTP response dict
-    '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Database configuration error'}),
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(database_url)
-        cursor = conn.cursor()
-        
-        if method == 'GET':
+STATION_COLUMNS = ('id', 'name', 'code_1c', 'address')
+
+def list_stations(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event)
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            conditional = api.Conditional(request, *db.table_version(cursor, ('stations',)))
+            if conditional.fresh:
+                return conditional.not_modified()
             cursor.execute("""
                 SELECT id, name, code_1c, address, created_at
                 FROM stations
                 ORDER BY id
             """)
             rows = cursor.fetchall()
-            
-            stations = []
-            for row in rows:
-                stations.append({
-                    'id': row[0],
-                    'name': row[1],
-                    'code_1c': row[2],
-                    'address': row[3],
-                    'created_at': row[4].isoformat() if row[4] else None
-                })
-            
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'stations': stations}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            
+
+    stations = [
+        {
+            'id': row[0],
+            'name': row[1],
+            'code_1c': row[2],
+            'address': row[3],
+            'created_at': row[4].isoformat() if row[4] else None
+        }
+        for row in rows
+    ]
+    return conditional.response({'stations': stations})
+
+def create_station(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
                 INSERT INTO stations (name, code_1c, address)
                 VALUES (%s, %s, %s)
@@ -84,33 +46,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('code_1c'),
                 body_data.get('address')
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            station = {
-                'id': row[0],
-                'name': row[1],
-                'code_1c': row[2],
-                'address': row[3]
-            }
-            
-            return {
-                'statusCode': 201,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'station': station}),
-                'isBase64Encoded': False
-            }
-        
-        if method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            station_id = body_data.get('id')
-            
+        conn.commit()
+    refcache.invalidate('stations')
+
+    return api.json_response({'station': dict(zip(STATION_COLUMNS, row))}, 201)
+
+def update_station(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    body_data = request.json
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("""
                 UPDATE stations
                 SET name = %s, code_1c = %s, address = %s
@@ -120,92 +66,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 body_data.get('name'),
                 body_data.get('code_1c'),
                 body_data.get('address'),
-                station_id
+                body_data.get('id')
             ))
-            
             row = cursor.fetchone()
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            if row:
-                station = {
-                    'id': row[0],
-                    'name': row[1],
-                    'code_1c': row[2],
-                    'address': row[3]
-                }
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'station': station}),
-                    'isBase64Encoded': False
-                }
-            else:
-                return {
-                    'statusCode': 404,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Station not found'}),
-                    'isBase64Encoded': False
-                }
-        
-        if method == 'DELETE':
-            params = event.get('queryStringParameters') or {}
-            station_id = params.get('id')
-            
-            if not station_id:
-                cursor.close()
-                conn.close()
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'error': 'Station ID required'}),
-                    'isBase64Encoded': False
-                }
-            
+        conn.commit()
+    refcache.invalidate('stations')
+
+    if not row:
+        raise api.HttpError(404, 'Station not found')
+    return api.json_response({'station': dict(zip(STATION_COLUMNS, row))})
+
+def delete_station(request: api.Request) -> Dict[str, Any]:
+    session.authorize(request.event, admin=True)
+    station_id = request.params.get('id')
+    if not station_id:
+        raise api.HttpError(400, 'Station ID required')
+
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
             cursor.execute("DELETE FROM stations WHERE id = %s", (station_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.close()
-        conn.close()
-        return {
-            'statusCode': 405,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': 'Method not allowed'}),
-            'isBase64Encoded': False
-        }
-    
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'error': f'Server error: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+        conn.commit()
+    refcache.invalidate('stations')
+
+    return api.json_response({'success': True})
+
+router = api.Router(
+    {'GET': list_stations, 'POST': create_station, 'PUT': update_station, 'DELETE': delete_station},
+    allow_headers=('Content-Type', 'X-Auth-Token', 'Authorization'),
+    error_prefix='Server error: '
+)
+
+@db.instrumented
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    API для управления АЗС: получение, создание, обновление и удаление станций
+    Args: event - dict с httpMethod, body, queryStringParameters
+          context - объект с атрибутами request_id, function_name
+    Returns: HTTP response dict
+    '''
+    return router(event, context)
@@ -0,0 +1,67 @@
+import threading
+from types import ModuleType
+from typing import Any, Dict
+
+from psycopg2.extensions import cursor as base_cursor
+
+_local = threading.local()
+
+
+def reset() -> None:
+    _local.queries = 0
+    _local.rows = 0
+
+
+def snapshot() -> Dict[str, int]:
+    return {'queries': getattr(_local, 'queries', 0), 'rows': getattr(_local, 'rows', 0)}
+
+
+def _add(queries: int = 0, rows: int = 0) -> None:
+    _local.queries = getattr(_local, 'queries', 0) + queries
+    _local.rows = getattr(_local, 'rows', 0) + rows
+
+
+class CountingCursorMixin:
+    '''
+    Считает запросы и полученные строки в счетчиках текущего потока:
+    один поток нагрузки выполняет один запрос к функции за раз
+    '''
+
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        _add(queries=1)
+        return super().execute(query, vars)
+
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        _add(queries=1)
+        return super().executemany(query, vars_list)
+
+    def fetchone(self) -> Any:
+        row = super().fetchone()
+        if row is not None:
+            _add(rows=1)
+        return row
+
+    def fetchmany(self, size: Any = None) -> Any:
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        _add(rows=len(rows))
+        return rows
+
+    def fetchall(self) -> Any:
+        rows = super().fetchall()
+        _add(rows=len(rows))
+        return rows
+
+    def __next__(self) -> Any:
+        row = super().__next__()
+        _add(rows=1)
+        return row
+
+
+def instrument(function_module: ModuleType) -> None:
+    '''
+    Подключает счетчики к пулу функции поверх ее собственного cursor_factory (TimedCursor из db.py):
+    соединения создаются с этим курсором, поэтому учитываются и обычные, и именованные (серверные) курсоры
+    '''
+    connect_kwargs = function_module.db.CONNECT_KWARGS
+    base = connect_kwargs.get('cursor_factory') or base_cursor
+    connect_kwargs['cursor_factory'] = type('CountingCursor', (CountingCursorMixin, base), {})
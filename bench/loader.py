@@ -0,0 +1,45 @@
+import importlib.util
+import os
+import sys
+import threading
+from types import ModuleType
+from typing import Any, Callable, Dict
+
+# Каталог функций и список модулей-копий — общие со шлюзом, чтобы не расходились
+from gateway.app import BACKEND_DIR, SHARED_MODULE_NAMES
+
+_load_lock = threading.Lock()
+
+
+def load_function(name: str) -> ModuleType:
+    '''
+    Загружает backend/<name>/index.py так же, как платформа: со своими копиями общих модулей.
+    Каждая функция получает собственные модули (и собственный пул соединений), поэтому
+    несколько функций можно держать в одном процессе без конфликтов имен
+    '''
+    function_dir = os.path.join(BACKEND_DIR, name)
+    index_path = os.path.join(function_dir, 'index.py')
+    if not os.path.isfile(index_path):
+        raise ValueError(f'Функция {name} не найдена в {BACKEND_DIR}')
+
+    with _load_lock:
+        saved = {module_name: sys.modules.pop(module_name) for module_name in SHARED_MODULE_NAMES if module_name in sys.modules}
+        sys.path.insert(0, function_dir)
+        try:
+            spec = importlib.util.spec_from_file_location(f"backend_{name.replace('-', '_')}", index_path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            # Копии общих модулей этой функции (db, dispense, ...) — для замеров отдельных запросов
+            module.shared_modules = {
+                module_name: sys.modules[module_name] for module_name in SHARED_MODULE_NAMES if module_name in sys.modules
+            }
+        finally:
+            sys.path.remove(function_dir)
+            for module_name in SHARED_MODULE_NAMES:
+                sys.modules.pop(module_name, None)
+            sys.modules.update(saved)
+    return module
+
+
+def load_handlers(names: list) -> Dict[str, Callable[[Dict[str, Any], Any], Dict[str, Any]]]:
+    return {name: load_function(name).handler for name in names}
@@ -0,0 +1,133 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import date
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Tuple
+
+import psycopg2
+
+from bench import loader, scenarios
+from bench.seed import SCHEMA, connect
+
+# Горячие запросы списания и опроса карт: обычный запрос с параметрами против
+# подготовленного (db.Statement). По каждому — задержка на клиенте и время планирования
+# и выполнения на сервере из EXPLAIN (ANALYZE). Каждый вызов выполняется в транзакции
+# и откатывается, данные базы не меняются
+EXPLAIN = 'EXPLAIN (ANALYZE, FORMAT JSON) '
+
+
+Case = Tuple[Any, Callable[[random.Random], Dict[str, Any]]]
+
+
+def load_statements(dataset: scenarios.Dataset) -> Tuple[ModuleType, Dict[str, Case]]:
+    '''
+    Statement из кода функций и генераторы параметров к ним; db — модуль с классом соединения
+    '''
+    refuel = loader.load_function('refuel')
+    card_status = loader.load_function('card-status')
+    operator_dispense = loader.load_function('operator-dispense')
+    dispense = refuel.shared_modules['dispense']
+
+    def dispense_params(rng: random.Random) -> Dict[str, Any]:
+        card, station = rng.choice(dataset.cards), rng.choice(dataset.stations)
+        return dispense.dispense_params(card[1], 1.0, price=55.5, comment='bench', code_1c=station[1], station_id=station[0])
+
+    def dispense_by_code_params(rng: random.Random) -> Dict[str, Any]:
+        card, station = rng.choice(dataset.cards), rng.choice(dataset.stations)
+        return dispense.dispense_params(card[1], 1.0, price=55.5, comment='bench', code_1c=station[1])
+
+    def card_params(rng: random.Random) -> Dict[str, Any]:
+        return {'today': date.today(), 'card_code': rng.choice(dataset.cards)[1]}
+
+    return refuel.shared_modules['db'], {
+        'dispense_by_station_id': (dispense.DISPENSE_BY_STATION_ID, dispense_params),
+        'dispense_by_code_1c': (dispense.DISPENSE_BY_CODE_1C, dispense_by_code_params),
+        'find_stored_response': (dispense.FIND_STORED_RESPONSE, lambda rng: {'key': uuid.uuid4().hex}),
+        'card_status_by_code': (card_status.CARD_STATUS_BY_CODE, card_params),
+        'operator_card_info': (operator_dispense.CARD_INFO, card_params),
+    }
+
+
+def run(conn: Any, statement: Any, make_params: Callable[[random.Random], Dict[str, Any]], prepared: bool,
+        iterations: int, rng: random.Random) -> Dict[str, float]:
+    client_ms: List[float] = []
+    planning_ms: List[float] = []
+    execution_ms: List[float] = []
+    with conn.cursor() as cur:
+        # Прогрев: PREPARE на соединении и первые пять выполнений, после которых
+        # сервер решает, переходить ли на общий план
+        for _ in range(10):
+            if prepared:
+                statement.execute(cur, make_params(rng))
+            else:
+                cur.execute(statement.query, make_params(rng))
+            cur.fetchall()
+            conn.rollback()
+        for _ in range(iterations):
+            params = make_params(rng)
+            started = time.perf_counter()
+            if prepared:
+                statement.execute(cur, params)
+            else:
+                cur.execute(statement.query, params)
+            cur.fetchall()
+            client_ms.append((time.perf_counter() - started) * 1000)
+            conn.rollback()
+
+            if prepared:
+                cur.execute(EXPLAIN + statement.execute_sql, statement.args(make_params(rng)))
+            else:
+                cur.execute(EXPLAIN + statement.query, make_params(rng))
+            plan = cur.fetchone()[0][0]
+            planning_ms.append(plan['Planning Time'])
+            execution_ms.append(plan['Execution Time'])
+            conn.rollback()
+    return {
+        'client_p50_ms': round(statistics.median(client_ms), 3),
+        'planning_p50_ms': round(statistics.median(planning_ms), 3),
+        'execution_p50_ms': round(statistics.median(execution_ms), 3),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Обычные и подготовленные горячие запросы: планирование и задержка')
+    parser.add_argument('--dsn', required=True)
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    conn = connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            dataset = scenarios.Dataset(cur)
+    finally:
+        conn.close()
+    if not dataset.cards or not dataset.stations:
+        print('В базе нет карт: сначала запустите python -m bench.seed', file=sys.stderr)
+        return 2
+    db, cases = load_statements(dataset)
+
+    report = {}
+    for name, (statement, make_params) in cases.items():
+        report[name] = {}
+        for mode in ('plain', 'prepared'):
+            conn = psycopg2.connect(args.dsn, options=f'-c search_path={SCHEMA}', connection_factory=db.Connection)
+            try:
+                report[name][mode] = run(conn, statement, make_params, mode == 'prepared', args.iterations, random.Random(args.seed))
+            finally:
+                conn.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from bench import counters, loader, scenarios
+from bench.seed import SCHEMA, connect
+
+
+class Context:
+    request_id = 'bench'
+    function_name = 'bench'
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.samples: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+
+    def add(self, scenario: str, sample: Dict[str, Any]) -> None:
+        with self.lock:
+            self.samples[scenario].append(sample)
+
+    def report(self, elapsed: float) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for scenario, samples in sorted(self.samples.items()):
+            latencies = sorted(sample['ms'] for sample in samples)
+            count = len(samples)
+            result[scenario] = {
+                'requests': count,
+                'rps': round(count / elapsed, 1) if elapsed else 0.0,
+                'p50_ms': round(percentile(latencies, 0.50), 2),
+                'p95_ms': round(percentile(latencies, 0.95), 2),
+                'p99_ms': round(percentile(latencies, 0.99), 2),
+                'queries': round(sum(sample['queries'] for sample in samples) / count, 2),
+                'rows': round(sum(sample['rows'] for sample in samples) / count, 1),
+                'response_kb': round(sum(sample['bytes'] for sample in samples) / count / 1024, 2),
+                'errors': sum(1 for sample in samples if sample['status'] >= 400),
+            }
+        return result
+
+
+def call(handler: Any, event: Dict[str, Any]) -> Dict[str, Any]:
+    counters.reset()
+    started = time.perf_counter()
+    try:
+        response = handler(event, Context())
+        status = int(response.get('statusCode', 500))
+        size = len(response.get('body') or '')
+    except Exception as e:
+        print(f'  исключение: {e!r}', file=sys.stderr)
+        status, size = 599, 0
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    stats = counters.snapshot()
+    return {'ms': elapsed_ms, 'status': status, 'bytes': size, **stats}
+
+
+def print_report(report: Dict[str, Dict[str, float]]) -> None:
+    columns = ('requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries', 'rows', 'response_kb', 'errors')
+    width = max([len('scenario')] + [len(name) for name in report])
+    print(f"{'scenario':<{width}}  " + '  '.join(f'{column:>11}' for column in columns))
+    for scenario, stats in report.items():
+        print(f'{scenario:<{width}}  ' + '  '.join(f'{stats[column]:>11}' for column in columns))
+
+
+def compare(report: Dict[str, Dict[str, float]], baseline_path: str, max_regression: float) -> List[str]:
+    '''
+    Сравнение p95 и числа запросов к БД с сохраненным прогоном; возвращает список регрессий
+    '''
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = []
+    for scenario, stats in report.items():
+        base = baseline.get(scenario)
+        if not base:
+            continue
+        if base['p95_ms'] and stats['p95_ms'] > base['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{scenario}: p95 {base['p95_ms']} → {stats['p95_ms']} мс")
+        if stats['queries'] > base['queries'] + 0.01:
+            regressions.append(f"{scenario}: запросов к БД {base['queries']} → {stats['queries']}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон функций backend/ в одном процессе')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='строка подключения к локальному PostgreSQL')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help='длительность прогона, секунд')
+    parser.add_argument('--warmup', type=float, default=3, help='прогрев без учета в отчете, секунд')
+    parser.add_argument('--mix', default=scenarios.DEFAULT_MIX, help='сценарии и веса: card_status=50,refuel=25,...')
+    parser.add_argument('--replay', help='NDJSON с записанными событиями вместо --mix')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='сохранить отчет в JSON (для --baseline следующих прогонов)')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--max-regression', type=float, default=0.2, help='допустимый рост p95 относительно --baseline')
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    # Окружение функций задается до их загрузки: размер пула читается при импорте db.py
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['PGOPTIONS'] = f'-c search_path={SCHEMA}'
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency))
+    os.environ.setdefault('DB_LOG_REQUESTS', '0')
+
+    replay: Optional[List[Any]] = scenarios.load_replay(args.replay) if args.replay else None
+    mix = [] if replay else scenarios.parse_mix(args.mix)
+
+    conn = connect(args.dsn)
+    try:
+        with conn.cursor() as cur:
+            dataset = scenarios.Dataset(cur)
+    finally:
+        conn.close()
+    if not dataset.cards:
+        print('В базе нет карт: сначала запустите python -m bench.seed', file=sys.stderr)
+        return 2
+
+    if replay:
+        function_names = sorted({request[0] for _, request in replay})
+    else:
+        rng = random.Random(0)
+        function_names = sorted({scenarios.SCENARIOS[name](rng, dataset)[0] for name, _ in mix})
+    handlers = {}
+    for name in function_names:
+        module = loader.load_function(name)
+        counters.instrument(module)
+        handlers[name] = module.handler
+
+    recorder = Recorder()
+    replay_position = iter(range(sys.maxsize))
+    replay_lock = threading.Lock()
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    started = time.monotonic()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+
+    def worker(worker_id: int) -> None:
+        rng = random.Random(args.seed * 1000 + worker_id)
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            if replay:
+                with replay_lock:
+                    position = next(replay_position)
+                scenario, (function_name, event) = replay[position % len(replay)]
+            else:
+                scenario = rng.choices(names, weights)[0]
+                function_name, event = scenarios.SCENARIOS[scenario](rng, dataset)
+            sample = call(handlers[function_name], event)
+            if now >= measure_from:
+                recorder.add(scenario, sample)
+
+    print(f'Прогон: {args.concurrency} потоков, {args.warmup:g} с прогрева, {args.duration:g} с замера')
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(worker, i) for i in range(args.concurrency)]:
+            future.result()
+
+    report = recorder.report(args.duration)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        regressions = compare(report, args.baseline, args.max_regression)
+        for line in regressions:
+            print(f'РЕГРЕССИЯ {line}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
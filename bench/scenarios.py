@@ -0,0 +1,121 @@
+import json
+import random
+import uuid
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+# Сценарий: (функция, событие). Событие — то, что платформа передает в handler(event, context)
+Request = Tuple[str, Dict[str, Any]]
+
+
+class Dataset:
+    '''
+    Ключи из тестовой базы, по которым сценарии строят запросы
+    '''
+
+    def __init__(self, cur: Any):
+        cur.execute("SELECT id, card_code, client_id FROM fuel_cards ORDER BY id")
+        self.cards = cur.fetchall()
+        cur.execute("SELECT id, code_1c FROM stations WHERE code_1c <> '200000' ORDER BY id")
+        self.stations = cur.fetchall()
+        cur.execute("SELECT id FROM clients ORDER BY id")
+        self.client_ids = [row[0] for row in cur.fetchall()]
+        # Первые 10% карт — «горячие», как в generate_operations
+        self.hot_cards = self.cards[:max(1, len(self.cards) // 10)]
+
+
+def get(params: Dict[str, Any]) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'queryStringParameters': {k: str(v) for k, v in params.items()}, 'headers': {}}
+
+
+def post(body: Dict[str, Any]) -> Dict[str, Any]:
+    return {'httpMethod': 'POST', 'body': json.dumps(body, ensure_ascii=False), 'headers': {}, 'queryStringParameters': {}}
+
+
+def card_status(rng: random.Random, data: Dataset) -> Request:
+    card = rng.choice(data.hot_cards if rng.random() < 0.5 else data.cards)
+    return 'card-status', get({'card_code': card[1]})
+
+
+def refuel(rng: random.Random, data: Dataset) -> Request:
+    card = rng.choice(data.cards)
+    station = rng.choice(data.stations)
+    return 'refuel', post({
+        'card_code': card[1],
+        'quantity': round(rng.uniform(5, 60), 2),
+        'price': 52.5,
+        'code_1c': station[1],
+        'idempotency_key': str(uuid.uuid4())
+    })
+
+
+def refuel_batch(rng: random.Random, data: Dataset) -> Request:
+    refuels = []
+    for _ in range(100):
+        card = rng.choice(data.cards)
+        refuels.append({
+            'card_code': card[1],
+            'quantity': round(rng.uniform(5, 60), 2),
+            'price': 52.5,
+            'code_1c': rng.choice(data.stations)[1]
+        })
+    return 'refuel', post({'refuels': refuels})
+
+
+def operations_card_history(rng: random.Random, data: Dataset) -> Request:
+    card = rng.choice(data.hot_cards)
+    return 'card-operations', get({'card_id': card[0], 'limit': 200})
+
+
+def operations_latest(rng: random.Random, data: Dataset) -> Request:
+    return 'card-operations', get({'limit': 200})
+
+
+def operations_summary(rng: random.Random, data: Dataset) -> Request:
+    month_start = (date.today().replace(day=1) - timedelta(days=rng.randrange(0, 300))).replace(day=1)
+    return 'card-operations', get({
+        'report': 'summary',
+        'group_by': 'client,fuel_type,month',
+        'date_from': month_start.isoformat()
+    })
+
+
+def cards_of_client(rng: random.Random, data: Dataset) -> Request:
+    return 'fuel-cards', get({'client_id': rng.choice(data.client_ids)})
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, Dataset], Request]] = {
+    'card_status': card_status,
+    'refuel': refuel,
+    'refuel_batch': refuel_batch,
+    'operations_card_history': operations_card_history,
+    'operations_latest': operations_latest,
+    'operations_summary': operations_summary,
+    'cards_of_client': cards_of_client,
+}
+
+DEFAULT_MIX = 'card_status=50,refuel=25,operations_card_history=10,operations_latest=5,cards_of_client=5,operations_summary=4,refuel_batch=1'
+
+
+def parse_mix(value: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Неизвестный сценарий {name}; доступны: {', '.join(SCENARIOS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def load_replay(path: str) -> List[Tuple[str, Request]]:
+    '''
+    Записанный поток запросов: NDJSON со строками {"function": ..., "event": {...}, "scenario": ...}
+    '''
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                requests.append((item.get('scenario') or item['function'], (item['function'], item['event'])))
+    return requests
@@ -0,0 +1,164 @@
+import argparse
+import io
+import os
+import random
+from datetime import date, datetime, timedelta
+from typing import Any, Iterator, List
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'db_migrations')
+# Схема, в которой работают функции в облаке (на нее ссылаются миграции V0006, V0007)
+SCHEMA = 't_p39946729_azs_lg_project'
+COPY_CHUNK_ROWS = 100_000
+OPERATION_TYPES = (('заправка', 0.85), ('пополнение', 0.1), ('списание', 0.03), ('оприходование', 0.02))
+
+
+def connect(dsn: str) -> Any:
+    return psycopg2.connect(dsn, options=f'-c search_path={SCHEMA}')
+
+
+def apply_migrations(conn: Any) -> None:
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS {SCHEMA}')
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if name.endswith('.sql'):
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as f:
+                    cur.execute(f.read())
+                print(f'  {name}')
+    conn.commit()
+
+
+def reset(conn: Any) -> None:
+    with conn.cursor() as cur:
+        cur.execute("""
+            TRUNCATE card_operations, card_daily_usage, operation_daily_rollups, dispense_requests,
+                     fuel_cards, clients, stations RESTART IDENTITY CASCADE
+        """)
+    conn.commit()
+
+
+def copy_rows(cur: Any, table: str, columns: List[str], rows: Iterator[tuple]) -> int:
+    '''
+    Загрузка через COPY порциями по COPY_CHUNK_ROWS строк, чтобы не держать весь набор в памяти
+    '''
+    total = 0
+    while True:
+        buffer = io.StringIO()
+        count = 0
+        for row in rows:
+            buffer.write('\t'.join('\\N' if value is None else str(value) for value in row) + '\n')
+            count += 1
+            if count >= COPY_CHUNK_ROWS:
+                break
+        if not count:
+            return total
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+        total += count
+
+
+def generate_operations(rng: random.Random, cards: List[tuple], stations: List[tuple], count: int, days: int) -> Iterator[tuple]:
+    '''
+    Операции по картам за последние days дней; «горячие» карты (первые 10%) получают
+    больше операций, как крупные клиенты в реальной базе
+    '''
+    now = datetime.now().replace(microsecond=0)
+    hot = cards[:max(1, len(cards) // 10)]
+    types, weights = zip(*OPERATION_TYPES)
+    for _ in range(count):
+        card_id = rng.choice(hot)[0] if rng.random() < 0.5 else rng.choice(cards)[0]
+        station_id, station_name = rng.choice(stations)
+        operation_type = rng.choices(types, weights)[0]
+        quantity = round(rng.uniform(5, 80), 2) if operation_type == 'заправка' else round(rng.uniform(100, 2000), 2)
+        price = round(rng.uniform(48, 62), 2)
+        operation_date = now - timedelta(seconds=rng.randrange(days * 86400))
+        yield (card_id, station_id, station_name, operation_date, operation_type, quantity, price,
+               round(quantity * price, 2), 'bench')
+
+
+def seed(conn: Any, clients: int, cards: int, stations: int, operations: int, days: int, seed_value: int) -> None:
+    rng = random.Random(seed_value)
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM fuel_types ORDER BY id")
+        fuel_type_ids = [row[0] for row in cur.fetchall()]
+
+        station_rows = [('Склад', '200000', 'Центральный склад')] + [
+            (f'АЗС bench №{i}', f'3{i:05d}', f'Адрес {i}') for i in range(1, stations + 1)
+        ]
+        copy_rows(cur, 'stations', ['name', 'code_1c', 'address'], iter(station_rows))
+        cur.execute("SELECT id, name FROM stations WHERE code_1c <> '200000' ORDER BY id")
+        station_list = cur.fetchall()
+
+        copy_rows(cur, 'clients', ['inn', 'name', 'login', 'password'], (
+            (f'77{i:08d}', f'ООО Клиент {i}', f'client{i}', 'bench') for i in range(1, clients + 1)
+        ))
+        cur.execute("SELECT id FROM clients ORDER BY id")
+        client_ids = [row[0] for row in cur.fetchall()]
+
+        # card_code — не больше 4 цифр, поэтому карт не больше 9999
+        copy_rows(cur, 'fuel_cards', ['client_id', 'fuel_type_id', 'balance_liters', 'card_code', 'pin_code', 'daily_limit'], (
+            (client_ids[i % len(client_ids)], rng.choice(fuel_type_ids), 1_000_000, f'{i:04d}', '1234',
+             rng.choice((0, 0, 0, 500)))
+            for i in range(1, min(cards, 9999) + 1)
+        ))
+        cur.execute("SELECT id, card_code FROM fuel_cards ORDER BY id")
+        card_list = cur.fetchall()
+
+        # Секции card_operations за всю историю создаются до загрузки, иначе строки попадут в секцию по умолчанию
+        month = date.today().replace(day=1) - timedelta(days=days)
+        cur.execute("""
+            SELECT create_card_operations_partition(m::date)
+            FROM generate_series(date_trunc('month', %s::date), date_trunc('month', CURRENT_DATE), INTERVAL '1 month') AS m
+        """, (month,))
+        conn.commit()
+
+        loaded = copy_rows(cur, 'card_operations', [
+            'fuel_card_id', 'station_id', 'station_name', 'operation_date', 'operation_type',
+            'quantity', 'price', 'amount', 'comment'
+        ], generate_operations(rng, card_list, station_list, operations, days))
+
+        cur.execute("""
+            INSERT INTO card_daily_usage (fuel_card_id, usage_date, liters)
+            SELECT fuel_card_id, operation_date::date, SUM(quantity)
+            FROM card_operations
+            WHERE operation_type = 'заправка'
+            GROUP BY fuel_card_id, operation_date::date
+        """)
+    conn.commit()
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('VACUUM ANALYZE')
+    conn.autocommit = False
+    print(f'  АЗС: {len(station_list)}, клиентов: {len(client_ids)}, карт: {len(card_list)}, операций: {loaded}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Генерация тестовой базы для нагрузочных прогонов')
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'), help='строка подключения к локальному PostgreSQL')
+    parser.add_argument('--migrate', action='store_true', help='применить db_migrations перед генерацией')
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--cards', type=int, default=5000)
+    parser.add_argument('--stations', type=int, default=50)
+    parser.add_argument('--operations', type=int, default=2_000_000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error('укажите --dsn или DATABASE_URL')
+
+    conn = connect(args.dsn)
+    try:
+        if args.migrate:
+            print('Миграции:')
+            apply_migrations(conn)
+        print('Очистка данных')
+        reset(conn)
+        print('Генерация данных')
+        seed(conn, args.clients, args.cards, args.stations, args.operations, args.days, args.seed)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import random
+import time
+import timeit
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Tuple
+
+from bench.loader import BACKEND_DIR
+
+# Стоимость сборки ответа без БД: прежний код (float()/strftime по каждому полю, литерал заголовков,
+# json.dumps с ASCII-экранированием) против api.json_response. Строки для api_us имеют форму,
+# в которой их отдает новый запрос списка операций (NUMERIC::float8 → float); api_decimal_us —
+# те же строки с Decimal, которые преобразует сам энкодер
+
+OPERATION_COLUMNS = (
+    'id', 'card_code', 'station_name', 'operation_date', 'operation_type',
+    'quantity', 'price', 'amount', 'comment', 'fuel_card_id', 'station_id'
+)
+
+
+def load_api() -> ModuleType:
+    spec = importlib.util.spec_from_file_location('bench_api', os.path.join(BACKEND_DIR, 'auth', 'api.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def operation_rows(count: int, seed: int) -> List[Tuple[Any, ...]]:
+    rng = random.Random(seed)
+    started = datetime(2026, 1, 1)
+    rows = []
+    for i in range(count):
+        quantity = Decimal(rng.randint(500, 9000)) / 100
+        price = Decimal(rng.randint(5000, 6500)) / 100
+        rows.append((
+            i + 1, f'{rng.randint(1, 99999):05d}', f'АЗС №{rng.randint(1, 50)}',
+            started + timedelta(minutes=17 * i), 'заправка',
+            quantity, price, (quantity * price).quantize(Decimal('0.01')),
+            'Заправка автомобиля', rng.randint(1, 5000), rng.randint(1, 50)
+        ))
+    return rows
+
+
+def legacy_operations(rows: List[Tuple[Any, ...]]) -> Dict[str, Any]:
+    operations = []
+    for row in rows:
+        operations.append({
+            'id': row[0],
+            'card_code': row[1],
+            'station_name': row[2],
+            'operation_date': row[3].strftime('%Y-%m-%d %H:%M') if row[3] else '',
+            'operation_type': row[4],
+            'quantity': float(row[5]) if row[5] else 0.0,
+            'price': float(row[6]) if row[6] else 0.0,
+            'amount': float(row[7]) if row[7] else 0.0,
+            'comment': row[8] or '',
+            'fuel_card_id': row[9],
+            'station_id': row[10]
+        })
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({'operations': operations, 'next_cursor': None}),
+        'isBase64Encoded': False
+    }
+
+
+def legacy_error() -> Dict[str, Any]:
+    return {
+        'statusCode': 404,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'body': json.dumps({'error': 'Карта 00001 не найдена'}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+
+def measure(func: Callable[[], Dict[str, Any]], number: int, repeat: int) -> float:
+    # Процессорное время, а не wall clock: на общей машине так меньше шума от соседей
+    return min(timeit.repeat(func, timer=time.process_time, number=number, repeat=repeat)) / number * 1e6
+
+
+def payload_report(api: ModuleType, rows: List[Tuple[Any, ...]], repeat: int) -> Dict[str, float]:
+    '''
+    Размер тела списка операций по вариантам: объекты / columns, без сжатия / gzip / br,
+    и время сжатия (api.compress с уровнями по умолчанию)
+    '''
+    report: Dict[str, float] = {}
+    for layout in ('objects', 'columns'):
+        request = api.Request({'queryStringParameters': {'layout': layout}}, 'GET')
+        response = api.json_response({**api.rows_payload(request, 'operations', OPERATION_COLUMNS, rows), 'next_cursor': None})
+        report[f'{layout}_kb'] = round(len(response['body'].encode('utf-8')) / 1024, 2)
+        for encoding in ('gzip', 'br') if api.brotli is not None else ('gzip',):
+            request = api.Request({'headers': {'Accept-Encoding': encoding}}, 'GET')
+            compressed = api.compress(request, response)
+            # Тело меньше COMPRESS_MIN_BYTES возвращается несжатым
+            data = base64.b64decode(compressed['body']) if compressed.get('isBase64Encoded') else compressed['body'].encode('utf-8')
+            report[f'{layout}_{encoding}_kb'] = round(len(data) / 1024, 2)
+            report[f'{layout}_{encoding}_us'] = round(measure(lambda: api.compress(request, response), 20, repeat), 1)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Сравнение сборки JSON-ответа: прежний код и api.json_response')
+    parser.add_argument('--rows', default='1,200,1000', help='Размеры страниц операций через запятую')
+    parser.add_argument('--repeat', type=int, default=15)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    api = load_api()
+    error_response = lambda: api.error_response(404, 'Карта 00001 не найдена')
+    cases: Dict[str, Tuple[Callable[[], Dict[str, Any]], ...]] = {
+        'error': (legacy_error, error_response, error_response)
+    }
+    for count in (int(value) for value in args.rows.split(',')):
+        rows = operation_rows(count, args.seed)
+        float_rows = [row[:5] + tuple(float(value) for value in row[5:8]) + row[8:] for row in rows]
+        cases[f'operations_{count}'] = (
+            lambda rows=rows: legacy_operations(rows),
+            lambda rows=float_rows: api.json_response({
+                'operations': [dict(zip(OPERATION_COLUMNS, row)) for row in rows],
+                'next_cursor': None
+            }),
+            lambda rows=rows: api.json_response({
+                'operations': [dict(zip(OPERATION_COLUMNS, row)) for row in rows],
+                'next_cursor': None
+            })
+        )
+
+    report = {}
+    for name, (legacy, current, current_decimal) in cases.items():
+        legacy_body, current_body = legacy()['body'], current()['body']
+        if not json.loads(legacy_body) == json.loads(current_body) == json.loads(current_decimal()['body']):
+            raise SystemExit(f'{name}: тела ответов различаются')
+        number = max(1, 20000 // max(1, len(current_body) // 100))
+        legacy_us = measure(legacy, number, args.repeat)
+        current_us = measure(current, number, args.repeat)
+        report[name] = {
+            'legacy_us': round(legacy_us, 1),
+            'api_us': round(current_us, 1),
+            'api_decimal_us': round(measure(current_decimal, number, args.repeat), 1),
+            'saved_pct': round((1 - current_us / legacy_us) * 100, 1),
+            'legacy_kb': round(len(legacy_body.encode('utf-8')) / 1024, 2),
+            'api_kb': round(len(current_body.encode('utf-8')) / 1024, 2),
+        }
+    for count in (int(value) for value in args.rows.split(',')):
+        report[f'payload_{count}'] = payload_report(api, operation_rows(count, args.seed), args.repeat)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
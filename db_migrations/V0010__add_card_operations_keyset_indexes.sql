@@ -0,0 +1,4 @@
+-- Индексы для keyset-пагинации операций по (operation_date, id) и фильтров по карте/АЗС
+CREATE INDEX IF NOT EXISTS idx_card_operations_date_id ON card_operations(operation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_card_operations_card_date_id ON card_operations(fuel_card_id, operation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_card_operations_station_date_id ON card_operations(station_id, operation_date DESC, id DESC);
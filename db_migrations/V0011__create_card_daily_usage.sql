@@ -0,0 +1,18 @@
+-- Счетчик заправок по карте за день: доступный остаток с учетом дневного лимита
+-- читается по первичному ключу вместо SUM(quantity) по card_operations
+CREATE TABLE IF NOT EXISTS card_daily_usage (
+    fuel_card_id INTEGER NOT NULL REFERENCES fuel_cards(id) ON DELETE CASCADE,
+    usage_date DATE NOT NULL,
+    liters DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (fuel_card_id, usage_date)
+);
+
+COMMENT ON TABLE card_daily_usage IS 'Сумма литров по операциям "заправка" на карту за день, обновляется вместе с операцией';
+
+-- Заполнение по существующей истории операций
+INSERT INTO card_daily_usage (fuel_card_id, usage_date, liters)
+SELECT fuel_card_id, operation_date::date, SUM(quantity)
+FROM card_operations
+WHERE operation_type = 'заправка'
+GROUP BY fuel_card_id, operation_date::date
+ON CONFLICT (fuel_card_id, usage_date) DO UPDATE SET liters = EXCLUDED.liters;
@@ -0,0 +1,13 @@
+-- Ключи идемпотентности для списаний (refuel, operator-dispense):
+-- повтор запроса с тем же ключом возвращает сохраненный ответ без повторного списания
+CREATE TABLE IF NOT EXISTS dispense_requests (
+    idempotency_key VARCHAR(100) PRIMARY KEY,
+    endpoint VARCHAR(50) NOT NULL,
+    status_code INTEGER NOT NULL,
+    response JSONB NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_dispense_requests_created_at ON dispense_requests(created_at);
+
+COMMENT ON TABLE dispense_requests IS 'Сохраненные ответы успешных списаний по ключу идемпотентности (например, id документа 1С). Записи старше срока повтора запросов можно удалять по created_at';
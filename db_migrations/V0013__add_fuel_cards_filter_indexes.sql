@@ -0,0 +1,4 @@
+-- Индексы для выборки карт клиента и фильтра по статусу/виду топлива
+CREATE INDEX IF NOT EXISTS idx_fuel_cards_client_id_id ON fuel_cards(client_id, id);
+CREATE INDEX IF NOT EXISTS idx_fuel_cards_status ON fuel_cards(status);
+CREATE INDEX IF NOT EXISTS idx_fuel_cards_fuel_type ON fuel_cards(fuel_type_id);
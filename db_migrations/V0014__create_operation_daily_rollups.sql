@@ -0,0 +1,93 @@
+-- Агрегаты операций для отчетов: клиент × АЗС × вид топлива × день × тип операции.
+-- Месячные отчеты по расходу читаются из тысяч строк агрегата вместо миллионов операций
+CREATE TABLE IF NOT EXISTS operation_daily_rollups (
+    client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+    station_id INTEGER NOT NULL REFERENCES stations(id) ON UPDATE CASCADE,
+    fuel_type_id INTEGER NOT NULL REFERENCES fuel_types(id),
+    day DATE NOT NULL,
+    operation_type VARCHAR(50) NOT NULL,
+    liters DECIMAL(14, 2) NOT NULL DEFAULT 0,
+    amount DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    operations_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (client_id, station_id, fuel_type_id, day, operation_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_operation_daily_rollups_day ON operation_daily_rollups(day);
+CREATE INDEX IF NOT EXISTS idx_operation_daily_rollups_station_day ON operation_daily_rollups(station_id, day);
+
+COMMENT ON TABLE operation_daily_rollups IS 'Суммы по card_operations за день, поддерживаются триггерами card_operations_rollup_*. Клиент и вид топлива берутся из карты на момент записи операции';
+
+-- Агрегат поддерживается триггерами уровня оператора, а не кодом функций: операции пишут
+-- refuel, operator-dispense (в том числе пакетами) и card-operations, и любой из путей
+-- без пересчета агрегата незаметно испортил бы отчеты. Таблицы переходов (new_rows/old_rows)
+-- дают одну вставку с группировкой на весь оператор, а ORDER BY задает одинаковый порядок
+-- блокировок строк агрегата у параллельных пакетных списаний
+CREATE OR REPLACE FUNCTION card_operations_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT fc.client_id, n.station_id, fc.fuel_type_id, n.operation_date::date, n.operation_type,
+               SUM(n.quantity), SUM(COALESCE(n.amount, 0)), COUNT(*)
+        FROM new_rows n
+        JOIN fuel_cards fc ON fc.id = n.fuel_card_id
+        GROUP BY fc.client_id, n.station_id, fc.fuel_type_id, n.operation_date::date, n.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT fc.client_id, o.station_id, fc.fuel_type_id, o.operation_date::date, o.operation_type,
+               -SUM(o.quantity), -SUM(COALESCE(o.amount, 0)), -COUNT(*)
+        FROM old_rows o
+        JOIN fuel_cards fc ON fc.id = o.fuel_card_id
+        GROUP BY fc.client_id, o.station_id, fc.fuel_type_id, o.operation_date::date, o.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Заполнение по существующей истории: таблица операций блокируется от записи до конца
+-- миграции, чтобы между заполнением и созданием триггеров не потерялись операции
+LOCK TABLE card_operations IN SHARE MODE;
+
+INSERT INTO operation_daily_rollups
+    (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+SELECT fc.client_id, co.station_id, fc.fuel_type_id, co.operation_date::date, co.operation_type,
+       SUM(co.quantity), SUM(COALESCE(co.amount, 0)), COUNT(*)
+FROM card_operations co
+JOIN fuel_cards fc ON fc.id = co.fuel_card_id
+GROUP BY fc.client_id, co.station_id, fc.fuel_type_id, co.operation_date::date, co.operation_type
+ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+SET liters = EXCLUDED.liters,
+    amount = EXCLUDED.amount,
+    operations_count = EXCLUDED.operations_count;
+
+DROP TRIGGER IF EXISTS card_operations_rollup_insert ON card_operations;
+CREATE TRIGGER card_operations_rollup_insert
+    AFTER INSERT ON card_operations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
+
+DROP TRIGGER IF EXISTS card_operations_rollup_update ON card_operations;
+CREATE TRIGGER card_operations_rollup_update
+    AFTER UPDATE ON card_operations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
+
+DROP TRIGGER IF EXISTS card_operations_rollup_delete ON card_operations;
+CREATE TRIGGER card_operations_rollup_delete
+    AFTER DELETE ON card_operations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
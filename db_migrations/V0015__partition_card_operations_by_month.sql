@@ -0,0 +1,142 @@
+-- Секционирование card_operations по месяцам operation_date.
+-- Выборки истории с фильтром по дате читают только нужные секции, индексы каждой секции
+-- остаются небольшими, а старые месяцы отключаются от таблицы без DELETE (см. archive_card_operations)
+LOCK TABLE card_operations IN ACCESS EXCLUSIVE MODE;
+
+CREATE TABLE card_operations_partitioned (
+    id INTEGER NOT NULL DEFAULT nextval('card_operations_id_seq'),
+    fuel_card_id INTEGER NOT NULL REFERENCES fuel_cards(id),
+    station_name VARCHAR(255) NOT NULL,
+    operation_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    operation_type VARCHAR(50) NOT NULL CHECK (operation_type IN ('пополнение', 'заправка', 'списание', 'оприходование')),
+    quantity DECIMAL(10, 2) NOT NULL,
+    price DECIMAL(10, 2),
+    amount DECIMAL(10, 2),
+    comment VARCHAR(100),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    station_id INTEGER NOT NULL REFERENCES stations(id) ON UPDATE CASCADE,
+    PRIMARY KEY (id, operation_date)
+) PARTITION BY RANGE (operation_date);
+
+-- Секция по умолчанию принимает операции за месяцы, для которых секция еще не создана
+CREATE TABLE card_operations_default PARTITION OF card_operations_partitioned DEFAULT;
+
+INSERT INTO card_operations_partitioned
+    (id, fuel_card_id, station_name, operation_date, operation_type, quantity, price, amount, comment, created_at, station_id)
+SELECT id, fuel_card_id, station_name, operation_date, operation_type, quantity, price, amount, comment, created_at, station_id
+FROM card_operations;
+
+ALTER SEQUENCE card_operations_id_seq OWNED BY NONE;
+DROP TABLE card_operations;
+ALTER TABLE card_operations_partitioned RENAME TO card_operations;
+ALTER SEQUENCE card_operations_id_seq OWNED BY card_operations.id;
+
+COMMENT ON COLUMN card_operations.station_id IS 'Foreign key to stations table';
+COMMENT ON COLUMN card_operations.station_name IS 'Deprecated: use station_id instead';
+
+-- Индексы под рабочие запросы: лента операций и keyset-пагинация по (operation_date, id),
+-- история карты и АЗС, заправки карты за период (дневной лимит, сверка card_daily_usage).
+-- Отдельные индексы по fuel_card_id / operation_date / station_id из V0001 и V0003 перекрываются
+-- составными и не создаются заново
+CREATE INDEX IF NOT EXISTS idx_card_operations_date_id ON card_operations(operation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_card_operations_card_date_id ON card_operations(fuel_card_id, operation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_card_operations_station_date_id ON card_operations(station_id, operation_date DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_card_operations_card_refuel_date ON card_operations(fuel_card_id, operation_date)
+    WHERE operation_type = 'заправка';
+
+-- Создание секции за месяц; операции этого месяца, попавшие в секцию по умолчанию,
+-- переносятся в новую секцию (триггеры агрегата на card_operations при этом не срабатывают)
+CREATE OR REPLACE FUNCTION create_card_operations_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month_start)::date;
+    range_end DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'card_operations_p' || to_char(month_start, 'YYYYMM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE card_operations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM card_operations_default WHERE operation_date >= %L AND operation_date < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        range_start, range_end, partition_name
+    );
+    EXECUTE format(
+        'ALTER TABLE card_operations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, range_start, range_end
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции с первого месяца истории до months_ahead месяцев вперед; вызывается из миграции
+-- и периодически (SELECT ensure_card_operations_partitions(12)), чтобы новые операции
+-- не накапливались в секции по умолчанию
+CREATE OR REPLACE FUNCTION ensure_card_operations_partitions(months_ahead INTEGER DEFAULT 12) RETURNS INTEGER AS $$
+DECLARE
+    first_month DATE;
+    month_start DATE;
+    created INTEGER := 0;
+BEGIN
+    SELECT date_trunc('month', COALESCE(MIN(operation_date), CURRENT_DATE))::date
+    INTO first_month
+    FROM card_operations_default;
+
+    first_month := LEAST(first_month, date_trunc('month', CURRENT_DATE)::date);
+
+    FOR month_start IN
+        SELECT generate_series(first_month, date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead), INTERVAL '1 month')::date
+    LOOP
+        IF to_regclass('card_operations_p' || to_char(month_start, 'YYYYMM')) IS NULL THEN
+            PERFORM create_card_operations_partition(month_start);
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Архивирование: секции целиком старше cutoff отключаются от card_operations и переносятся
+-- в схему archive. DETACH не удаляет строки по одной и не вызывает триггеры агрегата, поэтому
+-- отчеты из operation_daily_rollups за архивные месяцы сохраняются; архивную секцию можно
+-- выгрузить и удалить (DROP TABLE archive.card_operations_pYYYYMM) или вернуть через ATTACH PARTITION
+CREATE SCHEMA IF NOT EXISTS archive;
+
+CREATE OR REPLACE FUNCTION archive_card_operations(cutoff DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    partition_name TEXT;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'card_operations'::regclass
+          AND c.relname ~ '^card_operations_p[0-9]{6}$'
+          AND (to_date(substr(c.relname, 18), 'YYYYMM') + INTERVAL '1 month')::date <= date_trunc('month', cutoff)::date
+        ORDER BY c.relname
+    LOOP
+        EXECUTE format('ALTER TABLE card_operations DETACH PARTITION %I', partition_name);
+        EXECUTE format('ALTER TABLE %I SET SCHEMA archive', partition_name);
+        RETURN NEXT partition_name;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_card_operations_partitions(12);
+
+-- Триггеры агрегата operation_daily_rollups (V0014) удалены вместе со старой таблицей
+CREATE TRIGGER card_operations_rollup_insert
+    AFTER INSERT ON card_operations
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
+
+CREATE TRIGGER card_operations_rollup_update
+    AFTER UPDATE ON card_operations
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
+
+CREATE TRIGGER card_operations_rollup_delete
+    AFTER DELETE ON card_operations
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION card_operations_rollup();
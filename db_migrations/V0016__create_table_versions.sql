@@ -0,0 +1,50 @@
+-- Счетчики изменений справочников и списков для условных GET (ETag / Last-Modified):
+-- функция читает версию одной маленькой выборкой и отвечает 304, не выполняя сам запрос списка.
+-- Счетчик разбит на 16 строк по pg_backend_pid(): fuel_cards меняется при каждой заправке,
+-- и единственная строка версии стала бы общей блокировкой для всех параллельных списаний.
+-- Версия таблицы — сумма строк; незафиксированные увеличения не видны читателю, поэтому
+-- версия меняется только вместе с видимыми данными
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(63) NOT NULL,
+    shard SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (table_name, shard)
+);
+
+COMMENT ON TABLE table_versions IS 'Версии таблиц для ETag списков: SUM(version) и MAX(updated_at) по table_name, поддерживаются триггерами *_version';
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO table_versions AS v (table_name, shard, version, updated_at)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1, clock_timestamp())
+    ON CONFLICT (table_name, shard) DO UPDATE
+    SET version = v.version + 1,
+        updated_at = EXCLUDED.updated_at;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stations_version ON stations;
+CREATE TRIGGER stations_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON stations
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS fuel_types_version ON fuel_types;
+CREATE TRIGGER fuel_types_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fuel_types
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS clients_version ON clients;
+CREATE TRIGGER clients_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON clients
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+DROP TRIGGER IF EXISTS fuel_cards_version ON fuel_cards;
+CREATE TRIGGER fuel_cards_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fuel_cards
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions (table_name, shard, version)
+VALUES ('stations', 0, 1), ('fuel_types', 0, 1), ('clients', 0, 1), ('fuel_cards', 0, 1)
+ON CONFLICT (table_name, shard) DO NOTHING;
@@ -0,0 +1,11 @@
+-- Журнал операций панели оператора (operator-dispense, DISPENSE_JOURNAL_DIR): строки card_operations
+-- сначала пишутся в локальный файл-сегмент, разборщик переносит их в БД пакетами.
+-- Смещение разобранной части сегмента фиксируется в той же транзакции, что и вставка операций,
+-- поэтому после перезапуска журнал дочитывается с этого места и ни одна строка не вставляется дважды
+CREATE TABLE IF NOT EXISTS dispense_journal_segments (
+    segment VARCHAR(200) PRIMARY KEY,
+    applied_offset BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+COMMENT ON TABLE dispense_journal_segments IS 'Сколько байт каждого сегмента журнала операций уже перенесено в card_operations';
@@ -0,0 +1,79 @@
+-- Клиент и вид топлива карты сохраняются в самой операции на момент записи.
+-- Агрегат operation_daily_rollups (V0014) брал их из текущей строки fuel_cards и для новых,
+-- и для старых строк: правка или удаление старой операции после смены клиента или вида топлива
+-- карты вычитала ее из строки агрегата нового владельца (вплоть до отрицательных сумм),
+-- а у прежнего сумма оставалась завышенной. Теперь вычитание идет по old_rows.client_id / fuel_type_id
+-- Отключенные архивные секции (archive.card_operations_pYYYYMM) столбцов не получают:
+-- перед ATTACH PARTITION их нужно добавить так же
+ALTER TABLE card_operations ADD COLUMN IF NOT EXISTS client_id INTEGER;
+ALTER TABLE card_operations ADD COLUMN IF NOT EXISTS fuel_type_id INTEGER;
+
+COMMENT ON COLUMN card_operations.client_id IS 'Клиент карты на момент операции (заполняется триггером card_operations_card_attributes)';
+COMMENT ON COLUMN card_operations.fuel_type_id IS 'Вид топлива карты на момент операции (заполняется триггером card_operations_card_attributes)';
+
+-- Заполнение триггером, а не кодом функций: операции вставляют refuel, operator-dispense
+-- (и разборщик его журнала), card-operations и пакетные загрузки. При смене карты у операции
+-- значения берутся из новой карты
+CREATE OR REPLACE FUNCTION card_operations_card_attributes() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.fuel_card_id IS DISTINCT FROM OLD.fuel_card_id THEN
+        SELECT client_id, fuel_type_id
+        INTO NEW.client_id, NEW.fuel_type_id
+        FROM fuel_cards
+        WHERE id = NEW.fuel_card_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Пока пишется история, операции не должны поменяться: иначе агрегат разойдется с заполнением
+LOCK TABLE card_operations IN SHARE ROW EXCLUSIVE MODE;
+
+-- Для существующих операций владелец на момент записи неизвестен — берется текущий, тот же,
+-- по которому они уже учтены в агрегате. Пока функция агрегата не заменена, UPDATE вычитает
+-- и прибавляет одни и те же суммы, агрегат не меняется
+UPDATE card_operations co
+SET client_id = fc.client_id,
+    fuel_type_id = fc.fuel_type_id
+FROM fuel_cards fc
+WHERE fc.id = co.fuel_card_id
+  AND co.client_id IS NULL;
+
+DROP TRIGGER IF EXISTS card_operations_card_attributes ON card_operations;
+CREATE TRIGGER card_operations_card_attributes
+    BEFORE INSERT OR UPDATE OF fuel_card_id ON card_operations
+    FOR EACH ROW EXECUTE FUNCTION card_operations_card_attributes();
+
+CREATE OR REPLACE FUNCTION card_operations_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT n.client_id, n.station_id, n.fuel_type_id, n.operation_date::date, n.operation_type,
+               SUM(n.quantity), SUM(COALESCE(n.amount, 0)), COUNT(*)
+        FROM new_rows n
+        GROUP BY n.client_id, n.station_id, n.fuel_type_id, n.operation_date::date, n.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT o.client_id, o.station_id, o.fuel_type_id, o.operation_date::date, o.operation_type,
+               -SUM(o.quantity), -SUM(COALESCE(o.amount, 0)), -COUNT(*)
+        FROM old_rows o
+        GROUP BY o.client_id, o.station_id, o.fuel_type_id, o.operation_date::date, o.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
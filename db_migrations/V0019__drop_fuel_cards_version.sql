@@ -0,0 +1,8 @@
+-- Версия fuel_cards для ETag (V0016) не ведется: триггер уровня оператора срабатывал на каждом
+-- списании (UPDATE fuel_cards SET balance_liters) — лишняя запись строки table_versions на самом
+-- горячем пути, а ETag списка карт менялся с каждой заправкой, и 304 почти не возникал.
+-- Список карт показывает баланс, поэтому и без баланса версия была бы неверной:
+-- fuel-cards считает ETag по содержимому страницы
+DROP TRIGGER IF EXISTS fuel_cards_version ON fuel_cards;
+
+DELETE FROM table_versions WHERE table_name = 'fuel_cards';
@@ -0,0 +1,86 @@
+-- Перенос операций из секции по умолчанию в новую месячную секцию не должен срабатывать как
+-- новая операция: триггер card_operations_card_attributes (V0018) переписал бы client_id / fuel_type_id
+-- исторической строки текущими значениями карты, а триггеры агрегата (V0014) вычли бы и прибавили
+-- ее суммы заново — уже по другому клиенту и виду топлива.
+-- На время переноса create_card_operations_partition выставляет в транзакции флаг
+-- azs.card_operations_move, и оба триггера его пропускают; строки переносятся как есть
+CREATE OR REPLACE FUNCTION card_operations_card_attributes() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('azs.card_operations_move', true) = 'on' THEN
+        RETURN NEW;
+    END IF;
+    IF TG_OP = 'INSERT' OR NEW.fuel_card_id IS DISTINCT FROM OLD.fuel_card_id THEN
+        SELECT client_id, fuel_type_id
+        INTO NEW.client_id, NEW.fuel_type_id
+        FROM fuel_cards
+        WHERE id = NEW.fuel_card_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION card_operations_rollup() RETURNS trigger AS $$
+BEGIN
+    IF current_setting('azs.card_operations_move', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT n.client_id, n.station_id, n.fuel_type_id, n.operation_date::date, n.operation_type,
+               SUM(n.quantity), SUM(COALESCE(n.amount, 0)), COUNT(*)
+        FROM new_rows n
+        GROUP BY n.client_id, n.station_id, n.fuel_type_id, n.operation_date::date, n.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO operation_daily_rollups AS r
+            (client_id, station_id, fuel_type_id, day, operation_type, liters, amount, operations_count)
+        SELECT o.client_id, o.station_id, o.fuel_type_id, o.operation_date::date, o.operation_type,
+               -SUM(o.quantity), -SUM(COALESCE(o.amount, 0)), -COUNT(*)
+        FROM old_rows o
+        GROUP BY o.client_id, o.station_id, o.fuel_type_id, o.operation_date::date, o.operation_type
+        ORDER BY 1, 2, 3, 4, 5
+        ON CONFLICT (client_id, station_id, fuel_type_id, day, operation_type) DO UPDATE
+        SET liters = r.liters + EXCLUDED.liters,
+            amount = r.amount + EXCLUDED.amount,
+            operations_count = r.operations_count + EXCLUDED.operations_count;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_card_operations_partition(month_start DATE) RETURNS TEXT AS $$
+DECLARE
+    range_start DATE := date_trunc('month', month_start)::date;
+    range_end DATE := (date_trunc('month', month_start) + INTERVAL '1 month')::date;
+    partition_name TEXT := 'card_operations_p' || to_char(month_start, 'YYYYMM');
+BEGIN
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+
+    EXECUTE format('CREATE TABLE %I (LIKE card_operations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition_name);
+    -- Новая таблица создана по образцу card_operations: столбцы, включая client_id и fuel_type_id,
+    -- совпадают по порядку и копируются без изменений
+    PERFORM set_config('azs.card_operations_move', 'on', true);
+    EXECUTE format(
+        'WITH moved AS (DELETE FROM card_operations_default WHERE operation_date >= %L AND operation_date < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        range_start, range_end, partition_name
+    );
+    PERFORM set_config('azs.card_operations_move', 'off', true);
+    EXECUTE format(
+        'ALTER TABLE card_operations ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        partition_name, range_start, range_end
+    );
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, Optional, Tuple
+
+from gateway.app import Gateway, build_event
+
+# Режим --async: соединения обслуживает один цикл событий. Функции с async_handler (asyncpg)
+# выполняются прямо в нем, и пока они ждут БД, процесс принимает следующие запросы;
+# остальные вызываются в пуле потоков, как в обычном режиме
+KEEPALIVE_TIMEOUT = 15
+HEADER_LIMIT = 64 * 1024
+
+
+class BadRequest(Exception):
+    pass
+
+
+def status_line(status: int) -> bytes:
+    try:
+        reason = HTTPStatus(status).phrase
+    except ValueError:
+        reason = ''
+    return f'HTTP/1.1 {status} {reason}\r\n'.encode('latin-1')
+
+
+def encode_response(status: int, headers: Dict[str, str], data: bytes, keep_alive: bool, head: bool) -> bytes:
+    lines = [status_line(status), b'Server: azs-gateway\r\n']
+    for name, value in headers.items():
+        if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+            lines.append(f'{name}: {value}\r\n'.encode('latin-1', errors='replace'))
+    lines.append(f'Content-Length: {len(data)}\r\n'.encode('latin-1'))
+    if not keep_alive:
+        lines.append(b'Connection: close\r\n')
+    lines.append(b'\r\n')
+    if not head:
+        lines.append(data)
+    return b''.join(lines)
+
+
+async def read_head(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str]]]:
+    while True:
+        line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+        if not line:
+            return None
+        if line not in (b'\r\n', b'\n'):
+            break
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+        raise BadRequest('Некорректная строка запроса')
+    headers: Dict[str, str] = {}
+    size = len(line)
+    while True:
+        line = await reader.readline()
+        size += len(line)
+        if size > HEADER_LIMIT:
+            raise BadRequest('Слишком большие заголовки')
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip()] = value.strip()
+    return parts[0], parts[1], parts[2], headers
+
+
+def header(headers: Dict[str, str], name: str) -> str:
+    return next((value for key, value in headers.items() if key.lower() == name), '')
+
+
+async def read_body(reader: asyncio.StreamReader, headers: Dict[str, str], max_body: int) -> Optional[bytes]:
+    '''
+    Тело по Content-Length или chunked; None — тело больше max_body
+    '''
+    if 'chunked' in header(headers, 'transfer-encoding').lower():
+        chunks = []
+        size = 0
+        while True:
+            chunk_size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+            if chunk_size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            size += chunk_size
+            if size > max_body:
+                return None
+            chunks.append(await reader.readexactly(chunk_size))
+            await reader.readline()
+    length = int(header(headers, 'content-length') or 0)
+    if length > max_body:
+        return None
+    return await reader.readexactly(length) if length else b''
+
+
+class AsyncGatewayServer:
+    def __init__(self, gateway: Gateway, threads: int, max_body: int, access_log: bool = False):
+        self.gateway = gateway
+        self.max_body = max_body
+        self.access_log = access_log
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='gateway')
+
+    async def dispatch(self, method: str, target: str, headers: Dict[str, str], body: bytes, peer: str) -> Tuple[int, Dict[str, str], bytes]:
+        path = target.split('?', 1)[0]
+        if path.rstrip('/') == '/healthz':
+            functions = {'functions': sorted(self.gateway.handlers), 'async': sorted(self.gateway.async_handlers)}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(functions).encode()
+        name = self.gateway.resolve(path)
+        if name is None:
+            return 404, {'Content-Type': 'application/json'}, b'{"error":"Function not found"}'
+        event = build_event(method, target, headers, body, peer)
+        if name in self.gateway.async_handlers:
+            return await self.gateway.invoke_async(name, event)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.gateway.invoke, name, event)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = (writer.get_extra_info('peername') or ('',))[0]
+        try:
+            while True:
+                try:
+                    head = await read_head(reader)
+                except BadRequest:
+                    writer.write(encode_response(400, {'Content-Type': 'application/json'}, b'{"error":"Bad request"}', False, False))
+                    break
+                if head is None:
+                    break
+                method, target, version, headers = head
+                connection = header(headers, 'connection').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                if header(headers, 'expect').lower() == '100-continue':
+                    writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+                body = await read_body(reader, headers, self.max_body)
+                if body is None:
+                    writer.write(encode_response(413, {'Content-Type': 'application/json'}, b'{"error":"Request body too large"}', False, False))
+                    break
+                status, response_headers, data = await self.dispatch(method, target, headers, body, peer)
+                writer.write(encode_response(status, response_headers, data, keep_alive, method == 'HEAD'))
+                await writer.drain()
+                if self.access_log:
+                    print(f'{peer} "{method} {target} {version}" {status} {len(data)}', flush=True)
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, sock: socket.socket) -> None:
+        server = await asyncio.start_server(self.handle, sock=sock, limit=HEADER_LIMIT)
+        async with server:
+            await server.serve_forever()
+
+
+def serve(gateway: Gateway, sock: socket.socket, threads: int, max_body: int, access_log: bool = False) -> None:
+    '''
+    Запуск цикла событий в текущем процессе; пул потоков создается здесь же, после fork
+    '''
+    server = AsyncGatewayServer(gateway, threads, max_body, access_log)
+    gateway.start()
+    try:
+        asyncio.run(server.serve(sock))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.executor.shutdown(wait=False)
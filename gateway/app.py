@@ -0,0 +1,182 @@
+import base64
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import traceback
+import uuid
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+
+# Модули-копии, которые лежат в каталоге каждой функции (db.py, api.py, refcache.py, ...)
+# и импортируются функцией как верхнеуровневые; список общий со стендом нагрузки (bench.loader).
+# В облаке у каждой функции своя копия; шлюз загружает
+# каждую один раз, и все функции процесса делят один пул соединений (db) и один кэш справочников
+# (refcache): правка АЗС в stations сразу сбрасывает кэш, которым пользуется refuel
+SHARED_MODULE_NAMES = ('db', 'adb', 'api', 'session', 'passwords', 'refcache', 'dispense')
+
+Handler = Callable[[Dict[str, Any], Any], Dict[str, Any]]
+AsyncHandler = Callable[[Dict[str, Any], Any], Awaitable[Dict[str, Any]]]
+
+
+class Context:
+    '''
+    Аналог context облачной функции: db.instrumented и логи берут из него function_name
+    '''
+    __slots__ = ('request_id', 'function_name', 'function_version')
+
+    def __init__(self, function_name: str):
+        self.request_id = uuid.uuid4().hex
+        self.function_name = function_name
+        self.function_version = '$local'
+
+
+def list_functions() -> List[str]:
+    return sorted(
+        name for name in os.listdir(BACKEND_DIR)
+        if os.path.isfile(os.path.join(BACKEND_DIR, name, 'index.py'))
+    )
+
+
+def check_shared_copies(names: List[str]) -> None:
+    '''
+    Общие модули берутся из первого каталога, где они встретились, поэтому копии
+    во всех функциях обязаны совпадать: иначе часть функций работала бы с чужим кодом
+    '''
+    mismatched = []
+    for module_name in SHARED_MODULE_NAMES:
+        digests: Dict[str, List[str]] = {}
+        for name in names:
+            path = os.path.join(BACKEND_DIR, name, f'{module_name}.py')
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    digests.setdefault(hashlib.sha256(f.read()).hexdigest(), []).append(name)
+        if len(digests) > 1:
+            mismatched.append(f"{module_name}.py: {' / '.join(', '.join(group) for group in digests.values())}")
+    if mismatched:
+        raise RuntimeError('Копии общих модулей различаются: ' + '; '.join(mismatched))
+
+
+def load_functions(names: Optional[List[str]] = None) -> Dict[str, ModuleType]:
+    '''
+    Загружает модуль каждой функции backend/<name>/index.py в текущий процесс
+    с общими экземплярами SHARED_MODULE_NAMES
+    '''
+    names = names or list_functions()
+    check_shared_copies(names)
+    modules = {}
+    for name in names:
+        function_dir = os.path.join(BACKEND_DIR, name)
+        index_path = os.path.join(function_dir, 'index.py')
+        if not os.path.isfile(index_path):
+            raise ValueError(f'Функция {name} не найдена в {BACKEND_DIR}')
+        sys.path.insert(0, function_dir)
+        try:
+            spec = importlib.util.spec_from_file_location(f"gateway_{name.replace('-', '_')}", index_path)
+            module: ModuleType = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(function_dir)
+        modules[name] = module
+    return modules
+
+
+def load_aliases() -> Dict[str, str]:
+    '''
+    Пути из func2url.json («/<uuid>» → функция): клиенту достаточно заменить хост в URL
+    '''
+    path = os.path.join(BACKEND_DIR, 'func2url.json')
+    if not os.path.isfile(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        urls = json.load(f)
+    return {urlsplit(url).path.strip('/'): name for name, url in urls.items() if urlsplit(url).path.strip('/')}
+
+
+def build_event(method: str, target: str, headers: Dict[str, str], body: bytes, source_ip: str) -> Dict[str, Any]:
+    '''
+    HTTP-запрос → event в формате, который платформа передает в handler
+    '''
+    url = urlsplit(target)
+    multi_query = parse_qs(url.query, keep_blank_values=True)
+    try:
+        text, is_base64 = body.decode('utf-8'), False
+    except UnicodeDecodeError:
+        text, is_base64 = base64.b64encode(body).decode('ascii'), True
+    return {
+        'httpMethod': method,
+        'headers': headers,
+        'url': target,
+        'path': url.path,
+        'queryStringParameters': {key: values[-1] for key, values in multi_query.items()},
+        'multiValueQueryStringParameters': multi_query,
+        'body': text,
+        'isBase64Encoded': is_base64,
+        'requestContext': {
+            'httpMethod': method,
+            'requestId': uuid.uuid4().hex,
+            'requestTimeEpoch': int(time.time() * 1000),
+            'identity': {'sourceIp': source_ip, 'userAgent': headers.get('User-Agent', '')}
+        }
+    }
+
+
+def response_parts(response: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+    '''
+    Ответ handler → статус, заголовки и тело в байтах (isBase64Encoded декодируется)
+    '''
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        data = base64.b64decode(body)
+    else:
+        data = body.encode('utf-8') if isinstance(body, str) else bytes(body)
+    headers = {str(name): str(value) for name, value in (response.get('headers') or {}).items()}
+    return int(response.get('statusCode', 200)), headers, data
+
+
+class Gateway:
+    '''
+    Маршрутизация /<функция>/... и /<uuid из func2url.json>/... на handler функций
+    '''
+
+    def __init__(self, modules: Dict[str, ModuleType], aliases: Optional[Dict[str, str]] = None):
+        self.handlers: Dict[str, Handler] = {name: module.handler for name, module in modules.items()}
+        # async_handler есть у функций с asyncpg (adb); в режиме --async они выполняются в цикле событий
+        self.async_handlers: Dict[str, AsyncHandler] = {
+            name: module.async_handler for name, module in modules.items() if hasattr(module, 'async_handler')
+        }
+        # start() функций (фоновые потоки) вызывается в обслуживающем процессе, после fork
+        self.starters: List[Callable[[], None]] = [module.start for module in modules.values() if hasattr(module, 'start')]
+        self.routes: Dict[str, str] = {name: name for name in self.handlers}
+        for alias, name in (aliases or {}).items():
+            if name in self.handlers:
+                self.routes[alias] = name
+
+    def start(self) -> None:
+        for start in self.starters:
+            start()
+
+    def resolve(self, path: str) -> Optional[str]:
+        return self.routes.get(path.strip('/').split('/', 1)[0])
+
+    def invoke(self, name: str, event: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+        try:
+            return response_parts(self.handlers[name](event, Context(name)))
+        except Exception:
+            return function_error()
+
+    async def invoke_async(self, name: str, event: Dict[str, Any]) -> Tuple[int, Dict[str, str], bytes]:
+        try:
+            return response_parts(await self.async_handlers[name](event, Context(name)))
+        except Exception:
+            return function_error()
+
+
+def function_error() -> Tuple[int, Dict[str, str], bytes]:
+    print(traceback.format_exc(), file=sys.stderr)
+    return 502, {'Content-Type': 'application/json'}, b'{"error":"Function error"}'
@@ -0,0 +1,216 @@
+import argparse
+import functools
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from gateway import aio
+from gateway.app import Gateway, build_event, list_functions, load_aliases, load_functions
+
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class GatewayRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Один HTTP-запрос → один вызов handler функции; соединения keep-alive (HTTP/1.1)
+    '''
+    protocol_version = 'HTTP/1.1'
+    server_version = 'azs-gateway'
+    # Простаивающее keep-alive соединение занимает поток пула: закрываем его через timeout секунд
+    timeout = 15
+    # Заголовки и тело уходят одной записью (буфер сбрасывается после запроса), без задержки Nagle:
+    # иначе отдельная запись тела ждет delayed ACK клиента (~40 мс на запрос)
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_request(self) -> None:
+        gateway: Gateway = self.server.gateway
+        if self.path.split('?', 1)[0].rstrip('/') == '/healthz':
+            self.send(200, {'Content-Type': 'application/json'}, json.dumps({'functions': sorted(gateway.handlers)}).encode())
+            return
+        name = gateway.resolve(self.path.split('?', 1)[0])
+        if name is None:
+            self.send(404, {'Content-Type': 'application/json'}, b'{"error":"Function not found"}')
+            return
+        body = self.read_body()
+        if body is None:
+            return
+        headers = {key: value for key, value in self.headers.items()}
+        event = build_event(self.command, self.path, headers, body, self.client_address[0])
+        status, response_headers, data = gateway.invoke(name, event)
+        self.send(status, response_headers, data)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_OPTIONS = do_HEAD = do_request
+
+    def read_body(self) -> Optional[bytes]:
+        if 'chunked' in (self.headers.get('Transfer-Encoding') or '').lower():
+            chunks: List[bytes] = []
+            size = 0
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';', 1)[0].strip() or b'0', 16)
+                if chunk_size == 0:
+                    while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                size += chunk_size
+                if size > self.server.max_body:
+                    self.close_connection = True
+                    self.send(413, {'Content-Type': 'application/json'}, b'{"error":"Request body too large"}')
+                    return None
+                chunks.append(self.rfile.read(chunk_size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.server.max_body:
+            self.close_connection = True
+            self.send(413, {'Content-Type': 'application/json'}, b'{"error":"Request body too large"}')
+            return None
+        return self.rfile.read(length) if length else b''
+
+    def send(self, status: int, headers: Dict[str, str], data: bytes) -> None:
+        self.send_response(status)
+        for name, value in headers.items():
+            if name.lower() not in ('content-length', 'connection', 'transfer-encoding'):
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.access_log:
+            super().log_message(format, *args)
+
+
+class GatewayServer(HTTPServer):
+    '''
+    HTTP-сервер с пулом потоков фиксированного размера: соединения обслуживаются потоками пула,
+    число одновременных вызовов (и соединений с БД) не превышает threads
+    '''
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address: Any, gateway: Gateway, max_body: int = MAX_BODY_BYTES, access_log: bool = False):
+        super().__init__(address, GatewayRequestHandler)
+        self.gateway = gateway
+        self.max_body = max_body
+        self.access_log = access_log
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def serve(self, threads: int) -> None:
+        # Пул создается в том процессе, который обслуживает запросы: потоки не переживают fork
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='gateway')
+        self.gateway.start()
+        try:
+            self.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def process_request(self, request: Any, client_address: Any) -> None:
+        self.executor.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request: Any, client_address: Any) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def run_workers(serve: Callable[[], None], workers: int) -> None:
+    '''
+    Предварительный fork: дочерние процессы принимают соединения с общего сокета,
+    у каждого свой пул соединений и кэш справочников. Упавший процесс перезапускается
+    '''
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve()
+            finally:
+                os._exit(0)
+        children[pid] = slot
+
+    def stop(signum: int, frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(workers):
+        spawn(slot)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            print(f'Процесс {pid} завершился (статус {status}), перезапуск', file=sys.stderr)
+            time.sleep(1)
+            spawn(slot)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='HTTP-шлюз: все функции backend/ в одном долгоживущем процессе')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help='число процессов (fork после загрузки функций)')
+    parser.add_argument('--threads', type=int, default=16, help='потоков на процесс; по умолчанию и размер пула соединений')
+    parser.add_argument('--functions', help='загрузить только эти функции, через запятую')
+    parser.add_argument('--max-body', type=int, default=MAX_BODY_BYTES, help='максимальный размер тела запроса, байт')
+    parser.add_argument('--access-log', action='store_true', help='писать строку лога на каждый запрос')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='цикл событий asyncio: функции с async_handler (asyncpg) не занимают потоков')
+    args = parser.parse_args()
+    if not os.environ.get('DATABASE_URL'):
+        parser.error('не задан DATABASE_URL')
+
+    # Размер пула читается при импорте db.py: окружение задается до загрузки функций
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.threads))
+    names = args.functions.split(',') if args.functions else list_functions()
+    gateway = Gateway(load_functions(names), load_aliases())
+    mode = f"async ({', '.join(sorted(gateway.async_handlers))})" if args.use_async else 'threads'
+    print(f"Шлюз на {args.host}:{args.port}: {', '.join(sorted(gateway.handlers))}; "
+          f"процессов {args.workers}, потоков {args.threads}, режим {mode}", file=sys.stderr)
+
+    if args.use_async:
+        sock = socket.create_server((args.host, args.port), backlog=GatewayServer.request_queue_size)
+        serve: Callable[[], None] = functools.partial(aio.serve, gateway, sock, args.threads, args.max_body, args.access_log)
+    else:
+        server = GatewayServer((args.host, args.port), gateway, args.max_body, args.access_log)
+        sock = server.socket
+        serve = functools.partial(server.serve, args.threads)
+
+    if args.workers > 1:
+        run_workers(serve, args.workers)
+    else:
+        try:
+            serve()
+        except KeyboardInterrupt:
+            pass
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,6 +14,10 @@ import TablePagination from '@/components/ui/table-pagination';
 import { adminApi } from '@/utils/adminApi';
 import { formatDateForInput } from '@/utils/dateUtils';
 
+const CARDS_PAGE_SIZE = 500;
+const OPERATIONS_PAGE_SIZE = 500;
+const OPERATION_TYPES = ['пополнение', 'заправка', 'списание', 'оприходование'];
+
 interface AdminDashboardProps {
   onLogout: () => void;
 }
@@ -24,7 +28,9 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
   const [stations, setStations] = useState<any[]>([]);
   const [fuelTypes, setFuelTypes] = useState<any[]>([]);
   const [cards, setCards] = useState<any[]>([]);
+  const [cardsNextAfterId, setCardsNextAfterId] = useState<number | null>(null);
   const [operations, setOperations] = useState<any[]>([]);
+  const [operationsNextCursor, setOperationsNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
   const [recalculateDialogOpen, setRecalculateDialogOpen] = useState(false);
   const [recalculateCardId, setRecalculateCardId] = useState<number | null>(null);
@@ -50,8 +56,7 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
       loadClients(),
       loadStations(),
       loadFuelTypes(),
-      loadCards(),
-      loadOperations()
+      loadCards()
     ]);
     setLoading(false);
   };
@@ -83,19 +88,69 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
     }
   };
 
-  const loadCards = async () => {
+  // Фильтры по клиенту и виду топлива применяются на сервере: карты грузятся страницами по CARDS_PAGE_SIZE
+  const cardsFilterParams = (clientName: string, fuelTypeName: string) => {
+    const params: Record<string, string | number> = { limit: CARDS_PAGE_SIZE };
+    const client = clients.find(c => c.name === clientName);
+    const fuelType = fuelTypes.find(ft => ft.name === fuelTypeName);
+    if (clientName !== 'all' && client) params.client_id = client.id;
+    if (fuelTypeName !== 'all' && fuelType) params.fuel_type_id = fuelType.id;
+    return params;
+  };
+
+  const loadCards = async (clientName: string = filterCardClient, fuelTypeName: string = filterCardFuelType) => {
+    try {
+      const page = await adminApi.cards.getPage(cardsFilterParams(clientName, fuelTypeName));
+      setCards(page.cards);
+      setCardsNextAfterId(page.nextAfterId);
+    } catch (error) {
+      console.error('Error loading cards:', error);
+    }
+  };
+
+  const loadMoreCards = async () => {
+    if (cardsNextAfterId === null) return;
     try {
-      const data = await adminApi.cards.getAll();
-      setCards(data);
+      const page = await adminApi.cards.getPage({
+        ...cardsFilterParams(filterCardClient, filterCardFuelType),
+        after_id: cardsNextAfterId
+      });
+      setCards(prev => [...prev, ...page.cards]);
+      setCardsNextAfterId(page.nextAfterId);
     } catch (error) {
       console.error('Error loading cards:', error);
     }
   };
 
+  // Журнал операций не загружается целиком: фильтры применяются на сервере,
+  // следующая страница — по кнопке «Загрузить еще»
+  const operationsFilterParams = () => {
+    const params: Record<string, string | number> = { limit: OPERATIONS_PAGE_SIZE };
+    const station = stations.find(s => s.name === filterStation);
+    if (filterCard !== 'all') params.card_code = filterCard;
+    if (filterStation !== 'all' && station) params.station_id = station.id;
+    if (filterOperationType !== 'all') params.operation_type = filterOperationType;
+    if (filterDateFrom) params.date_from = filterDateFrom;
+    if (filterDateTo) params.date_to = filterDateTo;
+    return params;
+  };
+
   const loadOperations = async () => {
     try {
-      const data = await adminApi.operations.getAll();
-      setOperations(data);
+      const page = await adminApi.operations.getPage(operationsFilterParams());
+      setOperations(page.operations);
+      setOperationsNextCursor(page.nextCursor);
+    } catch (error) {
+      console.error('Error loading operations:', error);
+    }
+  };
+
+  const loadMoreOperations = async () => {
+    if (operationsNextCursor === null) return;
+    try {
+      const page = await adminApi.operations.getPage({ ...operationsFilterParams(), cursor: operationsNextCursor });
+      setOperations(prev => [...prev, ...page.operations]);
+      setOperationsNextCursor(page.nextCursor);
     } catch (error) {
       console.error('Error loading operations:', error);
     }
@@ -295,8 +350,7 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
     const card = cards.find(c => c.id === recalculateCardId);
     if (!card) return;
 
-    const cardOperations = operations
-      .filter(op => op.card_code === card.card_code)
+    const cardOperations = (await adminApi.operations.getCardHistory(card.id))
       .sort((a, b) => new Date(a.operation_date).getTime() - new Date(b.operation_date).getTime());
 
     let calculatedBalance = 0;
@@ -531,8 +585,8 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
     .sort((a, b) => a.card_code.localeCompare(b.card_code));
 
   const nonAdminClientNames = clients.filter(c => !c.admin).map(c => c.name);
-  const uniqueClientNames = Array.from(new Set(cards.map(c => c.client_name).filter(name => nonAdminClientNames.includes(name))));
-  const uniqueCardFuelTypes = Array.from(new Set(cards.map(c => c.fuel_type)));
+  const uniqueClientNames = Array.from(new Set(nonAdminClientNames));
+  const uniqueCardFuelTypes = Array.from(new Set(fuelTypes.map(ft => ft.name)));
 
   const cardsTotalPages = Math.ceil(filteredCards.length / cardsPageSize) || 1;
   const safeCardsPage = Math.min(cardsPage, cardsTotalPages);
@@ -549,6 +603,11 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
   const [filterOperationType, setFilterOperationType] = useState<string>('all');
   const [filterDateFrom, setFilterDateFrom] = useState<string>('');
   const [filterDateTo, setFilterDateTo] = useState<string>('');
+
+  useEffect(() => {
+    setOpsPage(1);
+    loadOperations();
+  }, [filterCard, filterStation, filterOperationType, filterDateFrom, filterDateTo]);
   const [balanceChangeDialog, setBalanceChangeDialog] = useState<{open: boolean, cardCode: string, oldBalance: number, newBalance: number}>({open: false, cardCode: '', oldBalance: 0, newBalance: 0});
 
 
@@ -622,9 +681,9 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
   const safeOpsPage = Math.min(opsPage, opsTotalPages);
   const pagedOperations = filteredOperations.slice((safeOpsPage - 1) * opsPageSize, safeOpsPage * opsPageSize);
 
-  const uniqueCardCodes = Array.from(new Set(operations.map(o => o.card_code)));
-  const uniqueStationNames = Array.from(new Set(operations.map(o => o.station_name)));
-  const uniqueOperationTypes = Array.from(new Set(operations.map(o => o.operation_type)));
+  const uniqueCardCodes = Array.from(new Set(cards.map(c => c.card_code))).sort();
+  const uniqueStationNames = Array.from(new Set(stations.map(s => s.name)));
+  const uniqueOperationTypes = Array.from(new Set([...OPERATION_TYPES, ...operations.map(o => o.operation_type)]));
 
   const handlePrintClients = () => {
     window.print();
@@ -1003,7 +1062,7 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
                 <div className="grid grid-cols-2 gap-4 mb-4">
                   <div>
                     <Label className="text-foreground">Клиент</Label>
-                    <Select value={filterCardClient} onValueChange={setFilterCardClient}>
+                    <Select value={filterCardClient} onValueChange={(value) => { setFilterCardClient(value); setCardsPage(1); loadCards(value, filterCardFuelType); }}>
                       <SelectTrigger>
                         <SelectValue placeholder="Все клиенты" />
                       </SelectTrigger>
@@ -1017,7 +1076,7 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
                   </div>
                   <div>
                     <Label className="text-foreground">Вид топлива</Label>
-                    <Select value={filterCardFuelType} onValueChange={setFilterCardFuelType}>
+                    <Select value={filterCardFuelType} onValueChange={(value) => { setFilterCardFuelType(value); setCardsPage(1); loadCards(filterCardClient, value); }}>
                       <SelectTrigger>
                         <SelectValue placeholder="Все виды топлива" />
                       </SelectTrigger>
@@ -1111,6 +1170,14 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
                 onPageChange={setCardsPage}
                 onPageSizeChange={(s) => { setCardsPageSize(s); setCardsPage(1); }}
               />
+              {cardsNextAfterId !== null && (
+                <div className="flex justify-center pb-4">
+                  <Button onClick={loadMoreCards} variant="outline" size="sm" className="border-2 border-accent text-foreground hover:bg-accent hover:text-accent-foreground">
+                    <Icon name="ChevronsDown" className="w-4 h-4 mr-2" />
+                    Загрузить еще
+                  </Button>
+                </div>
+              )}
             </Card>
           </TabsContent>
 
@@ -1337,6 +1404,14 @@ export default function AdminDashboard({ onLogout }: AdminDashboardProps) {
                 onPageChange={setOpsPage}
                 onPageSizeChange={(s) => { setOpsPageSize(s); setOpsPage(1); }}
               />
+              {operationsNextCursor !== null && (
+                <div className="flex justify-center pb-4">
+                  <Button onClick={loadMoreOperations} variant="outline" size="sm" className="border-2 border-accent text-foreground hover:bg-accent hover:text-accent-foreground">
+                    <Icon name="ChevronsDown" className="w-4 h-4 mr-2" />
+                    Загрузить еще
+                  </Button>
+                </div>
+              )}
             </Card>
           </TabsContent>
 
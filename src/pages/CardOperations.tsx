@@ -59,8 +59,8 @@ export default function CardOperations() {
     const loadData = async () => {
       try {
         const [operationsData, cardsData, fuelTypesData, clientsData, stationsData] = await Promise.all([
-          adminApi.operations.getAll(),
-          adminApi.cards.getAll(),
+          adminApi.operations.getCardHistory(cardId),
+          adminApi.cards.getPage({ id: cardId }).then(page => page.cards),
           adminApi.fuelTypes.getAll(),
           adminApi.clients.getAll(),
           adminApi.stations.getAll()
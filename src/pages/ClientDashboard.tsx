@@ -12,7 +12,6 @@ import { Textarea } from '@/components/ui/textarea';
 import Icon from '@/components/ui/icon';
 import { useOperations } from '@/contexts/OperationsContext';
 import { adminApi } from '@/utils/adminApi';
-import { formatDateForAPI } from '@/utils/dateUtils';
 
 interface ClientData {
   name: string;
@@ -56,10 +55,9 @@ export default function ClientDashboard({ clientLogin, onLogout }: ClientDashboa
 
   const loadData = async () => {
     try {
-      const [clientsData, cardsData, fuelTypesData] = await Promise.all([
-        adminApi.clients.getAll(),
-        adminApi.cards.getAll(),
-        adminApi.fuelTypes.getAll()
+      const [clientsData, cardsData] = await Promise.all([
+        adminApi.clients.getAll({ login: clientLogin }),
+        adminApi.cards.getAll({ client_login: clientLogin })
       ]);
       
       const client = clientsData.find((c: any) => c.login === clientLogin);
@@ -72,25 +70,16 @@ export default function ClientDashboard({ clientLogin, onLogout }: ClientDashboa
         });
       }
       
-      const clientCards = cardsData
-        .filter((card: any) => {
-          const cardClient = clientsData.find((c: any) => c.id === card.client_id);
-          return cardClient?.login === clientLogin;
-        })
-        .map((card: any) => {
-          const fuelType = fuelTypesData.find((ft: any) => ft.id === card.fuel_type_id);
-          const cardClient = clientsData.find((c: any) => c.id === card.client_id);
-          return {
-            id: card.id,
-            card_code: card.card_code,
-            fuel_type: fuelType?.name || '',
-            balance_liters: card.balance_liters,
-            daily_limit: card.daily_limit || 0,
-            status: card.status || 'активна',
-            block_reason: card.block_reason || '',
-            owner: cardClient?.name || ''
-          };
-        });
+      const clientCards = cardsData.map((card: any) => ({
+        id: card.id,
+        card_code: card.card_code,
+        fuel_type: card.fuel_type || '',
+        balance_liters: card.balance_liters,
+        daily_limit: card.daily_limit || 0,
+        status: card.status || 'активна',
+        block_reason: card.block_reason || '',
+        owner: card.client_name || ''
+      }));
       
       setCards(clientCards);
     } catch (error) {
@@ -189,49 +178,20 @@ export default function ClientDashboard({ clientLogin, onLogout }: ClientDashboa
       if (sourceCard && targetCard && sourceCard.balance_liters >= amount) {
         try {
           const avgPrice = 52.50;
-          const dateStr = formatDateForAPI();
-          
-          const debitOperation = {
-            card_code: sourceCard.card_code,
-            station_name: 'Склад',
-            operation_date: dateStr,
-            operation_type: 'списание',
-            quantity: amount,
-            price: avgPrice,
-            amount: amount * avgPrice,
-            comment: `Перемещение на карту ${targetCard.card_code}`
-          };
           
-          const creditOperation = {
-            card_code: targetCard.card_code,
-            station_name: 'Склад',
-            operation_date: dateStr,
-            operation_type: 'оприходование',
+          const result = await adminApi.operations.transfer({
+            source_card_id: selectedCardId,
+            target_card_id: targetCardId,
             quantity: amount,
-            price: avgPrice,
-            amount: amount * avgPrice,
-            comment: `Перемещение с карты ${sourceCard.card_code}`
-          };
-          
-          await Promise.all([
-            adminApi.operations.create(debitOperation),
-            adminApi.operations.create(creditOperation),
-            adminApi.cards.update({
-              id: selectedCardId,
-              balance_liters: sourceCard.balance_liters - amount
-            }),
-            adminApi.cards.update({
-              id: targetCardId,
-              balance_liters: targetCard.balance_liters + amount
-            })
-          ]);
+            price: avgPrice
+          });
           
           setCards(cards.map(card => {
             if (card.id === selectedCardId) {
-              return { ...card, balance_liters: card.balance_liters - amount };
+              return { ...card, balance_liters: result.source.balance_liters };
             }
             if (card.id === targetCardId) {
-              return { ...card, balance_liters: card.balance_liters + amount };
+              return { ...card, balance_liters: result.target.balance_liters };
             }
             return card;
           }));
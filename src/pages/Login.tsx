@@ -5,6 +5,7 @@ import { Input } from '@/components/ui/input';
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card';
 import { Label } from '@/components/ui/label';
 import Icon from '@/components/ui/icon';
+import { setSessionToken } from '@/utils/session';
 
 interface LoginProps {
   onLogin: (login: string, password: string) => void;
@@ -35,6 +36,7 @@ export default function Login({ onLogin }: LoginProps) {
 
       if (response.ok && data.success) {
         localStorage.setItem('user', JSON.stringify(data.user));
+        setSessionToken(data.token);
         sessionStorage.removeItem('fromAdmin');
         
         if (data.user.admin && data.user.operator) {
@@ -4,6 +4,7 @@ import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Card, CardContent } from '@/components/ui/card';
 import Icon from '@/components/ui/icon';
+import { authFetch, getSessionToken, setSessionToken } from '@/utils/session';
 
 const OPERATOR_API = 'https://functions.poehali.dev/63d97170-36d0-4590-bf1f-e247777c20db';
 const AUTH_API = 'https://functions.poehali.dev/9f5ff2f8-a6c2-489f-8a85-40f260bbac9e';
@@ -141,6 +142,7 @@ export default function OperatorPanel() {
 
   const barcodeRef = useRef<HTMLInputElement>(null);
   const quantityRef = useRef<HTMLInputElement>(null);
+  const dispenseKeyRef = useRef<string>('');
 
   useEffect(() => {
     const urlLogin = searchParams.get('login');
@@ -174,6 +176,10 @@ export default function OperatorPanel() {
               setPassword(sp);
               setSelectedStation(st);
               autoLogin(sl, sp, st);
+            } else if (sl && st && getSessionToken()) {
+              setLogin(sl);
+              setSelectedStation(st);
+              resumeSession(st);
             }
           } catch (e) {
             console.warn('operator_session parse error', e);
@@ -193,6 +199,7 @@ export default function OperatorPanel() {
       });
       const data = await res.json();
       if (res.ok && data.success && data.user.admin) {
+        setSessionToken(data.token);
         setSelectedStation(st);
         setStage('scan');
       } else {
@@ -205,6 +212,25 @@ export default function OperatorPanel() {
     }
   };
 
+  const resumeSession = async (st: Station) => {
+    setAuthLoading(true);
+    try {
+      const res = await authFetch(AUTH_API);
+      const data = await res.json();
+      if (res.ok && data.success && data.user.admin) {
+        setSelectedStation(st);
+        setStage('scan');
+      } else {
+        localStorage.removeItem('operator_session');
+        setSessionToken(null);
+      }
+    } catch {
+      localStorage.removeItem('operator_session');
+    } finally {
+      setAuthLoading(false);
+    }
+  };
+
   useEffect(() => {
     if (stage === 'scan') {
       setTimeout(() => barcodeRef.current?.focus(), 50);
@@ -226,8 +252,12 @@ export default function OperatorPanel() {
       });
       const data = await res.json();
       if (res.ok && data.success && data.user.admin) {
+        setSessionToken(data.token);
         if (selectedStation) {
-          localStorage.setItem('operator_session', JSON.stringify({ login, password, stationId: selectedStation.id }));
+          const stored = data.token
+            ? { login, stationId: selectedStation.id }
+            : { login, password, stationId: selectedStation.id };
+          localStorage.setItem('operator_session', JSON.stringify(stored));
         }
         setStage('scan');
       } else if (res.ok && data.success && !data.user.admin) {
@@ -268,7 +298,7 @@ export default function OperatorPanel() {
 
     setCardLoading(true);
     try {
-      const res = await fetch(`${OPERATOR_API}?card_code=${encodeURIComponent(code)}`);
+      const res = await authFetch(`${OPERATOR_API}?card_code=${encodeURIComponent(code)}`);
       const data = await res.json();
       if (res.ok) {
         setCardInfo(data);
@@ -307,17 +337,22 @@ export default function OperatorPanel() {
     setDispenseError('');
     setDispenseLoading(true);
     const qty = parseFloat(quantity.replace(',', '.'));
+    if (!dispenseKeyRef.current) {
+      dispenseKeyRef.current = crypto.randomUUID();
+    }
     try {
-      const res = await fetch(OPERATOR_API, {
+      const res = await authFetch(OPERATOR_API, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
           card_code: cardInfo.card_code,
           quantity: qty,
           station_id: selectedStation.id,
+          idempotency_key: dispenseKeyRef.current,
         }),
       });
       const data = await res.json();
+      dispenseKeyRef.current = '';
       if (res.ok && data.success) {
         setSuccessMsg(`Отпущено ${qty.toFixed(3)} л. Остаток: ${data.new_balance.toFixed(3)} л`);
         setTimeout(() => handleReset(), 4000);
@@ -334,6 +369,7 @@ export default function OperatorPanel() {
   };
 
   const handleReset = () => {
+    dispenseKeyRef.current = '';
     setBarcode('');
     setCardInfo(null);
     setCardError('');
@@ -472,7 +508,7 @@ export default function OperatorPanel() {
           </div>
           <Button
             variant="outline"
-            onClick={() => { localStorage.removeItem('operator_session'); navigate('/'); }}
+            onClick={() => { localStorage.removeItem('operator_session'); setSessionToken(null); navigate('/'); }}
             className="border-2 border-accent text-accent hover:bg-accent hover:text-accent-foreground font-bold px-6"
           >
             <Icon name="LogOut" size={16} className="mr-2" />
@@ -1,3 +1,5 @@
+import { authFetch } from '@/utils/session';
+
 const API_URLS = {
   clients: 'https://functions.poehali.dev/5d6b9503-f733-4035-8881-786d1f28023b',
   stations: 'https://functions.poehali.dev/80fb772c-a848-45ed-84c5-780c2b3e690c',
@@ -6,11 +8,36 @@ const API_URLS = {
   operations: 'https://functions.poehali.dev/85e04362-ba57-45bf-8226-8b92c7bea08d',
 };
 
+const fetchOperationsPage = async (params: Record<string, string | number> = {}) => {
+  const query = new URLSearchParams(
+    Object.entries(params).map(([key, value]) => [key, String(value)])
+  ).toString();
+  const response = await authFetch(query ? `${API_URLS.operations}?${query}` : API_URLS.operations);
+  const data = await response.json();
+  return {
+    operations: data.operations || [],
+    nextCursor: (data.next_cursor as string | null) || null
+  };
+};
+
+const fetchCardsPage = async (params: Record<string, string | number> = {}) => {
+  const query = new URLSearchParams(
+    Object.entries(params).map(([key, value]) => [key, String(value)])
+  ).toString();
+  const response = await authFetch(query ? `${API_URLS.cards}?${query}` : API_URLS.cards);
+  const data = await response.json();
+  return {
+    cards: data.cards || [],
+    nextAfterId: (data.next_after_id as number | null) || null
+  };
+};
+
 export const adminApi = {
   clients: {
-    getAll: async () => {
+    getAll: async (params: Record<string, string> = {}) => {
+      const query = new URLSearchParams(params).toString();
       try {
-        const response = await fetch(API_URLS.clients);
+        const response = await authFetch(query ? `${API_URLS.clients}?${query}` : API_URLS.clients);
         if (!response.ok) {
           console.error('Fetch error:', response.status, response.statusText);
           throw new Error(`HTTP error! status: ${response.status}`);
@@ -23,7 +50,7 @@ export const adminApi = {
       }
     },
     create: async (client: any) => {
-      const response = await fetch(API_URLS.clients, {
+      const response = await authFetch(API_URLS.clients, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(client)
@@ -36,14 +63,14 @@ export const adminApi = {
       return response.json();
     },
     update: async (client: any) => {
-      await fetch(API_URLS.clients, {
+      await authFetch(API_URLS.clients, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(client)
       });
     },
     delete: async (id: number) => {
-      await fetch(`${API_URLS.clients}?id=${id}`, {
+      await authFetch(`${API_URLS.clients}?id=${id}`, {
         method: 'DELETE'
       });
     }
@@ -51,26 +78,26 @@ export const adminApi = {
 
   stations: {
     getAll: async () => {
-      const response = await fetch(API_URLS.stations);
+      const response = await authFetch(API_URLS.stations);
       const data = await response.json();
       return data.stations || [];
     },
     create: async (station: any) => {
-      await fetch(API_URLS.stations, {
+      await authFetch(API_URLS.stations, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(station)
       });
     },
     update: async (station: any) => {
-      await fetch(API_URLS.stations, {
+      await authFetch(API_URLS.stations, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(station)
       });
     },
     delete: async (id: number) => {
-      await fetch(`${API_URLS.stations}?id=${id}`, {
+      await authFetch(`${API_URLS.stations}?id=${id}`, {
         method: 'DELETE'
       });
     }
@@ -78,46 +105,54 @@ export const adminApi = {
 
   fuelTypes: {
     getAll: async () => {
-      const response = await fetch(API_URLS.fuelTypes);
+      const response = await authFetch(API_URLS.fuelTypes);
       const data = await response.json();
       return data.fuel_types || [];
     },
     create: async (fuelType: any) => {
-      await fetch(API_URLS.fuelTypes, {
+      await authFetch(API_URLS.fuelTypes, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(fuelType)
       });
     },
     update: async (fuelType: any) => {
-      await fetch(API_URLS.fuelTypes, {
+      await authFetch(API_URLS.fuelTypes, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(fuelType)
       });
     },
     delete: async (id: number) => {
-      await fetch(`${API_URLS.fuelTypes}?id=${id}`, {
+      await authFetch(`${API_URLS.fuelTypes}?id=${id}`, {
         method: 'DELETE'
       });
     }
   },
 
   cards: {
-    getAll: async () => {
-      const response = await fetch(API_URLS.cards);
-      const data = await response.json();
-      return data.cards || [];
+    getPage: fetchCardsPage,
+    // Все карты по фильтру — только для выборок одного клиента (client_login, client_id);
+    // общий список администратора загружается постранично через getPage
+    getAll: async (params: Record<string, string | number>) => {
+      const cards: any[] = [];
+      let afterId: number | null = null;
+      do {
+        const page = await fetchCardsPage({ ...params, limit: 1000, ...(afterId ? { after_id: afterId } : {}) });
+        cards.push(...page.cards);
+        afterId = page.nextAfterId;
+      } while (afterId);
+      return cards;
     },
     create: async (card: any) => {
-      await fetch(API_URLS.cards, {
+      await authFetch(API_URLS.cards, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(card)
       });
     },
     update: async (card: any) => {
-      const response = await fetch(API_URLS.cards, {
+      const response = await authFetch(API_URLS.cards, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(card)
@@ -130,34 +165,66 @@ export const adminApi = {
       return response.json();
     },
     delete: async (id: number) => {
-      await fetch(`${API_URLS.cards}?id=${id}`, {
+      await authFetch(`${API_URLS.cards}?id=${id}`, {
         method: 'DELETE'
       });
     }
   },
 
   operations: {
-    getAll: async () => {
-      const response = await fetch(API_URLS.operations);
+    getPage: fetchOperationsPage,
+    // Полная история одной карты (пересчет баланса, страница карты); общий журнал операций
+    // загружается постранично через getPage
+    getCardHistory: async (cardId: number) => {
+      const operations: any[] = [];
+      let cursor: string | null = null;
+      do {
+        const params = { card_id: cardId, limit: 1000 };
+        const page = await fetchOperationsPage(cursor ? { ...params, cursor } : params);
+        operations.push(...page.operations);
+        cursor = page.nextCursor;
+      } while (cursor);
+      return operations;
+    },
+    getSummary: async (params: Record<string, string | number> = {}) => {
+      const query = new URLSearchParams(
+        Object.entries({ ...params, report: 'summary' }).map(([key, value]) => [key, String(value)])
+      ).toString();
+      const response = await authFetch(`${API_URLS.operations}?${query}`);
       const data = await response.json();
-      return data.operations || [];
+      if (!response.ok) {
+        throw new Error(data.error || `HTTP error! status: ${response.status}`);
+      }
+      return data.summary || [];
     },
     create: async (operation: any) => {
-      await fetch(API_URLS.operations, {
+      await authFetch(API_URLS.operations, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(operation)
       });
     },
+    transfer: async (transfer: { source_card_id: number; target_card_id: number; quantity: number; price: number }) => {
+      const response = await authFetch(API_URLS.operations, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ action: 'transfer', ...transfer })
+      });
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || `HTTP error! status: ${response.status}`);
+      }
+      return data;
+    },
     update: async (operation: any) => {
-      await fetch(API_URLS.operations, {
+      await authFetch(API_URLS.operations, {
         method: 'PUT',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(operation)
       });
     },
     delete: async (id: number) => {
-      await fetch(`${API_URLS.operations}?id=${id}`, {
+      await authFetch(`${API_URLS.operations}?id=${id}`, {
         method: 'DELETE'
       });
     }
@@ -0,0 +1,21 @@
+const SESSION_TOKEN_KEY = 'session_token';
+
+export const getSessionToken = (): string | null => localStorage.getItem(SESSION_TOKEN_KEY);
+
+export const setSessionToken = (token?: string | null) => {
+  if (token) {
+    localStorage.setItem(SESSION_TOKEN_KEY, token);
+  } else {
+    localStorage.removeItem(SESSION_TOKEN_KEY);
+  }
+};
+
+export const authFetch = (input: string, init: RequestInit = {}) => {
+  const token = getSessionToken();
+  if (!token) {
+    return fetch(input, init);
+  }
+  const headers = new Headers(init.headers);
+  headers.set('X-Auth-Token', token);
+  return fetch(input, { ...init, headers });
+};